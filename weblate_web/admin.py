@@ -82,6 +82,9 @@ class ServiceAdmin(admin.ModelAdmin):
         "site_version",
     )
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_subscription_index()
+
 
 class SubscriptionPastPaymentInline(admin.TabularInline):
     model = SubscriptionPastPayment
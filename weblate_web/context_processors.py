@@ -17,21 +17,18 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 #
 
+from functools import lru_cache, partial
 from math import ceil
+from typing import Any
 
 from django.conf import settings
-from django.urls import reverse
+from django.urls import get_script_prefix, get_urlconf, reverse
 from django.utils import timezone
 from django.utils.functional import SimpleLazyObject
 from django.utils.translation import get_language, override
 
 from weblate_web.invoices.models import BANK_ACCOUNTS, Currency
-from weblate_web.models import (
-    Package,
-    PackageCategory,
-    Service,
-    get_donation_reward_package_name,
-)
+from weblate_web.models import get_donate_links, get_hosting_packages
 from weblate_web.remote import get_activity, get_changes, get_contributors, get_release
 from weblate_web.schema import get_site_schema
 
@@ -51,20 +48,18 @@ from .const import (
 )
 
 
-def weblate_web(request):
-    if request.resolver_match and request.resolver_match.url_name:
-        match = request.resolver_match
-        url_name = ":".join([*match.namespaces, match.url_name])
-        url_kwargs = match.kwargs
-    else:
-        url_name = "home"
-        url_kwargs = {}
-
+def build_language_urls(
+    url_name: str,
+    url_kwargs: dict[str, Any],
+    script_prefix: str,
+    urlconf: str | None,
+) -> tuple[str, tuple[dict[str, str], ...]]:
+    """Build canonical and per-language URLs for a view."""
     # Get canonical URl, unfortunately there seems to be no clean
     # way, so just strip /en/ from the URL
     # See also https://stackoverflow.com/a/27727877/225718
     with override("en"):
-        canonical_url = reverse(url_name, kwargs=url_kwargs)
+        canonical_url = reverse(url_name, kwargs=url_kwargs, urlconf=urlconf)
         if canonical_url.startswith("/en/"):
             canonical_url = canonical_url[3:]
 
@@ -75,39 +70,87 @@ def weblate_web(request):
                 {
                     "name": name,
                     "code": code,
-                    "url": reverse(url_name, kwargs=url_kwargs),
+                    "url": reverse(url_name, kwargs=url_kwargs, urlconf=urlconf),
                 }
             )
 
-    language_col = ceil(len(settings.LANGUAGES) / 3)
+    return canonical_url, tuple(language_urls)
+
+
+@lru_cache(maxsize=1024)
+def get_language_urls(
+    url_name: str,
+    url_kwargs: tuple[tuple[str, str | int], ...],
+    script_prefix: str,
+    urlconf: str | None,
+) -> tuple[str, tuple[dict[str, str], ...]]:
+    """
+    Return memoized canonical and per-language URLs for a view.
+
+    The result only depends on the arguments, so it is memoized
+    to avoid reversing the URL for every language on each request.
+    """
+    return build_language_urls(url_name, dict(url_kwargs), script_prefix, urlconf)
+
+
+def is_hashable(value: object) -> bool:
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+
+def get_activity_sum() -> int:
+    # Passed as a callable so that the template evaluates it only when used
+    return sum(get_activity()[-7:])
+
+
+def get_site_schema_json_ld(language: str | None) -> list[dict[str, Any]]:
+    return [get_site_schema(language)]
+
+
+def weblate_web(request):
+    if request.resolver_match and request.resolver_match.url_name:
+        match = request.resolver_match
+        url_name = ":".join([*match.namespaces, match.url_name])
+        url_kwargs = match.kwargs
+    else:
+        url_name = "home"
+        url_kwargs = {}
+
+    hashable_kwargs = tuple(sorted(url_kwargs.items()))
+    if is_hashable(hashable_kwargs):
+        canonical_url, cached_urls = get_language_urls(
+            url_name, hashable_kwargs, get_script_prefix(), get_urlconf()
+        )
+    else:
+        # Some views get extra arguments, for example the sitemaps dict
+        canonical_url, cached_urls = build_language_urls(
+            url_name, url_kwargs, get_script_prefix(), get_urlconf()
+        )
+    # Copy the cached data, so that it can not be modified by the view
+    language_urls = [dict(language_url) for language_url in cached_urls]
+    language_col = ceil(len(language_urls) / 3)
+    language_columns = [
+        language_urls[:language_col],
+        language_urls[language_col : language_col * 2],
+        language_urls[language_col * 2 :],
+    ]
 
     return {
         "downloads": SimpleLazyObject(get_release),
         "canonical_url": canonical_url,
         "language_urls": language_urls,
         "is_fosdem": False,
-        "donate_links": Service.objects.donations()
-        .filter(
-            subscription__package__name=get_donation_reward_package_name(3),
-            subscription__enabled=True,
-            subscription__expires__gte=timezone.now(),
-        )
-        .distinct(),
-        "activity_sum": sum(get_activity()[-7:]),
+        "donate_links": SimpleLazyObject(get_donate_links),
+        "activity_sum": get_activity_sum,
         "contributors": SimpleLazyObject(get_contributors),
         "changes": SimpleLazyObject(get_changes),
         "bank_account": BANK_ACCOUNTS[Currency.EUR],
         "today": timezone.now(),
-        "hosting_packages": Package.objects.filter(
-            category=PackageCategory.PACKAGE_SHARED
-        )
-        .filter(name__regex="^hosted:[0-9.]+[km]$")
-        .order_by("price")[:6],
-        "language_columns": [
-            language_urls[:language_col],
-            language_urls[language_col : language_col * 2],
-            language_urls[language_col * 2 :],
-        ],
+        "hosting_packages": SimpleLazyObject(get_hosting_packages),
+        "language_columns": language_columns,
         "company_name": COMPANY_NAME,
         "company_address": COMPANY_ADDRESS,
         "company_zip": COMPANY_ZIP,
@@ -123,5 +166,7 @@ def weblate_web(request):
         "company_id": COMPANY_ID,
         "company_duns": COMPANY_DUNS,
         "company_pic": COMPANY_PIC,
-        "schema_json_ld": [get_site_schema(get_language())],
+        "schema_json_ld": SimpleLazyObject(
+            partial(get_site_schema_json_ld, get_language())
+        ),
     }
@@ -2,23 +2,30 @@ from __future__ import annotations
 
 import os
 from dataclasses import dataclass
+from time import time_ns
 from typing import TYPE_CHECKING, Any
 
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.files.storage import FileSystemStorage
 from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
-from weblate_web.payments.models import Customer
+from weblate_web.invoices.models import Invoice
+from weblate_web.models import Service, Subscription
+from weblate_web.payments.models import Customer, CustomerFollowUp, Payment
 
 if TYPE_CHECKING:
     from collections.abc import Callable
 
 CRM_STORAGE = FileSystemStorage(location=settings.CRM_ROOT)
+WORK_QUEUE_GENERATION_KEY = "crm-work-queue-generation"
 
 
 @dataclass(frozen=True)
@@ -251,3 +258,33 @@ class ZammadSyncLog(models.Model):
 
     def __str__(self):
         return f"{self.customer}: {self.article_id}"
+
+
+@receiver(post_save, sender=Customer)
+@receiver(post_delete, sender=Customer)
+@receiver(post_save, sender=CustomerFollowUp)
+@receiver(post_delete, sender=CustomerFollowUp)
+@receiver(post_save, sender=Invoice)
+@receiver(post_delete, sender=Invoice)
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+@receiver(post_save, sender=Service)
+@receiver(post_delete, sender=Service)
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def invalidate_work_queue(sender, **kwargs) -> None:
+    """Invalidate all cached CRM work queues by bumping the cache generation."""
+    try:
+        cache.incr(WORK_QUEUE_GENERATION_KEY)
+    except ValueError:
+        # The key was evicted, restart from the clock so that generations
+        # used before the eviction are never reused
+        cache.set(WORK_QUEUE_GENERATION_KEY, time_ns(), timeout=None)
+
+
+def get_work_queue_generation() -> int:
+    """Return the current CRM work queue cache generation."""
+    seed = time_ns()
+    if cache.add(WORK_QUEUE_GENERATION_KEY, seed, timeout=None):
+        return seed
+    return cache.get(WORK_QUEUE_GENERATION_KEY, seed)
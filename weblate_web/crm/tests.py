@@ -15,14 +15,25 @@ from django.core.files.base import ContentFile
 from django.core.management import call_command
 from django.core.management.base import OutputWrapper
 from django.core.signing import dumps, loads
+from django.db import connection
 from django.test import TestCase
-from django.test.utils import override_settings
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.urls import reverse
 from django.utils import timezone
 
 from weblate_web.crm.hosted import USER_ENSURE_RESPONSE_SALT, USER_ENSURE_SALT
-from weblate_web.crm.models import Interaction, ZammadSyncLog
+from weblate_web.crm.models import (
+    WORK_QUEUE_GENERATION_KEY,
+    Interaction,
+    ZammadSyncLog,
+    get_work_queue_generation,
+    invalidate_work_queue,
+)
 from weblate_web.crm.views import IncomeView
+from weblate_web.crm.workqueue import (
+    get_crm_work_items,
+    get_expired_service_subscriptions,
+)
 from weblate_web.exchange_rates import ExchangeRates
 from weblate_web.invoices.models import (
     Currency,
@@ -276,6 +287,7 @@ class CRMFollowUpTestCase(BaseCRMTestCase):
     user: User
 
     def setUp(self):
+        cache.clear()
         self.user = User.objects.create_superuser(
             username="admin", email="admin@example.com"
         )
@@ -520,6 +532,7 @@ class CRMWorkQueueTestCase(BaseCRMTestCase):
     user: User
 
     def setUp(self):
+        cache.clear()
         self.user = User.objects.create_superuser(
             username="admin", email="admin@example.com"
         )
@@ -720,6 +733,38 @@ class CRMWorkQueueTestCase(BaseCRMTestCase):
         self.assertContains(response, expired_service.customer.name)
         self.assertNotContains(response, active_service.customer.name)
 
+    def test_work_queue_skips_obsolete_and_non_repeating_services(self):
+        expired = timezone.now() - timedelta(days=1)
+        obsolete_service = self.create_queue_service(
+            "OBSOLETE SERVICE CUSTOMER", expires=expired
+        )
+        obsolete_service.subscription_set.create(
+            package=Package.objects.create(
+                name="extended",
+                verbose="Extended support",
+                price=600,
+                category=PackageCategory.PACKAGE_SUPPORT,
+            ),
+            expires=timezone.now() + timedelta(days=30),
+        )
+        one_time_service = self.create_queue_service(
+            "ONE TIME SERVICE CUSTOMER", expires=expired
+        )
+        one_time_service.subscription_set.update(
+            package=Package.objects.create(name="one-time", price=100)
+        )
+        expired_service = self.create_queue_service(
+            "EXPIRED SERVICE CUSTOMER", expires=expired
+        )
+
+        self.assertEqual(
+            [
+                subscription.service
+                for subscription in get_expired_service_subscriptions()
+            ],
+            [expired_service],
+        )
+
     def test_work_queue_service_items_require_detail_permission(self):
         service = self.create_queue_service(
             "SERVICE VIEW-ONLY CUSTOMER", expires=timezone.now() - timedelta(days=1)
@@ -816,6 +861,91 @@ class CRMWorkQueueTestCase(BaseCRMTestCase):
 
         self.assertContains(response, customers[10].name)
 
+    def test_work_queue_cached_until_invalidated(self):
+        customer = self.create_customer("CACHED QUEUE CUSTOMER")
+        followup = self.create_followup(
+            customer,
+            follow_up_at=timezone.now() - timedelta(hours=1),
+            note="Cached note",
+        )
+
+        items = get_crm_work_items(self.user)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_crm_work_items(self.user), items)
+
+        # Queryset updates do not emit signals, so the cached item stays
+        CustomerFollowUp.objects.filter(pk=followup.pk).update(note="Stale note")
+        response = self.client.get(reverse("crm:work-queue"))
+        self.assertContains(response, "Cached note")
+
+        followup.note = "Updated note"
+        followup.save()
+        response = self.client.get(reverse("crm:work-queue"))
+        self.assertContains(response, "Updated note")
+
+        followup.delete()
+        response = self.client.get(reverse("crm:work-queue"))
+        self.assertNotContains(response, customer.name)
+
+        invoice = self.create_queue_invoice("CACHED INVOICE CUSTOMER", age_days=8)
+        response = self.client.get(reverse("crm:work-queue"))
+        self.assertContains(response, invoice.number)
+
+        Payment.objects.create(
+            customer=invoice.customer,
+            amount=100,
+            description="Processed invoice payment",
+            paid_invoice=invoice,
+            state=Payment.PROCESSED,
+        )
+        response = self.client.get(reverse("crm:work-queue"))
+        self.assertNotContains(response, invoice.number)
+
+        service = self.create_queue_service(
+            "CACHED SERVICE CUSTOMER", expires=timezone.now() - timedelta(days=1)
+        )
+        response = self.client.get(reverse("crm:work-queue"))
+        self.assertContains(response, service.customer.name)
+
+        service.subscription_set.get().delete()
+        response = self.client.get(reverse("crm:work-queue"))
+        self.assertNotContains(response, service.customer.name)
+
+    def test_work_queue_invalidated_by_customer_and_service(self):
+        customer = self.create_customer("RENAMED QUEUE CUSTOMER")
+        self.create_followup(customer, follow_up_at=timezone.now() - timedelta(hours=1))
+        response = self.client.get(reverse("crm:work-queue"))
+        self.assertContains(response, "RENAMED QUEUE CUSTOMER")
+
+        customer.name = "UPDATED QUEUE CUSTOMER"
+        customer.save()
+        response = self.client.get(reverse("crm:work-queue"))
+        self.assertContains(response, "UPDATED QUEUE CUSTOMER")
+
+        service = self.create_queue_service(
+            "SERVICE QUEUE CUSTOMER", expires=timezone.now() - timedelta(days=1)
+        )
+        response = self.client.get(reverse("crm:work-queue"))
+        self.assertContains(response, service.customer.name)
+
+        # Queryset updates do not emit signals, saving the service refreshes
+        service.subscription_set.update(expires=timezone.now() + timedelta(days=30))
+        service.save()
+        response = self.client.get(reverse("crm:work-queue"))
+        self.assertNotContains(response, service.customer.name)
+
+    def test_work_queue_generation_survives_eviction(self):
+        generation = get_work_queue_generation()
+        self.assertEqual(get_work_queue_generation(), generation)
+
+        cache.delete(WORK_QUEUE_GENERATION_KEY)
+        invalidate_work_queue(sender=Customer)
+        self.assertGreater(get_work_queue_generation(), generation)
+
+        generation = get_work_queue_generation()
+        cache.delete(WORK_QUEUE_GENERATION_KEY)
+        self.assertGreater(get_work_queue_generation(), generation)
+
 
 class CRMQuoteStatusTestCase(BaseCRMTestCase):
     user: User
@@ -2544,7 +2674,8 @@ class IncomeTrackingTestCase(BaseCRMTestCase):
         years = [2023, 2024, 2025]
         current_date = date(2025, 6, 30)
 
-        with self.assertNumQueries(2):
+        # Exchange rate dates, payments and invoices
+        with self.assertNumQueries(3):
             rows = view.get_annual_trend_rows(years, current_date)
         with self.assertNumQueries(0):
             cached_rows = view.get_annual_trend_rows(years, current_date)
@@ -3426,6 +3557,40 @@ class IncomeTrackingTestCase(BaseCRMTestCase):
         self.assertNotContains(response, "Hosted 10k")
         self.assertNotContains(response, "Basic Support")
 
+    def test_service_list_package_kind_order(self):
+        Package.objects.create(name="community", price=0)
+        customer = self.create_customer()
+        backup = Package.objects.create(name="backup", verbose="Backup", price=10)
+        extended = Package.objects.create(
+            name="extended",
+            verbose="Extended support",
+            price=100,
+            category=PackageCategory.PACKAGE_SUPPORT,
+        )
+        url = reverse("crm:service-list", kwargs={"kind": "all"})
+
+        def create_services() -> None:
+            for package in (extended, backup, None):
+                service = Service.objects.create(customer=customer)
+                if package is not None:
+                    service.subscription_set.create(
+                        package=package, expires=timezone.now() + timedelta(days=30)
+                    )
+
+        create_services()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(
+            [service.package_kind for service in response.context["object_list"]],
+            ["Backup", "Community support", "Support"],
+        )
+
+        create_services()
+        with CaptureQueriesContext(connection) as more_queries:
+            response = self.client.get(url)
+        self.assertEqual(len(response.context["object_list"]), 6)
+        self.assertEqual(len(more_queries), len(queries))
+
     def test_service_detail_upgrade_invoice(self):
         Package.objects.create(name="community", price=0)
         current = Package.objects.create(
@@ -4,7 +4,6 @@ import calendar
 import math
 from datetime import date, datetime, time, timedelta
 from decimal import Decimal
-from operator import attrgetter
 from typing import TYPE_CHECKING, ClassVar, Literal, TypeAlias, TypedDict, cast
 
 from django.contrib import messages
@@ -95,6 +94,7 @@ from weblate_web.utils import show_form_errors
 from .models import Interaction
 
 if TYPE_CHECKING:
+    from collections.abc import Iterable
     from uuid import UUID
 
     from django.http import HttpRequest
@@ -188,6 +188,7 @@ class ServiceListView(CRMMixin, ListView[Service]):  # type: ignore[misc]
     permission = "weblate_web.view_service"
     title = "Services"
     template_name = "weblate_web/service_list.html"
+    paginate_by = 100
 
     def get_title(self) -> str:
         match self.kwargs["kind"]:
@@ -209,31 +210,52 @@ class ServiceListView(CRMMixin, ListView[Service]):  # type: ignore[misc]
         return context
 
     def get_queryset(self):
-        qs = Service.objects.customer_services().prefetch_related("subscription_set")
+        qs = (
+            Service.objects.customer_services()
+            .select_related("customer")
+            .with_subscription_index()
+        )
         match self.kwargs["kind"]:
             case "all":
-                return sorted(qs, key=attrgetter("package_kind"))
+                return qs.with_package_kind().order_by(
+                    "package_kind_label", "site_title", "site_url", "pk"
+                )
             case "expired":
-                expired = qs.filter(pk__in=get_expired_service_ids()).distinct()
-                return sorted(expired, key=attrgetter("package_kind"))
+                return (
+                    qs.filter(pk__in=get_expired_service_ids())
+                    .with_package_kind()
+                    .order_by("package_kind_label", "site_title", "site_url", "pk")
+                )
             case "extended":
-                return qs.filter(
-                    subscription__expires__gte=timezone.now(),
-                    subscription__package__name="extended",
-                    subscription__enabled=True,
-                ).distinct()
+                return (
+                    qs.filter(
+                        subscription__expires__gte=timezone.now(),
+                        subscription__package__name="extended",
+                        subscription__enabled=True,
+                    )
+                    .distinct()
+                    .order()
+                )
             case "dedicated":
-                return qs.filter(
-                    subscription__package__category=PackageCategory.PACKAGE_DEDICATED,
-                    subscription__expires__gte=timezone.now(),
-                    subscription__enabled=True,
-                ).distinct()
+                return (
+                    qs.filter(
+                        subscription__package__category=PackageCategory.PACKAGE_DEDICATED,
+                        subscription__expires__gte=timezone.now(),
+                        subscription__enabled=True,
+                    )
+                    .distinct()
+                    .order()
+                )
             case "premium":
-                return qs.filter(
-                    subscription__package__name="premium",
-                    subscription__expires__gte=timezone.now(),
-                    subscription__enabled=True,
-                ).distinct()
+                return (
+                    qs.filter(
+                        subscription__package__name="premium",
+                        subscription__expires__gte=timezone.now(),
+                        subscription__enabled=True,
+                    )
+                    .distinct()
+                    .order()
+                )
         raise ValueError(self.kwargs["kind"])
 
 
@@ -1543,6 +1565,10 @@ class IncomeView(CRMMixin, TemplateView):  # type: ignore[misc]
             rate_cache[key] = ExchangeRates.get(currency, rate_date)
         return rate_cache[key]
 
+    def _preload_exchange_rates(self, rate_dates: Iterable[date]) -> None:
+        """Load exchange rates for the whole report using minimal number of requests."""
+        ExchangeRates.resolve(rate_dates)
+
     def _convert_to_eur(
         self, amount: Decimal, currency: str, rate_date: date
     ) -> Decimal:
@@ -1652,6 +1678,9 @@ class IncomeView(CRMMixin, TemplateView):  # type: ignore[misc]
             ),
         )
 
+        self._preload_exchange_rates(
+            row["tax_date"] for row in raw_rows if row["currency"] != Currency.EUR
+        )
         return [
             {
                 "pk": row["pk"],
@@ -1815,9 +1844,19 @@ class IncomeView(CRMMixin, TemplateView):  # type: ignore[misc]
             ).select_related("package", "service")
         }
 
+        payment_dates = {
+            payment.pk: timezone.localtime(payment.created).date()
+            for payment in payments
+        }
+        self._preload_exchange_rates(
+            payment_dates[payment.pk]
+            for payment in payments
+            if payment.currency != Payment.CURRENCY_EUR
+        )
+
         summary_rows: list[IncomeSummaryRow] = []
         for payment in payments:
-            payment_date = timezone.localtime(payment.created).date()
+            payment_date = payment_dates[payment.pk]
             summary_rows.append(
                 {
                     "pk": payment.pk,
@@ -1902,6 +1941,13 @@ class IncomeView(CRMMixin, TemplateView):  # type: ignore[misc]
             .select_related("customer")
         )
 
+        # Dates are in the current time zone, same as timezone.localtime
+        self._preload_exchange_rates(
+            query.exclude(currency=Payment.CURRENCY_EUR)
+            .order_by()
+            .values_list("created__date", flat=True)
+            .distinct()
+        )
         totals: dict[int, Decimal] = {}
         for payment in query.iterator():
             payment_date = timezone.localtime(payment.created).date()
@@ -22,10 +22,13 @@ from dataclasses import dataclass
 from datetime import date, datetime, time, timedelta
 from typing import TYPE_CHECKING
 
+from django.core.cache import cache
 from django.db.models import Q
 from django.utils import timezone
+from django.utils.translation import get_language
 from django.utils.translation import gettext as _
 
+from weblate_web.crm.models import get_work_queue_generation
 from weblate_web.invoices.models import Invoice, InvoiceKind, QuoteStatus
 from weblate_web.models import Subscription
 from weblate_web.payments.models import CustomerFollowUp, Payment
@@ -38,6 +41,9 @@ if TYPE_CHECKING:
 UNPAID_INVOICE_FOLLOW_UP_DAYS = 7
 STALE_QUOTE_FOLLOW_UP_DAYS = 14
 DASHBOARD_WORK_QUEUE_LIMIT = 10
+# Items depend on the current time as well, so the cache expires even without
+# any model changes
+WORK_QUEUE_CACHE_TIMEOUT = 300
 
 WORK_QUEUE_GROUP_FOLLOWUPS = "followups"
 WORK_QUEUE_GROUP_BILLING = "billing"
@@ -104,40 +110,63 @@ def get_stale_quote_queryset() -> QuerySet[Invoice]:
     )
 
 
-def get_expired_service_subscriptions() -> list[Subscription]:
-    possible_subscriptions = (
+def get_expired_service_queryset() -> QuerySet[Subscription]:
+    return (
         Subscription.objects.customer_services()
         .filter(expires__lte=timezone.now(), enabled=True)
         .exclude(payment=None)
+        .repeating()
+        .exclude_obsolete()
+    )
+
+
+def get_expired_service_subscriptions() -> QuerySet[Subscription]:
+    return (
+        get_expired_service_queryset()
         .select_related("package", "service", "service__customer")
         .order_by("expires", "service__customer__name", "pk")
     )
-    subscriptions = []
-    for subscription in possible_subscriptions:
-        if not subscription.package.get_repeat():
-            continue
-        if subscription.could_be_obsolete():
-            continue
-        subscriptions.append(subscription)
-    return subscriptions
 
 
-def get_expired_service_ids() -> list[int]:
-    return [
-        subscription.service_id for subscription in get_expired_service_subscriptions()
-    ]
+def get_expired_service_ids() -> QuerySet[Subscription]:
+    return get_expired_service_queryset().values("service_id")
+
+
+def get_work_queue_cache_key(permissions: tuple[bool, bool, bool]) -> str:
+    generation = get_work_queue_generation()
+    flags = "".join(str(int(permission)) for permission in permissions)
+    return f"crm-work-queue-{generation}-{get_language()}-{flags}"
 
 
 def get_crm_work_items(user: User) -> list[CRMWorkItem]:
-    items: list[CRMWorkItem] = []
-    if user.has_perm("payments.view_customer"):
+    """
+    Build work queue items visible to the user.
+
+    The result is cached per permission combination and invalidated by
+    crm.models.invalidate_work_queue.
+    """
+    permissions = (
+        user.has_perm("payments.view_customer"),
+        user.has_perm("invoices.view_invoice"),
+        user.has_perm("weblate_web.change_service"),
+    )
+    cache_key = get_work_queue_cache_key(permissions)
+    items: list[CRMWorkItem] | None = cache.get(cache_key)
+    if items is not None:
+        return items
+
+    items = []
+    view_customer, view_invoice, change_service = permissions
+    if view_customer:
         items.extend(get_customer_follow_up_items())
-    if user.has_perm("invoices.view_invoice"):
+    if view_invoice:
         items.extend(get_invoice_follow_up_items())
         items.extend(get_quote_follow_up_items())
-    if user.has_perm("weblate_web.change_service"):
+    if change_service:
         items.extend(get_service_follow_up_items())
-    return sorted(items, key=lambda item: item.sort_key)
+    items.sort(key=lambda item: item.sort_key)
+    cache.set(cache_key, items, timeout=WORK_QUEUE_CACHE_TIMEOUT)
+    return items
 
 
 def get_crm_work_queue_sections(user: User) -> list[CRMWorkQueueSection]:
@@ -5,16 +5,29 @@ import json
 import logging
 from decimal import Decimal, InvalidOperation
 from pathlib import Path
-from typing import ClassVar
+from typing import TYPE_CHECKING, Any, ClassVar
 
 import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
 
 logger = logging.getLogger(__name__)
 RATE_URL = "https://api.cnb.cz/cnbapi/exrates/daily"
 BTC_RATE_URL = "https://api.exchange.coinbase.com/products/BTC-EUR/candles"
-CACHE_DIR = Path.home() / ".cache" / "fakturace"
 EXCHANGE_MARKUP = Decimal("1.1")
 BTC_GRANULARITY = 86400
+# Number of previous days to try when rates are not available
+FALLBACK_DAYS = 5
+# Cache timeout for dates without rates and rates which are not final yet
+MISSING_CACHE_TIMEOUT = 3600
+# Currencies with precomputed conversion from EUR
+CONVERSION_CURRENCIES = ("CZK", "USD", "GBP")
+CONVERSION_CACHE_TIMEOUT = 2 * 86400
 
 
 class DecimalEncoder(json.JSONEncoder):
@@ -30,14 +43,25 @@ class InvalidDataError(Exception):
 
 class UncachedExchangeRates:
     @classmethod
-    def download(cls, date: str) -> dict[str, Decimal]:
+    def fetch(cls, date: str) -> tuple[str, dict[str, Decimal]]:
+        """Download rates, returns date they were published for and the rates."""
         response = requests.get(RATE_URL, params={"date": date}, timeout=10)
         response.raise_for_status()
         try:
             payload = json.loads(response.text, parse_float=Decimal)
         except json.JSONDecodeError as error:
             raise InvalidDataError(str(error)) from error
-        return {item["currencyCode"]: item["rate"] for item in payload["rates"]}
+        if not payload["rates"]:
+            raise InvalidDataError(f"Rate response has no rates for {date}")
+        # CNB returns last published rates for days without rates
+        valid_for = payload["rates"][0].get("validFor", date)
+        return valid_for, {
+            item["currencyCode"]: item["rate"] for item in payload["rates"]
+        }
+
+    @classmethod
+    def download(cls, date: str) -> dict[str, Decimal]:
+        return cls.fetch(date)[1]
 
     @classmethod
     def download_btc(cls, date: str) -> Decimal:
@@ -82,23 +106,41 @@ class UncachedExchangeRates:
         raise InvalidDataError(f"BTC rate response has no candle for {date}")
 
     @classmethod
-    def get(cls, currency: str, date: datetime.date, *, recursion: int = 0) -> Decimal:
-        date_iso = date.isoformat()
+    # ruff:ignore[unused-class-method-argument]
+    def is_missing(cls, currency: str, date: str) -> bool:
+        return False
+
+    @classmethod
+    # ruff:ignore[unused-class-method-argument]
+    def mark_missing(cls, currency: str, date: str) -> None:
+        return
+
+    @classmethod
+    def get_rate(cls, currency: str, date: str) -> Decimal:
+        if currency == "BTC":
+            return cls.download_btc(date)
+        return cls.download(date)[currency]
+
+    @classmethod
+    def get(cls, currency: str, date: datetime.date) -> Decimal:
         if currency == "CZK":
             return Decimal(1)
-        try:
-            if currency == "BTC":
-                return cls.download_btc(date_iso)
-            rates = cls.download(date_iso)
-        except (requests.RequestException, InvalidDataError):
-            logger.exception("failed to fetch exchange rate data")
-            if recursion > 4:
-                raise
-            # Fallback on previous day if data is not available
-            return cls.get(
-                currency, date - datetime.timedelta(days=1), recursion=recursion + 1
-            )
-        return rates[currency]
+        # Fallback on previous days if data is not available
+        for offset in range(FALLBACK_DAYS):
+            rate_date = (date - datetime.timedelta(days=offset)).isoformat()
+            if cls.is_missing(currency, rate_date):
+                continue
+            try:
+                return cls.get_rate(currency, rate_date)
+            except requests.RequestException:
+                # Transport errors are retried on the next call
+                logger.exception("failed to fetch exchange rate data")
+            except InvalidDataError:
+                logger.exception("failed to fetch exchange rate data")
+                cls.mark_missing(currency, rate_date)
+        return cls.get_rate(
+            currency, (date - datetime.timedelta(days=FALLBACK_DAYS)).isoformat()
+        )
 
     @classmethod
     def convert_from_eur(
@@ -112,41 +154,261 @@ class UncachedExchangeRates:
 
 
 class ExchangeRates(UncachedExchangeRates):
+    """
+    Exchange rates stored in the database.
+
+    Loaded rates are kept in the process memory, the filesystem cache
+    configured by EXCHANGE_RATES_CACHE_DIR is used as an optional fallback.
+    """
+
     datacache: ClassVar[dict[str, dict[str, Decimal]]] = {}
     btc_datacache: ClassVar[dict[str, Decimal]] = {}
+    conversion_datacache: ClassVar[dict[str, dict[str, Decimal]]] = {}
 
     @classmethod
-    def download(cls, date: str) -> dict[str, Decimal]:
-        CACHE_DIR.mkdir(parents=True, exist_ok=True)
-        cache_file = CACHE_DIR / f"rates-{date}"
+    def load_stored(cls, date: str, stored: dict[str, str | float]) -> None:
+        # Convert str (from DjangoJSONEncoder) or float (legacy cache) to Decimal
+        rates = {key: Decimal(value) for key, value in stored.items()}
+        btc_rate = rates.pop("BTC", None)
+        if btc_rate is not None:
+            cls.btc_datacache[date] = btc_rate
+        if rates:
+            cls.datacache[date] = rates
 
-        # Filesystem cache
-        if date not in cls.datacache and cache_file.exists():
-            cached: dict[str, str | float] = json.loads(cache_file.read_text())
-            # Convert str (from DecimalEncoder) or float (legacy cache) to Decimal
-            cls.datacache[date] = {key: Decimal(value) for key, value in cached.items()}
+    @classmethod
+    def preload(cls, start: datetime.date, end: datetime.date) -> None:
+        """Load all stored rates for the date range using a single query."""
+        # ruff:ignore[import-outside-top-level]
+        from weblate_web.models import ExchangeRate
+
+        for rate_date, stored in ExchangeRate.objects.filter(
+            date__range=(start, end)
+        ).values_list("date", "rates"):
+            cls.load_stored(rate_date.isoformat(), stored)
 
-        # Load remotely
+    @classmethod
+    def load_database(cls, date: str) -> None:
+        # ruff:ignore[import-outside-top-level]
+        from weblate_web.models import ExchangeRate
+
+        stored = (
+            ExchangeRate.objects.filter(date=date)
+            .values_list("rates", flat=True)
+            .first()
+        )
+        if stored:
+            cls.load_stored(date, stored)
+
+    @classmethod
+    def store_database(cls, date: str, rates: dict[str, Decimal]) -> None:
+        # ruff:ignore[import-outside-top-level]
+        from weblate_web.models import ExchangeRate
+
+        with transaction.atomic():
+            exchange_rate, created = (
+                ExchangeRate.objects.select_for_update().get_or_create(
+                    date=date, defaults={"rates": rates}
+                )
+            )
+            if not created:
+                exchange_rate.rates.update(rates)
+                exchange_rate.save(update_fields=["rates"])
+
+    @classmethod
+    def load_file(cls, name: str) -> Any:
+        cache_dir = settings.EXCHANGE_RATES_CACHE_DIR
+        if cache_dir is None:
+            return None
+        cache_file = Path(cache_dir) / name
+        if not cache_file.exists():
+            return None
+        return json.loads(cache_file.read_text())
+
+    @classmethod
+    def store_file(cls, name: str, value: dict[str, Decimal] | Decimal) -> None:
+        cache_dir = settings.EXCHANGE_RATES_CACHE_DIR
+        if cache_dir is None:
+            return
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        (Path(cache_dir) / name).write_text(json.dumps(value, cls=DecimalEncoder))
+
+    @classmethod
+    def get_missing_key(cls, currency: str, date: str) -> str:
+        source = "btc" if currency == "BTC" else "cnb"
+        return f"exchange-rates-missing-{source}-{date}"
+
+    @classmethod
+    def is_missing(cls, currency: str, date: str) -> bool:
+        if date in (cls.btc_datacache if currency == "BTC" else cls.datacache):
+            return False
+        return cache.get(cls.get_missing_key(currency, date), False)
+
+    @classmethod
+    def mark_missing(cls, currency: str, date: str) -> None:
+        cache.set(cls.get_missing_key(currency, date), True, MISSING_CACHE_TIMEOUT)
+
+    @classmethod
+    def store_resolved(
+        cls,
+        published: datetime.date,
+        rates: dict[str, Decimal],
+        dates: set[datetime.date],
+    ) -> None:
+        """
+        Store rates for all dates they are valid for.
+
+        Rates are final only for the day they were published for and for past
+        days, rates for today can still be published later.
+        """
+        # ruff:ignore[import-outside-top-level]
+        from weblate_web.models import ExchangeRate
+
+        today = timezone.now().date()
+        all_dates = {published, *dates}
+        existing = set(
+            ExchangeRate.objects.filter(date__in=all_dates).values_list(
+                "date", flat=True
+            )
+        )
+        created: list[ExchangeRate] = []
+        for rate_date in sorted(all_dates):
+            date = rate_date.isoformat()
+            if rate_date != published and rate_date >= today:
+                cache.set(f"exchange-rates-{date}", rates, MISSING_CACHE_TIMEOUT)
+                continue
+            cls.store_file(f"rates-{date}", rates)
+            if rate_date in existing:
+                # Merge with the stored BTC rate
+                cls.store_database(date, rates)
+            else:
+                created.append(ExchangeRate(date=rate_date, rates=rates))
+            cls.datacache[date] = rates
+        ExchangeRate.objects.bulk_create(created, ignore_conflicts=True)
+
+    @classmethod
+    def resolve_date(
+        cls, rate_date: datetime.date, pending: Iterable[datetime.date] = ()
+    ) -> tuple[dict[str, Decimal], set[datetime.date]]:
+        """
+        Download rates for a date and use them for all dates they cover.
+
+        Returns the rates and the set of resolved dates.
+        """
+        valid_for, rates = cls.fetch(rate_date.isoformat())
+        published = min(datetime.date.fromisoformat(valid_for), rate_date)
+        resolved = {
+            rate_date,
+            *(date for date in pending if published <= date <= rate_date),
+        }
+        cls.store_resolved(published, rates, resolved)
+        return rates, resolved
+
+    @classmethod
+    def resolve(cls, dates: Iterable[datetime.date]) -> None:
+        """
+        Make rates for given dates available with minimal number of requests.
+
+        Stored rates are loaded using a single query. Remaining dates are
+        downloaded starting with the newest one as a single response covers
+        all days back to the day the rates were published for.
+        """
+        pending = sorted(set(dates), reverse=True)
+        if not pending:
+            return
+        cls.preload(pending[-1], pending[0])
+        pending = [date for date in pending if date.isoformat() not in cls.datacache]
+        while pending:
+            rate_date = pending.pop(0)
+            if cls.is_missing("EUR", rate_date.isoformat()):
+                continue
+            try:
+                _rates, resolved = cls.resolve_date(rate_date, pending)
+            except requests.RequestException:
+                # Transport errors are retried on the next call
+                logger.exception("failed to fetch exchange rate data")
+                continue
+            except InvalidDataError:
+                logger.exception("failed to fetch exchange rate data")
+                cls.mark_missing("EUR", rate_date.isoformat())
+                continue
+            pending = [date for date in pending if date not in resolved]
+
+    @classmethod
+    def download(cls, date: str) -> dict[str, Decimal]:
         if date not in cls.datacache:
-            cls.datacache[date] = super().download(date)
+            cls.load_database(date)
+        if date in cls.datacache:
+            return cls.datacache[date]
 
-            # Update filesystem cache
-            cache_file.write_text(json.dumps(cls.datacache[date], cls=DecimalEncoder))
+        # Rates which are not final yet
+        rates = cache.get(f"exchange-rates-{date}")
+        if rates is not None:
+            return rates
 
-        return cls.datacache[date]
+        rate_date = datetime.date.fromisoformat(date)
+        cached = cls.load_file(f"rates-{date}")
+        if cached is None:
+            return cls.resolve_date(rate_date)[0]
+        rates = {key: Decimal(value) for key, value in cached.items()}
+        cls.store_resolved(rate_date, rates, {rate_date})
+        return rates
 
     @classmethod
     def download_btc(cls, date: str) -> Decimal:
-        CACHE_DIR.mkdir(parents=True, exist_ok=True)
-        cache_file = CACHE_DIR / f"rate-btc-{date}"
-
-        if date not in cls.btc_datacache and cache_file.exists():
-            cls.btc_datacache[date] = Decimal(json.loads(cache_file.read_text()))
+        if date not in cls.btc_datacache:
+            cls.load_database(date)
 
         if date not in cls.btc_datacache:
-            cls.btc_datacache[date] = super().download_btc(date)
-            cache_file.write_text(
-                json.dumps(cls.btc_datacache[date], cls=DecimalEncoder)
-            )
+            cached = cls.load_file(f"rate-btc-{date}")
+            if cached is None:
+                btc_rate = super().download_btc(date)
+                cls.store_file(f"rate-btc-{date}", btc_rate)
+            else:
+                btc_rate = Decimal(cached)
+            cls.store_database(date, {"BTC": btc_rate})
+            cls.btc_datacache[date] = btc_rate
 
         return cls.btc_datacache[date]
+
+    @classmethod
+    def get_conversion_rates(cls, date: datetime.date) -> dict[str, Decimal]:
+        """
+        Get multipliers for converting EUR prices to other currencies.
+
+        The table is computed once per day and shared using the cache, tables
+        based on rates which are not final yet expire sooner.
+        """
+        date_iso = date.isoformat()
+        if date_iso in cls.conversion_datacache:
+            return cls.conversion_datacache[date_iso]
+
+        cache_key = f"exchange-rates-conversion-{date_iso}"
+        cached = cache.get(cache_key)
+        if cached is None:
+            eur_rate = cls.get("EUR", date)
+            conversion = {
+                currency: EXCHANGE_MARKUP * eur_rate / cls.get(currency, date)
+                for currency in CONVERSION_CURRENCIES
+            }
+            final = date_iso in cls.datacache
+            cache.set(
+                cache_key,
+                (conversion, final),
+                CONVERSION_CACHE_TIMEOUT if final else MISSING_CACHE_TIMEOUT,
+            )
+        else:
+            conversion, final = cached
+        if final:
+            cls.conversion_datacache[date_iso] = conversion
+        return conversion
+
+    @classmethod
+    def convert_from_eur(
+        cls, amount: Decimal | float, currency: str, date: datetime.date
+    ) -> Decimal:
+        conversion = cls.get_conversion_rates(date)
+        if currency not in conversion:
+            return super().convert_from_eur(amount, currency, date)
+        if not isinstance(amount, Decimal):
+            amount = Decimal(amount)
+        return round(amount * conversion[currency], 0)
@@ -22,11 +22,13 @@ from __future__ import annotations
 from typing import TYPE_CHECKING, Any
 
 from django.contrib import admin
+from django.utils.html import format_html_join
 
 from .models import Discount, Invoice, InvoiceItem, InvoiceKind
 
 if TYPE_CHECKING:
     from django.http.request import HttpRequest
+    from django.utils.safestring import SafeString
 
 
 @admin.register(Discount)
@@ -89,5 +91,13 @@ class InvoiceAdmin(admin.ModelAdmin):
     ) -> list[str]:
         fields = ["number", "prepaid"]
         if obj:
-            fields.extend(("kind", "issue_date"))
+            fields.extend(("kind", "issue_date", "file_fingerprints"))
         return fields
+
+    @admin.display(description="File fingerprints")
+    def file_fingerprints(self, obj: Invoice) -> SafeString:
+        return format_html_join(
+            "\n",
+            "<div>{}: <code>{}</code></div>",
+            sorted(obj.get_fingerprints()["files"].items()),
+        )
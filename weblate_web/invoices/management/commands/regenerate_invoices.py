@@ -0,0 +1,245 @@
+#
+# Copyright © Michal Čihař <michal@weblate.org>
+#
+# This file is part of Weblate <https://weblate.org/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+from __future__ import annotations
+
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+from pathlib import Path
+from time import perf_counter
+from typing import TYPE_CHECKING, TextIO
+
+import django
+import sentry_sdk
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from weblate_web.invoices.models import Invoice, InvoiceKind
+
+if TYPE_CHECKING:
+    from django.db.models import QuerySet
+
+
+def get_artifacts(invoice: Invoice, *, receipts: bool) -> list[Path]:
+    artifacts = [invoice.path, invoice.xml_path]
+    if invoice.supports_en_16931:
+        artifacts.append(invoice.en_16931_xml_path)
+    if receipts and invoice.is_paid:
+        artifacts.append(invoice.receipt_path)
+    return artifacts
+
+
+def is_stale(invoice: Invoice, *, receipts: bool) -> bool:
+    """Check whether any invoice file is missing or generated from old templates."""
+    return bool(invoice.get_stale_files(get_artifacts(invoice, receipts=receipts)))
+
+
+def regenerate_invoice(pk: str, *, receipts: bool, force: bool) -> None:
+    invoice = Invoice.objects.get(pk=pk)
+    invoice.generate_files(force=force)
+    if receipts and invoice.is_paid:
+        invoice.generate_receipt(force=force)
+
+
+def setup_worker() -> None:
+    # Workers started using spawn or forkserver need Django configured
+    django.setup()
+
+
+class Command(BaseCommand):
+    help = "regenerates invoice files in parallel"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument(
+            "--from",
+            dest="date_from",
+            type=date.fromisoformat,
+            help="Issue date to start from (YYYY-MM-DD)",
+        )
+        parser.add_argument(
+            "--to",
+            dest="date_to",
+            type=date.fromisoformat,
+            help="Issue date to end with (YYYY-MM-DD)",
+        )
+        parser.add_argument(
+            "--customer",
+            type=int,
+            help="Customer ID to limit regeneration to",
+        )
+        parser.add_argument(
+            "--kind",
+            choices=[kind.name.lower() for kind in InvoiceKind],
+            help="Invoice kind to limit regeneration to",
+        )
+        parser.add_argument(
+            "--receipts",
+            default=False,
+            action="store_true",
+            help="Regenerate receipts for paid invoices as well",
+        )
+        parser.add_argument(
+            "--force",
+            default=False,
+            action="store_true",
+            help="Rewrite files even when their fingerprint is unchanged",
+        )
+        parser.add_argument(
+            "--dry-run",
+            default=False,
+            action="store_true",
+            help="Only list invoices with stale files",
+        )
+        parser.add_argument(
+            "--jobs",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Number of worker processes, defaults to number of CPUs",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            type=Path,
+            help="File to record regenerated invoices in",
+        )
+        parser.add_argument(
+            "--resume",
+            default=False,
+            action="store_true",
+            help="Skip invoices recorded in the checkpoint file",
+        )
+
+    @staticmethod
+    def get_invoices(options: dict) -> QuerySet[Invoice]:
+        invoices = Invoice.objects.select_related("customer").order_by(
+            "issue_date", "sequence"
+        )
+        if options["date_from"]:
+            invoices = invoices.filter(issue_date__gte=options["date_from"])
+        if options["date_to"]:
+            invoices = invoices.filter(issue_date__lte=options["date_to"])
+        if options["customer"]:
+            invoices = invoices.filter(customer_id=options["customer"])
+        if options["kind"]:
+            invoices = invoices.filter(kind=InvoiceKind[options["kind"].upper()])
+        return invoices
+
+    def record(self, checkpoint: TextIO, invoice: Invoice) -> None:
+        checkpoint.write(f"{invoice.pk}\n")
+        checkpoint.flush()
+
+    def report_failure(self, invoice: Invoice, error: Exception) -> None:
+        sentry_sdk.capture_exception(error)
+        self.stderr.write(f"Failed to regenerate {invoice.number}: {error}")
+
+    def regenerate_serial(
+        self,
+        invoices: list[Invoice],
+        checkpoint: TextIO,
+        *,
+        receipts: bool,
+        force: bool,
+    ) -> int:
+        failed = 0
+        for invoice in invoices:
+            try:
+                regenerate_invoice(str(invoice.pk), receipts=receipts, force=force)
+            except Exception as error:
+                self.report_failure(invoice, error)
+                failed += 1
+            else:
+                self.record(checkpoint, invoice)
+        return failed
+
+    def regenerate_parallel(
+        self,
+        invoices: list[Invoice],
+        checkpoint: TextIO,
+        *,
+        receipts: bool,
+        force: bool,
+        jobs: int,
+    ) -> int:
+        failed = 0
+        # Forked workers must not share database connections with this process
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=jobs, initializer=setup_worker) as pool:
+            futures = {
+                pool.submit(
+                    regenerate_invoice, str(invoice.pk), receipts=receipts, force=force
+                ): invoice
+                for invoice in invoices
+            }
+            for future in as_completed(futures):
+                invoice = futures[future]
+                try:
+                    future.result()
+                except Exception as error:
+                    self.report_failure(invoice, error)
+                    failed += 1
+                else:
+                    self.record(checkpoint, invoice)
+        return failed
+
+    def handle(self, *args, **options) -> None:
+        checkpoint_path: Path = options["checkpoint"] or (
+            settings.INVOICES_PATH / "regenerate_invoices.checkpoint"
+        )
+        done: set[str] = set()
+        if options["resume"] and checkpoint_path.exists():
+            done = set(checkpoint_path.read_text().split())
+
+        receipts = options["receipts"]
+        force = options["force"]
+        invoices = [
+            invoice
+            for invoice in self.get_invoices(options)
+            if str(invoice.pk) not in done
+            and (force or is_stale(invoice, receipts=receipts))
+        ]
+
+        if options["dry_run"]:
+            for invoice in invoices:
+                self.stdout.write(f"{invoice.number}: stale")
+            self.stdout.write(f"{len(invoices)} invoices need regeneration")
+            return
+
+        settings.INVOICES_PATH.mkdir(exist_ok=True)
+        start = perf_counter()
+        jobs = min(options["jobs"], len(invoices))
+        with checkpoint_path.open("a" if options["resume"] else "w") as checkpoint:
+            if jobs > 1:
+                failed = self.regenerate_parallel(
+                    invoices, checkpoint, receipts=receipts, force=force, jobs=jobs
+                )
+            else:
+                failed = self.regenerate_serial(
+                    invoices, checkpoint, receipts=receipts, force=force
+                )
+        elapsed = perf_counter() - start
+
+        self.stdout.write(
+            f"Regenerated {len(invoices) - failed} invoices in {elapsed:.2f} s "
+            f"using {max(jobs, 1)} processes"
+        )
+        if failed:
+            raise CommandError(
+                f"Failed to regenerate {failed} invoices, use --resume to retry"
+            )
@@ -19,9 +19,14 @@
 from __future__ import annotations
 
 import datetime
+import hashlib
+import json
+import re
 import uuid
+from contextlib import contextmanager
 from dataclasses import dataclass
 from decimal import ROUND_HALF_UP, Decimal
+from functools import lru_cache, partial
 from pathlib import Path
 from shutil import copyfile
 from typing import TYPE_CHECKING, Literal, cast
@@ -73,11 +78,11 @@ from weblate_web.const import (
     COMPANY_ZIP,
 )
 from weblate_web.exchange_rates import ExchangeRates
-from weblate_web.pdf import count_pdf_pages, render_pdf
+from weblate_web.pdf import render_pdf_document, write_pdf_document
 from weblate_web.utils import get_site_url
 
 if TYPE_CHECKING:
-    from collections.abc import Generator
+    from collections.abc import Callable, Generator
 
     from django_stubs_ext import StrOrPromise
 
@@ -87,7 +92,52 @@ if TYPE_CHECKING:
 INVOICES_URL = "invoices:"
 STATIC_URL = "static:"
 TEMPLATES_PATH = Path(__file__).parent / "templates"
+STATIC_REFERENCE_RE = re.compile(r"""static:([^"')\s]+)""")
 MONEY_QUANTUM = Decimal("0.01")
+# Increase when changes in the code affect generated files
+FINGERPRINT_VERSION = "1"
+
+
+def get_fingerprint(*parts: str | bytes) -> str:
+    """Return SHA-256 fingerprint of the file inputs."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode() if isinstance(part, str) else part)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+@lru_cache(maxsize=1)
+def _get_templates_digest(paths: tuple[tuple[Path, int], ...]) -> str:
+    return get_fingerprint(
+        *(part for path, _mtime in paths for part in (path.name, path.read_bytes()))
+    )
+
+
+@lru_cache(maxsize=1)
+def _get_static_assets(paths: tuple[tuple[Path, int], ...]) -> tuple[Path, ...]:
+    """Return static files referenced by the templates and stylesheets."""
+    assets: set[Path] = set()
+    for path, _mtime in paths:
+        if path.suffix not in {".css", ".html"}:
+            continue
+        for name in STATIC_REFERENCE_RE.findall(path.read_text()):
+            if match := finders.find(name):
+                assets.add(Path(match))
+    return tuple(sorted(assets))
+
+
+def get_templates_digest() -> str:
+    """Return digest of templates, stylesheets and assets used to render PDF."""
+    paths = sorted(path for path in TEMPLATES_PATH.iterdir() if path.is_file())
+    if fonts_css := finders.find("pdf/fonts.css"):
+        paths.append(Path(fonts_css))
+    paths.extend(
+        _get_static_assets(tuple((path, path.stat().st_mtime_ns) for path in paths))
+    )
+    return _get_templates_digest(
+        tuple((path, path.stat().st_mtime_ns) for path in paths)
+    )
 
 
 def date_format(value: datetime.datetime | datetime.date) -> str:
@@ -329,6 +379,16 @@ class _EN16931TaxDetails:
     money_s3_code: str
 
 
+@dataclass
+class _InvoiceGeneration:
+    """Data shared by all documents generated for an invoice."""
+
+    tax_details: _EN16931TaxDetails
+    fingerprints: dict[str, dict[str, str]]
+    en_16931_xml: str | None = None
+    fingerprints_changed: bool = False
+
+
 @dataclass(frozen=True)
 class _InvoiceAmounts:
     items: Decimal
@@ -359,8 +419,18 @@ class InvoiceQuerySet(models.QuerySet["Invoice", "Invoice"]):
     def order(self) -> InvoiceQuerySet:
         return self.order_by("-issue_date", "-number")
 
+    def with_items(self) -> InvoiceQuerySet:
+        """Prefetch data needed to calculate invoice totals."""
+        return self.select_related("discount").prefetch_related(
+            models.Prefetch(
+                "invoiceitem_set", queryset=InvoiceItem.objects.order_by("id")
+            )
+        )
+
 
 class Invoice(models.Model):  # ruff:ignore[too-many-public-methods]
+    _generation: _InvoiceGeneration | None = None
+
     uuid = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     sequence = models.IntegerField(editable=False)
     number = models.GeneratedField(
@@ -771,6 +841,9 @@ class Invoice(models.Model):  # ruff:ignore[too-many-public-methods]
 
     @cached_property
     def all_items(self) -> models.QuerySet[InvoiceItem]:
+        if "invoiceitem_set" in getattr(self, "_prefetched_objects_cache", {}):
+            # Prefetched using InvoiceQuerySet.with_items()
+            return self.invoiceitem_set.all()
         return self.invoiceitem_set.order_by("id")
 
     def get_description(self) -> str:
@@ -836,18 +909,135 @@ class Invoice(models.Model):  # ruff:ignore[too-many-public-methods]
         """XML path object."""
         return settings.INVOICES_PATH / self.get_filename("einvoice.xml")
 
-    def generate_files(self) -> None:
-        # Validate accounting data before any document is written.
-        self._get_en_16931_tax_details()
-        self.generate_money_s3_xml()
-        self.generate_en_16931_xml()
-        self.generate_pdf()
-        self.sync_files()
+    @property
+    def fingerprints_path(self) -> Path:
+        """Fingerprints JSON path object."""
+        return settings.INVOICES_PATH / self.get_filename("fingerprints.json")
+
+    def get_fingerprints(self) -> dict[str, dict[str, str]]:
+        """
+        Return fingerprints of the generated files and their copies.
+
+        The fingerprint is a digest of all inputs affecting the file content,
+        files are regenerated or copied only when it changes.
+        """
+        try:
+            fingerprints = json.loads(self.fingerprints_path.read_text())
+        except (FileNotFoundError, ValueError):
+            fingerprints = {}
+        return {
+            "files": fingerprints.get("files", {}),
+            "copies": fingerprints.get("copies", {}),
+            "templates": fingerprints.get("templates", {}),
+        }
+
+    def save_fingerprints(self, fingerprints: dict[str, dict[str, str]]) -> None:
+        # Write to a temporary file first so readers never see partial content
+        path = self.fingerprints_path
+        temp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            temp.write_text(json.dumps(fingerprints, indent=2, sort_keys=True))
+            temp.replace(path)
+        finally:
+            temp.unlink(missing_ok=True)
+
+    def _load_fingerprints(self) -> dict[str, dict[str, str]]:
+        """Return fingerprints, shared within the generation context."""
+        if self._generation is not None:
+            return self._generation.fingerprints
+        return self.get_fingerprints()
+
+    def _store_fingerprints(self, fingerprints: dict[str, dict[str, str]]) -> None:
+        """Save fingerprints, deferred to the end of the generation context."""
+        if self._generation is not None:
+            self._generation.fingerprints_changed = True
+        else:
+            self.save_fingerprints(fingerprints)
 
-    def generate_receipt(self) -> None:
-        self._generate_pdf(self.receipt_filename, is_receipt=True)
+    def _write_file(
+        self,
+        path: Path,
+        fingerprint: str,
+        write: Callable[[Path], None],
+        *,
+        templates_digest: str | None = None,
+        force: bool = False,
+    ) -> None:
+        """Write file unless it exists with a matching fingerprint."""
+        fingerprints = self._load_fingerprints()
+        if (
+            not force
+            and fingerprints["files"].get(path.name) == fingerprint
+            and path.exists()
+        ):
+            return
+        write(path)
+        fingerprints["files"][path.name] = fingerprint
+        if templates_digest is not None:
+            fingerprints["templates"][path.name] = templates_digest
+        self._store_fingerprints(fingerprints)
+
+    def get_stale_files(self, paths: list[Path]) -> list[Path]:
+        """
+        Return files which are missing or were generated from other templates.
+
+        Only the stored fingerprints are compared, so this does not depend on
+        file modification times.
+        """
+        fingerprints = self.get_fingerprints()
+        templates_digest = get_templates_digest()
+        return [
+            path
+            for path in paths
+            if not path.exists()
+            or path.name not in fingerprints["files"]
+            or (
+                path.suffix == ".pdf"
+                and fingerprints["templates"].get(path.name) != templates_digest
+            )
+        ]
 
-    def sync_files(self) -> None:
+    @contextmanager
+    def generation(self) -> Generator[None]:
+        """
+        Build data shared by the generated documents only once.
+
+        The tax details and EN 16931 XML are reused by all documents generated
+        within the context. File fingerprints are loaded once and saved when
+        leaving the context.
+        """
+        if self._generation is not None:
+            yield
+            return
+        # Validate accounting data before any document is written.
+        generation = self._generation = _InvoiceGeneration(
+            tax_details=self._get_en_16931_tax_details(),
+            fingerprints=self.get_fingerprints(),
+        )
+        try:
+            yield
+        finally:
+            self._generation = None
+            # Record files written before a possible failure as well
+            if generation.fingerprints_changed:
+                self.save_fingerprints(generation.fingerprints)
+
+    def generate_files(self, *, force: bool = False) -> None:
+        """
+        Generate invoice files and copy them to the configured location.
+
+        Files with unchanged fingerprint are skipped unless forced.
+        """
+        with self.generation():
+            self.generate_money_s3_xml(force=force)
+            self.generate_en_16931_xml(force=force)
+            self.generate_pdf(force=force)
+            self.sync_files(force=force)
+
+    def generate_receipt(self, *, force: bool = False) -> None:
+        self._generate_pdf(self.receipt_filename, is_receipt=True, force=force)
+
+    def sync_files(self, *, force: bool = False) -> None:
         if self.kind == InvoiceKind.INVOICE and settings.INVOICES_COPY_PATH:
             output_dir = (
                 settings.INVOICES_COPY_PATH
@@ -855,8 +1045,24 @@ class Invoice(models.Model):  # ruff:ignore[too-many-public-methods]
                 / f"{self.issue_date.month:02d}"
             )
             output_dir.mkdir(parents=True, exist_ok=True)
-            copyfile(self.path, output_dir / self.filename)
-            copyfile(self.xml_path, output_dir / self.get_filename("xml"))
+            fingerprints = self._load_fingerprints()
+            copied = False
+            for path in (self.path, self.xml_path):
+                target = output_dir / path.name
+                fingerprint = fingerprints["files"].get(path.name)
+                if (
+                    not force
+                    and fingerprint is not None
+                    and fingerprints["copies"].get(target.as_posix()) == fingerprint
+                    and target.exists()
+                ):
+                    continue
+                copyfile(path, target)
+                if fingerprint is not None:
+                    fingerprints["copies"][target.as_posix()] = fingerprint
+                    copied = True
+            if copied:
+                self._store_fingerprints(fingerprints)
 
     def get_money_s3_xml_tree(self, invoices: etree._Element) -> None:  # ruff:ignore[too-many-statements, complex-structure]
         """Create XML tree for Money S3 invoice XML."""
@@ -975,16 +1181,26 @@ class Invoice(models.Model):  # ruff:ignore[too-many-public-methods]
         return document, invoices
 
     @staticmethod
-    def save_invoice_xml(document: etree._Element, path: Path) -> None:
+    def get_invoice_xml_bytes(document: etree._Element) -> bytes:
         etree.indent(document)
-        etree.ElementTree(document).write(path, encoding="utf-8", xml_declaration=True)
+        return etree.tostring(document, encoding="utf-8", xml_declaration=True)
+
+    @classmethod
+    def save_invoice_xml(cls, document: etree._Element, path: Path) -> None:
+        path.write_bytes(cls.get_invoice_xml_bytes(document))
 
-    def generate_money_s3_xml(self) -> None:
+    def generate_money_s3_xml(self, *, force: bool = False) -> None:
         """Create XML file for Money S3 invoice XML."""
         document, invoices = self.get_invoice_xml_root()
         self.get_money_s3_xml_tree(invoices)
         settings.INVOICES_PATH.mkdir(exist_ok=True)
-        self.save_invoice_xml(document, self.xml_path)
+        content = self.get_invoice_xml_bytes(document)
+        self._write_file(
+            self.xml_path,
+            get_fingerprint(content),
+            partial(Path.write_bytes, data=content),
+            force=force,
+        )
 
     @property
     def supports_en_16931(self) -> bool:
@@ -999,6 +1215,8 @@ class Invoice(models.Model):  # ruff:ignore[too-many-public-methods]
         )
 
     def _get_en_16931_tax_details(self) -> _EN16931TaxDetails:
+        if self._generation is not None:
+            return self._generation.tax_details
         if self.vat_rate:
             return _EN16931TaxDetails(
                 category=TaxCategoryCode.STANDARD_RATE,
@@ -1233,48 +1451,89 @@ class Invoice(models.Model):  # ruff:ignore[too-many-public-methods]
         return xml_tree
 
     def get_en_16931_xml_string(self) -> str:
+        generation = self._generation
+        if generation is not None and generation.en_16931_xml is not None:
+            return generation.en_16931_xml
         xml_tree = self.get_en_16931_xml_tree()
         ElementTree.indent(xml_tree)
-        return ElementTree.tostring(xml_tree, encoding="unicode", xml_declaration=True)
+        xml = ElementTree.tostring(xml_tree, encoding="unicode", xml_declaration=True)
+        if generation is not None:
+            generation.en_16931_xml = xml
+        return xml
 
-    def generate_en_16931_xml(self) -> None:
+    def generate_en_16931_xml(self, *, force: bool = False) -> None:
         if self.supports_en_16931:
-            self.en_16931_xml_path.write_text(self.get_en_16931_xml_string())
+            xml = self.get_en_16931_xml_string()
+            self._write_file(
+                self.en_16931_xml_path,
+                get_fingerprint(xml),
+                partial(Path.write_text, data=xml),
+                force=force,
+            )
 
     def _generate_pdf(
         self,
         filename: str,
         *,
         is_receipt: bool = False,
-        attachments: list[Attachment] | None = None,
+        en_16931_xml: str | None = None,
+        force: bool = False,
     ) -> None:
         """Render invoice as PDF."""
         # Create directory to store invoices
         settings.INVOICES_PATH.mkdir(exist_ok=True)
         html = self.render_html(is_receipt=is_receipt)
-        if count_pdf_pages(html=html) > 1:
-            html = self.render_html(is_receipt=is_receipt, show_page_marker=True)
-        render_pdf(
-            html=html,
-            output=settings.INVOICES_PATH / filename,
-            attachments=attachments,
-            factur_x=bool(attachments),
+        templates_digest = get_templates_digest()
+        fingerprint = get_fingerprint(
+            FINGERPRINT_VERSION, templates_digest, html, en_16931_xml or ""
+        )
+        self._write_file(
+            settings.INVOICES_PATH / filename,
+            fingerprint,
+            partial(
+                self._write_pdf,
+                html=html,
+                is_receipt=is_receipt,
+                en_16931_xml=en_16931_xml,
+            ),
+            templates_digest=templates_digest,
+            force=force,
         )
 
-    def generate_pdf(self) -> None:
-        """Render invoice as PDF."""
+    def _write_pdf(
+        self, output: Path, *, html: str, is_receipt: bool, en_16931_xml: str | None
+    ) -> None:
         attachments: list[Attachment] = []
-        if self.supports_en_16931:
+        if en_16931_xml is not None:
             attachments = [
                 Attachment(
-                    string=self.get_en_16931_xml_string(),
+                    string=en_16931_xml,
                     base_url="factur-x.xml",
                     description="Factur-x invoice",
                 )
             ]
+        document = render_pdf_document(html=html)
+        # Most invoices fit on a single page and the first layout is written
+        # as is, only multi-page ones are laid out again with the page marker
+        if len(document.pages) > 1:
+            document = render_pdf_document(
+                html=self.render_html(is_receipt=is_receipt, show_page_marker=True)
+            )
+        write_pdf_document(
+            document,
+            output=output,
+            attachments=attachments,
+            factur_x=bool(attachments),
+        )
+
+    def generate_pdf(self, *, force: bool = False) -> None:
+        """Render invoice as PDF."""
         self._generate_pdf(
             self.filename,
-            attachments=attachments,
+            en_16931_xml=(
+                self.get_en_16931_xml_string() if self.supports_en_16931 else None
+            ),
+            force=force,
         )
 
     def duplicate(  # ruff:ignore[too-many-arguments]
@@ -1,18 +1,22 @@
 from __future__ import annotations
 
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, timedelta
 from decimal import Decimal
 from importlib import import_module
+from io import StringIO
 from pathlib import Path
 from tempfile import TemporaryDirectory
 from typing import cast
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
 import requests
 import responses
 from django.apps import apps
+from django.contrib.staticfiles import finders
 from django.core.exceptions import ValidationError
+from django.core.management import call_command
 from django.forms import modelform_factory
 from django.test.utils import override_settings
 from django.urls import reverse
@@ -21,9 +25,17 @@ from drafthorse.utils import validate_xml  # type: ignore[import-untyped]
 from lxml import etree
 from pycheval.quantities import QuantityCode
 from pycheval.type_codes import TaxCategoryCode
+from weasyprint import CSS, Attachment
+from weasyprint.text.fonts import FontConfiguration
 
 from weblate_web.models import Package, PackageCategory
 from weblate_web.payments.models import Customer, Payment
+from weblate_web.pdf import (
+    WeblateUrlFetcher,
+    get_render_context,
+    render_pdf_document,
+    reset_render_context,
+)
 from weblate_web.tests import UserTestCase, cnb_mock_rates, mock_vies
 
 from .models import (
@@ -32,8 +44,11 @@ from .models import (
     Invoice,
     InvoiceCalculationVersion,
     InvoiceCategory,
+    InvoiceItem,
     InvoiceKind,
     QuantityUnit,
+    _get_static_assets,
+    get_templates_digest,
 )
 from .validation import EN16931Validator
 
@@ -735,26 +750,331 @@ class InvoiceTestCase(UserTestCase):  # ruff:ignore[too-many-public-methods]
     @responses.activate
     def test_pdf_page_marker_is_added_only_for_multi_page_invoice(self) -> None:
         self.mock_requests()
+        self.use_temporary_invoices_path()
         invoice = self.create_invoice(kind=InvoiceKind.QUOTE)
+        single_page = MagicMock(pages=[MagicMock()])
+        multi_page = MagicMock(pages=[MagicMock(), MagicMock()])
+        marked_page = MagicMock(pages=[MagicMock(), MagicMock()])
 
         with (
             patch(
-                "weblate_web.invoices.models.count_pdf_pages",
-                side_effect=[1, 2],
-            ) as count_pdf_pages,
-            patch("weblate_web.invoices.models.render_pdf") as render_pdf,
+                "weblate_web.invoices.models.render_pdf_document",
+                side_effect=[single_page, multi_page, marked_page],
+            ) as render_pdf_document,
+            patch("weblate_web.invoices.models.write_pdf_document") as write_pdf,
         ):
             invoice.generate_pdf()
-            single_page_html = render_pdf.call_args.kwargs["html"]
-
-            render_pdf.reset_mock()
+            # Single page invoice is laid out only once
+            self.assertEqual(render_pdf_document.call_count, 1)
+            write_pdf.assert_called_once()
+            self.assertIs(write_pdf.call_args.args[0], single_page)
+            single_page_html = render_pdf_document.call_args.kwargs["html"]
+
+            render_pdf_document.reset_mock()
+            write_pdf.reset_mock()
             invoice.generate_pdf()
-            multi_page_html = render_pdf.call_args.kwargs["html"]
+            self.assertEqual(render_pdf_document.call_count, 2)
+            write_pdf.assert_called_once()
+            self.assertIs(write_pdf.call_args.args[0], marked_page)
+            multi_page_html = render_pdf_document.call_args.kwargs["html"]
 
-        self.assertEqual(count_pdf_pages.call_count, 2)
         self.assertNotIn("with-page-marker", single_page_html)
         self.assertIn("with-page-marker", multi_page_html)
 
+    @responses.activate
+    def test_en_16931_xml_built_once(self) -> None:
+        self.mock_requests()
+        self.use_temporary_invoices_path()
+        invoice = self.create_invoice()
+        self.assertTrue(invoice.supports_en_16931)
+
+        with (
+            patch.object(
+                Invoice,
+                "get_en_16931_xml_tree",
+                autospec=True,
+                side_effect=Invoice.get_en_16931_xml_tree,
+            ) as xml_tree,
+            patch(
+                "weblate_web.invoices.models.Attachment", wraps=Attachment
+            ) as attachment,
+        ):
+            invoice.generate_files()
+
+        self.assertEqual(xml_tree.call_count, 1)
+        self.assertEqual(
+            attachment.call_args.kwargs["string"],
+            invoice.en_16931_xml_path.read_text(),
+        )
+        self.assertIsNone(invoice._generation)
+
+    @responses.activate
+    def test_unchanged_files_are_skipped(self) -> None:
+        self.mock_requests()
+        with (
+            TemporaryDirectory() as temp_dir,
+            TemporaryDirectory() as copy_dir,
+            override_settings(
+                INVOICES_PATH=Path(temp_dir), INVOICES_COPY_PATH=Path(copy_dir)
+            ),
+        ):
+            invoice = self.create_invoice()
+            invoice.generate_files()
+            fingerprints = invoice.get_fingerprints()
+            self.assertEqual(
+                set(fingerprints["files"]),
+                {
+                    invoice.filename,
+                    invoice.xml_path.name,
+                    invoice.en_16931_xml_path.name,
+                },
+            )
+            self.assertEqual(len(fingerprints["copies"]), 2)
+
+            with (
+                patch("weblate_web.invoices.models.write_pdf_document") as write_pdf,
+                patch("weblate_web.invoices.models.copyfile") as copy,
+            ):
+                invoice.generate_files()
+                write_pdf.assert_not_called()
+                copy.assert_not_called()
+
+                invoice.invoiceitem_set.update(description="Changed item")
+                invoice = Invoice.objects.get(pk=invoice.pk)
+                invoice.generate_files()
+                write_pdf.assert_called_once()
+                self.assertEqual(copy.call_count, 2)
+
+                # Forced generation rewrites and copies unchanged files
+                write_pdf.reset_mock()
+                copy.reset_mock()
+                with patch.object(Path, "write_bytes") as write_bytes:
+                    invoice.generate_files(force=True)
+                write_bytes.assert_called_once()
+                write_pdf.assert_called_once()
+                self.assertEqual(copy.call_count, 2)
+
+            self.assertNotEqual(
+                invoice.get_fingerprints()["files"][invoice.filename],
+                fingerprints["files"][invoice.filename],
+            )
+
+    @responses.activate
+    def test_fingerprints_saved_once(self) -> None:
+        self.mock_requests()
+        with (
+            TemporaryDirectory() as temp_dir,
+            TemporaryDirectory() as copy_dir,
+            override_settings(
+                INVOICES_PATH=Path(temp_dir), INVOICES_COPY_PATH=Path(copy_dir)
+            ),
+        ):
+            invoice = self.create_invoice()
+            with (
+                patch.object(
+                    Invoice, "get_fingerprints", wraps=invoice.get_fingerprints
+                ) as get_fingerprints,
+                patch.object(
+                    Invoice, "save_fingerprints", wraps=invoice.save_fingerprints
+                ) as save_fingerprints,
+            ):
+                invoice.generate_files()
+            get_fingerprints.assert_called_once()
+            save_fingerprints.assert_called_once()
+            self.assertEqual(len(invoice.get_fingerprints()["files"]), 3)
+            self.assertEqual(len(invoice.get_fingerprints()["copies"]), 2)
+            self.assertEqual(list(Path(temp_dir).glob("*.tmp")), [])
+
+    def test_templates_digest_static_assets(self) -> None:
+        paths = tuple(
+            (path, path.stat().st_mtime_ns)
+            for path in (Path(cast("str", finders.find("pdf/fonts.css"))),)
+        )
+        self.assertIn(
+            Path(
+                cast(
+                    "str",
+                    finders.find("weblate_fonts/source-sans/ttf/SourceSans3-Bold.ttf"),
+                )
+            ),
+            _get_static_assets(paths),
+        )
+
+        with TemporaryDirectory() as temp_dir:
+            asset = Path(temp_dir) / "logo.png"
+            asset.write_bytes(b"logo")
+            with patch(
+                "weblate_web.invoices.models._get_static_assets",
+                return_value=(asset,),
+            ):
+                digest = get_templates_digest()
+                asset.write_bytes(b"new logo")
+                mtime = asset.stat().st_mtime_ns + 1_000_000_000
+                os.utime(asset, ns=(mtime, mtime))
+                self.assertNotEqual(get_templates_digest(), digest)
+
+    @responses.activate
+    def test_pdf_layout_count(self) -> None:
+        self.mock_requests()
+        self.use_temporary_invoices_path()
+        typical = self.create_invoice(kind=InvoiceKind.QUOTE)
+        long = self.create_invoice(kind=InvoiceKind.QUOTE)
+        long.invoiceitem_set.bulk_create(
+            InvoiceItem(invoice=long, description=f"Item {index}", unit_price=1)
+            for index in range(100)
+        )
+
+        with patch(
+            "weblate_web.invoices.models.render_pdf_document",
+            wraps=render_pdf_document,
+        ) as render:
+            typical.generate_pdf()
+            self.assertEqual(render.call_count, 1)
+
+            render.reset_mock()
+            long.generate_pdf()
+            self.assertEqual(render.call_count, 2)
+
+    @responses.activate
+    def test_pdf_render_context_reused(self) -> None:
+        self.mock_requests()
+        self.use_temporary_invoices_path()
+        invoices = [self.create_invoice(kind=InvoiceKind.QUOTE) for _ in range(3)]
+        reset_render_context()
+
+        with (
+            patch("weblate_web.pdf.CSS", wraps=CSS) as css,
+            patch(
+                "weblate_web.pdf.FontConfiguration", wraps=FontConfiguration
+            ) as font_config,
+        ):
+            invoices[0].generate_pdf()
+            files = dict(get_render_context().url_fetcher.files)
+            for invoice in invoices[1:]:
+                invoice.generate_pdf()
+
+        # Fonts are parsed once for the whole batch
+        self.assertEqual(css.call_count, 1)
+        self.assertEqual(font_config.call_count, 1)
+        cached_files = get_render_context().url_fetcher.files
+        self.assertTrue(files)
+        for path, (_mtime, content) in files.items():
+            self.assertIs(cached_files[path][1], content)
+
+    def test_pdf_render_context_per_thread(self) -> None:
+        reset_render_context()
+        context = get_render_context()
+        self.assertIs(get_render_context(), context)
+
+        # Font configuration is not shared with other threads
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            other = executor.submit(get_render_context).result()
+        self.assertIsNot(other, context)
+        self.assertIsNot(other.font_config, context.font_config)
+        self.assertIs(get_render_context(), context)
+
+    def test_pdf_fetcher_reloads_changed_file(self) -> None:
+        fetcher = WeblateUrlFetcher()
+        with TemporaryDirectory() as tempdir:
+            path = Path(tempdir) / "test.css"
+            path.write_text("body {}")
+            self.assertEqual(fetcher.read_file(path), b"body {}")
+            path.write_text("html {}")
+            mtime = fetcher.files[path][0] + 1_000_000_000
+            os.utime(path, ns=(mtime, mtime))
+            self.assertEqual(fetcher.read_file(path), b"html {}")
+
+    @responses.activate
+    def test_regenerate_invoices(self) -> None:
+        self.mock_requests()
+        with (
+            TemporaryDirectory() as temp_dir,
+            override_settings(INVOICES_PATH=Path(temp_dir)),
+        ):
+            invoices = [self.create_invoice(kind=InvoiceKind.QUOTE) for _ in range(2)]
+            self.create_invoice(kind=InvoiceKind.DRAFT)
+            checkpoint = Path(temp_dir) / "checkpoint"
+
+            output = StringIO()
+            call_command(
+                "regenerate_invoices", "--kind=quote", "--dry-run", stdout=output
+            )
+            self.assertIn("2 invoices need regeneration", output.getvalue())
+            self.assertFalse(invoices[0].path.exists())
+
+            output = StringIO()
+            call_command(
+                "regenerate_invoices",
+                "--kind=quote",
+                "--jobs=1",
+                f"--checkpoint={checkpoint}",
+                stdout=output,
+            )
+            self.assertIn("Regenerated 2 invoices", output.getvalue())
+            for invoice in invoices:
+                self.assertTrue(invoice.path.exists())
+                self.assertTrue(invoice.xml_path.exists())
+            self.assertEqual(
+                set(checkpoint.read_text().split()),
+                {str(invoice.pk) for invoice in invoices},
+            )
+
+            output = StringIO()
+            call_command(
+                "regenerate_invoices", "--kind=quote", "--dry-run", stdout=output
+            )
+            self.assertIn("0 invoices need regeneration", output.getvalue())
+
+            # Staleness does not depend on file modification times
+            os.utime(invoices[0].path, ns=(0, 0))
+            output = StringIO()
+            call_command(
+                "regenerate_invoices", "--kind=quote", "--dry-run", stdout=output
+            )
+            self.assertIn("0 invoices need regeneration", output.getvalue())
+
+            # PDF files generated from other templates are stale
+            with patch(
+                "weblate_web.invoices.models.get_templates_digest",
+                return_value="changed",
+            ):
+                output = StringIO()
+                call_command(
+                    "regenerate_invoices", "--kind=quote", "--dry-run", stdout=output
+                )
+            self.assertIn("2 invoices need regeneration", output.getvalue())
+
+            # Forced run rewrites files with unchanged fingerprint
+            with patch("weblate_web.invoices.models.write_pdf_document") as write_pdf:
+                output = StringIO()
+                call_command(
+                    "regenerate_invoices",
+                    "--kind=quote",
+                    "--force",
+                    "--jobs=1",
+                    f"--checkpoint={checkpoint}",
+                    stdout=output,
+                )
+            self.assertIn("Regenerated 2 invoices", output.getvalue())
+            self.assertEqual(write_pdf.call_count, 2)
+
+            # Resumed run skips invoices recorded in the checkpoint
+            output = StringIO()
+            call_command(
+                "regenerate_invoices",
+                "--force",
+                "--resume",
+                "--jobs=1",
+                f"--checkpoint={checkpoint}",
+                stdout=output,
+            )
+            self.assertIn("Regenerated 1 invoices", output.getvalue())
+
+    def use_temporary_invoices_path(self) -> None:
+        # Unchanged files are not generated again
+        temp_dir = self.enterContext(TemporaryDirectory())
+        self.enterContext(override_settings(INVOICES_PATH=Path(temp_dir)))
+
     def mock_requests(self) -> None:
         mock_vies()
         cnb_mock_rates()
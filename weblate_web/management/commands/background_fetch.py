@@ -39,7 +39,7 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options) -> None:
         self.disable_stale_services()
-        get_contributors(force=True)
-        get_activity(force=True)
-        get_changes(force=True)
-        get_release(force=True)
+        get_contributors(refresh=True)
+        get_activity(refresh=True)
+        get_changes(refresh=True)
+        get_release(refresh=True)
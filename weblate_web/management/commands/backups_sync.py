@@ -214,7 +214,9 @@ class Command(BaseCommand):
     def handle(self, delete: bool, skip_scan: bool, **kwargs) -> None:
         backup_services: dict[str, Service] = {
             service.backup_repository: service
-            for service in Service.objects.exclude(backup_repository="")
+            for service in Service.objects.exclude(
+                backup_repository=""
+            ).with_subscription_index()
         }
 
         processed_repositories = self.sync_data(backup_services)
@@ -0,0 +1,124 @@
+#
+# Copyright © Michal Čihař <michal@weblate.org>
+#
+# This file is part of Weblate <https://weblate.org/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from __future__ import annotations
+
+import math
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+import requests
+import sentry_sdk
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from weblate_web.payments.backends import BACKENDS, PaymentError, ThePay2Card
+from weblate_web.payments.models import Payment
+
+
+def percentile(values: list[float], percent: int) -> float:
+    """Nearest-rank percentile of sorted values."""
+    if not values:
+        return 0.0
+    rank = math.ceil(percent / 100 * len(values))
+    return values[max(rank, 1) - 1]
+
+
+class Command(BaseCommand):
+    help = "collects state of pending The Pay payments"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=None,
+            help="Number of concurrent API requests, defaults to THEPAY_POOL_SIZE",
+        )
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=None,
+            help="Maximal number of payments to collect",
+        )
+
+    @staticmethod
+    @transaction.atomic
+    def complete_payment(payment_pk: str) -> str:
+        payment = Payment.objects.get(pk=payment_pk)
+        backend = payment.get_payment_backend()
+        # Might have been completed meanwhile by the notification
+        if backend.payment.state == Payment.PENDING:
+            backend.complete(None)
+        return backend.payment.get_state_display()
+
+    @classmethod
+    def collect_payment(cls, payment_pk: str) -> tuple[str, float]:
+        start = perf_counter()
+        try:
+            state = cls.complete_payment(payment_pk)
+        except (PaymentError, ValueError, requests.RequestException):
+            sentry_sdk.capture_exception()
+            state = "error"
+        return state, perf_counter() - start
+
+    @classmethod
+    def collect_payment_thread(cls, payment_pk: str) -> tuple[str, float]:
+        try:
+            return cls.collect_payment(payment_pk)
+        finally:
+            # Each worker thread has own database connection
+            connection.close()
+
+    def handle(self, *args, **options) -> None:
+        concurrency = options["concurrency"] or settings.THEPAY_POOL_SIZE
+        backends = [
+            name
+            for name, backend in BACKENDS.items()
+            if issubclass(backend, ThePay2Card)
+        ]
+        payments = Payment.objects.filter(
+            state=Payment.PENDING, backend__in=backends
+        ).order_by("created")
+        pks = list(payments.values_list("pk", flat=True)[: options["limit"]])
+
+        start = perf_counter()
+        if concurrency > 1 and len(pks) > 1:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                results = list(executor.map(self.collect_payment_thread, pks))
+        else:
+            results = [self.collect_payment(pk) for pk in pks]
+        elapsed = perf_counter() - start
+
+        for state, count in sorted(Counter(state for state, _ in results).items()):
+            self.stdout.write(f"{state}: {count}")
+        latencies = sorted(latency for _, latency in results)
+        throughput = len(results) / elapsed if elapsed else 0.0
+        self.stdout.write(
+            f"Collected {len(results)} payments in {elapsed:.2f} s "
+            f"({throughput:.1f}/s, concurrency {concurrency})"
+        )
+        if latencies:
+            self.stdout.write(
+                f"Latency p50 {percentile(latencies, 50):.3f} s, "
+                f"p90 {percentile(latencies, 90):.3f} s, "
+                f"p99 {percentile(latencies, 99):.3f} s, "
+                f"max {latencies[-1]:.3f} s"
+            )
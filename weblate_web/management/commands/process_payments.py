@@ -38,8 +38,8 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options) -> None:
         if settings.FIO_TOKEN:
-            with transaction.atomic():
-                FioBank.fetch_payments(from_date=options["from_date"])
+            # Each bank transaction is committed separately
+            FioBank.fetch_payments(from_date=options["from_date"])
         with transaction.atomic():
             self.pending()
 
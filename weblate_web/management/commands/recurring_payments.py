@@ -19,6 +19,7 @@
 
 from __future__ import annotations
 
+from collections import defaultdict
 from datetime import timedelta
 from typing import TYPE_CHECKING
 
@@ -30,7 +31,13 @@ from django.utils import timezone
 from django.utils.html import strip_tags
 
 from weblate_web.invoices.models import InvoiceKind
-from weblate_web.models import Service, ServiceKind, Subscription, get_period_delta
+from weblate_web.models import (
+    Service,
+    ServiceKind,
+    Subscription,
+    SubscriptionPastPayment,
+    get_period_delta,
+)
 from weblate_web.payments.models import Customer, Payment
 from weblate_web.payments.utils import send_notification
 
@@ -38,6 +45,7 @@ if TYPE_CHECKING:
     from collections.abc import Iterable
     from datetime import datetime
     from decimal import Decimal
+    from uuid import UUID
 
 
 class Command(BaseCommand):
@@ -87,8 +95,10 @@ class Command(BaseCommand):
         )
         expires_notify = timestamp + timedelta(days=max(31, customer_notification_days))
 
-        subscriptions = Subscription.objects.payment_lifecycle().filter(
-            expires__lte=expires_notify,
+        subscriptions = (
+            Subscription.objects.payment_lifecycle()
+            .with_renewal_state()
+            .filter(expires__lte=expires_notify)
         )
         for subscription in subscriptions:
             if not subscription.uses_payment_lifecycle():
@@ -133,14 +143,61 @@ class Command(BaseCommand):
 
     @staticmethod
     def handle_services() -> None:
-        for service in Service.objects.customer_services():
-            service.update_status()
+        for service in Service.objects.customer_services().update_status():
             service.create_backup()
 
+    @staticmethod
+    def get_rejected_counts(subscriptions: list[Subscription]) -> dict[int, int]:
+        """
+        Count rejected repeated payments since the last processed one.
+
+        Only payments listed by Subscription.list_payments are considered,
+        all subscriptions are handled by two queries.
+        """
+        if not subscriptions:
+            return {}
+        roots: dict[int, UUID] = {
+            subscription.pk: subscription.payment_obj.repeat_id
+            or subscription.payment_obj.pk
+            for subscription in subscriptions
+        }
+        past: dict[int, set[UUID]] = defaultdict(set)
+        for subscription_id, payment_id in SubscriptionPastPayment.objects.filter(
+            subscription_id__in=roots
+        ).values_list("subscription_id", "payment_id"):
+            past[subscription_id].add(payment_id)
+        repeats: dict[UUID, list[tuple[UUID, int, datetime]]] = defaultdict(list)
+        for pk, repeat_id, state, created in Payment.objects.filter(
+            repeat_id__in=set(roots.values()),
+            state__in={Payment.REJECTED, Payment.PROCESSED},
+        ).values_list("pk", "repeat_id", "state", "created"):
+            repeats[repeat_id].append((pk, state, created))
+
+        result: dict[int, int] = {}
+        for subscription in subscriptions:
+            root = roots[subscription.pk]
+            related = {subscription.payment_id, *past[subscription.pk]}
+            payments = [
+                (state, created)
+                for pk, state, created in repeats[root]
+                if root in related or pk in related
+            ]
+            last_processed = max(
+                (created for state, created in payments if state == Payment.PROCESSED),
+                default=None,
+            )
+            result[subscription.pk] = sum(
+                1
+                for state, created in payments
+                if state == Payment.REJECTED
+                and (last_processed is None or created > last_processed)
+            )
+        return result
+
     @staticmethod
     def peform_payment(  # ruff:ignore[too-many-arguments]
         payment,
-        past_payments,
+        rejected_count: int,
         *,
         recurring: str,
         end_date: datetime,
@@ -148,18 +205,7 @@ class Command(BaseCommand):
         extra: dict[str, int],
     ) -> None:
         # Allow at most three failures of current payment method
-        repeated_payments = past_payments.filter(repeat=payment.repeat or payment)
-        rejected_payments = repeated_payments.filter(state=Payment.REJECTED)
-        last_processed = (
-            repeated_payments.filter(state=Payment.PROCESSED)
-            .order_by("-created")
-            .first()
-        )
-        if last_processed is not None:
-            rejected_payments = rejected_payments.filter(
-                created__gt=last_processed.created
-            )
-        if rejected_payments.count() >= 3:
+        if rejected_count >= 3:
             payment.recurring = ""
             payment.save()
             return
@@ -230,14 +276,34 @@ class Command(BaseCommand):
     ) -> list[tuple[Subscription, Payment | None]]:
         now = timezone.now()
         disable_donations: list[tuple[Subscription, Payment | None]] = []
-        subscriptions = Subscription.objects.payment_lifecycle().filter(
-            expires__range=(now - timedelta(days=10), now + timedelta(days=3)),
+        subscriptions = (
+            Subscription.objects.payment_lifecycle()
+            .with_renewal_state()
+            .filter(
+                expires__range=(now - timedelta(days=10), now + timedelta(days=3)),
+            )
         )
         if service_kind is not None:
             subscriptions = subscriptions.filter(service__kind=service_kind)
-        for subscription in subscriptions:
-            if not subscription.uses_payment_lifecycle():
-                continue
+        candidates = [
+            subscription
+            for subscription in subscriptions
+            if subscription.uses_payment_lifecycle()
+        ]
+        # Count rejected payments for all possible renewals at once
+        rejected_counts = cls.get_rejected_counts(
+            [
+                subscription
+                for subscription in candidates
+                if subscription.payment_obj.recurring
+            ]
+        )
+        renewed_services: set[int] = set()
+        for subscription in candidates:
+            if subscription.service_id in renewed_services:
+                # Renewal of other subscription might have made this one obsolete,
+                # check without the annotation computed before the renewals
+                del subscription.has_newer_support  # type: ignore[attr-defined]
 
             # Skip this in case there is another subscription, for example on service
             # upgrade on downgrade
@@ -269,10 +335,11 @@ class Command(BaseCommand):
                         )
                 continue
 
+            renewed_services.add(subscription.service_id)
             # Trigger recurring payment
             cls.peform_payment(
                 payment,
-                subscription.list_payments(),
+                rejected_counts[subscription.pk],
                 amount=subscription.get_renewal_amount(),
                 recurring=recurring,
                 end_date=subscription.expires,
@@ -17,17 +17,25 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+from __future__ import annotations
+
 from base64 import b64encode
 from secrets import token_bytes
+from typing import TYPE_CHECKING
 
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 from django.urls import reverse
 from django.utils.translation import get_language
 from weblate_language_data.docs import DOCUMENTATION_LANGUAGES
 
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Iterator
+
 SENTRY_KEY = "5eb5194266692a262a4f8a6aad7a25b6"
 SENTRY_URL = f"https://o4507304895905792.ingest.de.sentry.io/api/4507486269866064/security/?sentry_key={SENTRY_KEY}"
 
+DOCUMENTATION_URL = b"https://docs.weblate.org/en/"
 
 CSP_TEMPLATE = (
     "default-src 'self'; "
@@ -42,6 +50,79 @@ CSP_TEMPLATE = (
     "form-action {form};"
     "report-uri {report}"
 )
+CSP_NONCE = "{nonce}"
+CSP_SOURCES: dict[str, list[str]] = {
+    "style": ["'self'"],
+    "script": [
+        "'self'",
+        CSP_NONCE,
+        # Sentry/Raven
+        "browser.sentry-cdn.com",
+        "de.sentry.io",
+    ],
+    "connect": [
+        "'self'",
+        # Sentry/Raven
+        "de.sentry.io",
+    ],
+    "image": [
+        "'self'",
+        "data:",
+        # Hosted Weblate widget
+        "hosted.weblate.org",
+        # Old blog entries
+        "blog.cihar.com",
+        # The Pay
+        "gate.thepay.cz",
+        # GitHub avatars
+        "*.githubusercontent.com",
+    ],
+    "font": ["'self'"],
+    "form": [
+        "'self'",
+        "weblate.org",
+        "hosted.weblate.org",
+        # The Pay
+        "gate.thepay.cz",
+        "thepay.cz",
+    ],
+}
+EXPECT_CT = f'max-age=86400, enforce, report-uri="{SENTRY_URL}"'
+
+
+def register_csp_source(directive: str, *sources: str) -> None:
+    """
+    Allow additional sources in the Content-Security-Policy.
+
+    This has to be called before the middleware is initialized, extra sources
+    can also be configured using the CSP_EXTRA_SOURCES setting.
+    """
+    if directive not in CSP_SOURCES:
+        raise ValueError(f"Unsupported CSP directive: {directive}")
+    CSP_SOURCES[directive].extend(
+        source for source in sources if source not in CSP_SOURCES[directive]
+    )
+
+
+def build_csp_template(extra_sources: dict[str, list[str]]) -> tuple[str, str]:
+    """Build Content-Security-Policy split around the nonce."""
+    sources = {
+        directive: [
+            *values,
+            *(
+                source
+                for source in extra_sources.get(directive, ())
+                if source not in values
+            ),
+        ]
+        for directive, values in CSP_SOURCES.items()
+    }
+    policy = CSP_TEMPLATE.format(
+        **{directive: " ".join(values) for directive, values in sources.items()},
+        report=SENTRY_URL,
+    )
+    prefix, suffix = policy.split(CSP_NONCE)
+    return f"{prefix}'nonce-", f"'{suffix}"
 
 
 def add_agent_discovery_link_header(request, response) -> None:
@@ -64,6 +145,29 @@ def add_agent_discovery_link_header(request, response) -> None:
         response["Link"] = links
 
 
+def rewrite_doc_links(chunks: Iterable[bytes], replacement: bytes) -> Iterator[bytes]:
+    """
+    Replace English documentation links in streamed content.
+
+    The tail of each chunk which could be a start of a link split across
+    chunk boundary is held back until the next chunk arrives.
+    """
+    pending = b""
+    for chunk in chunks:
+        buffer = pending + chunk if pending else chunk
+        pending = b""
+        for length in range(min(len(DOCUMENTATION_URL), len(buffer) + 1) - 1, 0, -1):
+            if buffer.endswith(DOCUMENTATION_URL[:length]):
+                buffer, pending = buffer[:-length], buffer[-length:]
+                break
+        if DOCUMENTATION_URL in buffer:
+            buffer = buffer.replace(DOCUMENTATION_URL, replacement)
+        if buffer:
+            yield buffer
+    if pending:
+        yield pending
+
+
 class SecurityMiddleware:
     """
     Middleware that sets various security related headers.
@@ -74,6 +178,12 @@ class SecurityMiddleware:
 
     def __init__(self, get_response=None) -> None:
         self.get_response = get_response
+        for directive in settings.CSP_EXTRA_SOURCES:
+            if directive not in CSP_SOURCES:
+                raise ImproperlyConfigured(f"Unsupported CSP directive: {directive}")
+        self.csp_prefix, self.csp_suffix = build_csp_template(
+            settings.CSP_EXTRA_SOURCES
+        )
 
     def __call__(self, request):
         request.csp_nonce = b64encode(token_bytes(16)).decode("ascii")
@@ -84,42 +194,10 @@ class SecurityMiddleware:
         if settings.DEBUG:
             return response
 
-        style = ["'self'"]
-        script = ["'self'", f"'nonce-{request.csp_nonce}'"]
-        connect = ["'self'"]
-        image = ["'self'", "data:"]
-        font = ["'self'"]
-        form = ["'self'", "weblate.org", "hosted.weblate.org"]
-
-        # Sentry/Raven
-        script.append("browser.sentry-cdn.com")
-        connect.append("de.sentry.io")
-        script.append("de.sentry.io")
-
-        # Hosted Weblate widget
-        image.append("hosted.weblate.org")
-
-        # Old blog entries
-        image.append("blog.cihar.com")
-
-        # The Pay
-        image.append("gate.thepay.cz")
-        form.append("gate.thepay.cz")
-        form.append("thepay.cz")
-
-        # GitHub avatars
-        image.append("*.githubusercontent.com")
-
-        response["Content-Security-Policy"] = CSP_TEMPLATE.format(
-            style=" ".join(style),
-            image=" ".join(image),
-            script=" ".join(script),
-            font=" ".join(font),
-            connect=" ".join(connect),
-            form=" ".join(form),
-            report=SENTRY_URL,
+        response["Content-Security-Policy"] = (
+            f"{self.csp_prefix}{request.csp_nonce}{self.csp_suffix}"
         )
-        response["Expect-CT"] = f'max-age=86400, enforce, report-uri="{SENTRY_URL}"'
+        response["Expect-CT"] = EXPECT_CT
         response["X-XSS-Protection"] = "1; mode=block"
         # Opt-out from Google FLoC
         response["Permissions-Policy"] = "interest-cohort=()"
@@ -149,11 +227,21 @@ class LocalizedDocumentationMiddleware:
 
     def adjust_doc_links(self, response) -> None:
         lang = get_language()
-        if lang in DOCUMENTATION_LANGUAGES:
-            response.content = response.content.replace(
-                b"https://docs.weblate.org/en/",
-                f"https://docs.weblate.org/{DOCUMENTATION_LANGUAGES[lang]}/".encode(),
-            )
+        if lang not in DOCUMENTATION_LANGUAGES:
+            return
+        replacement = (
+            f"https://docs.weblate.org/{DOCUMENTATION_LANGUAGES[lang]}/".encode()
+        )
+        if response.streaming:
+            # Async iterators would need to be consumed in an event loop
+            if not response.is_async:
+                response.streaming_content = rewrite_doc_links(
+                    response.streaming_content, replacement
+                )
+            return
+        content = response.content
+        if DOCUMENTATION_URL in content:
+            response.content = content.replace(DOCUMENTATION_URL, replacement)
 
     def __call__(self, request):
         response = self.get_response(request)
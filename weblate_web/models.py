@@ -19,6 +19,7 @@
 
 from __future__ import annotations
 
+from collections import defaultdict
 from datetime import datetime, timedelta
 from decimal import ROUND_CEILING, Decimal
 from io import BytesIO
@@ -30,11 +31,23 @@ import html2text
 from dateutil.relativedelta import relativedelta
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import FileExtensionValidator
 from django.db import models, transaction
-from django.db.models import IntegerChoices, Q
+from django.db.models import (
+    Case,
+    Exists,
+    IntegerChoices,
+    OuterRef,
+    Prefetch,
+    Q,
+    Value,
+    When,
+)
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.crypto import get_random_string
@@ -72,7 +85,7 @@ from .packages import (
 from .url_utils import normalize_site_url, normalize_site_url_for_lock
 
 if TYPE_CHECKING:
-    from collections.abc import Collection, Generator
+    from collections.abc import Collection, Generator, Iterable
     from datetime import date
 
     from weblate_web.invoices.models import InvoiceKind
@@ -88,6 +101,25 @@ PILLOW_VALIDATION_ERRORS = (
     PILImage.DecompressionBombError,
 )
 MINIMUM_UPGRADE_PAYMENT = Decimal(5)
+# Support packages which are skipped on renewal when superseded
+OBSOLETE_SUPPORT_PACKAGES = frozenset({"basic", "extended", "premium"})
+# Packages renewed periodically, see Package.get_repeat
+REPEATING_PACKAGES = frozenset({"basic", "extended", "premium", "backup"})
+# Service statuses by priority
+SERVICE_STATUS_PRIORITY = ("hosted", "shared", "premium", "extended", "basic")
+SERVICE_STATUS_FIELDS = (
+    "status",
+    "limit_source_strings",
+    "limit_hosted_words",
+    "limit_hosted_strings",
+    "limit_languages",
+    "limit_projects",
+)
+
+DONATE_LINKS_CACHE_KEY = "wlweb-donate-links"
+DONATE_LINKS_CACHE_TIMEOUT = 3600
+HOSTING_PACKAGES_CACHE_KEY = "wlweb-hosting-packages"
+HOSTING_PACKAGES_CACHE_TIMEOUT = 72 * 3600
 
 
 class SamlIdentity(models.Model):
@@ -130,6 +162,38 @@ class ExternalSyncState(models.Model):
         return self.key
 
 
+class RemoteData(models.Model):
+    """Last successfully fetched remote data and refresh state."""
+
+    key = models.CharField(max_length=100, unique=True)
+    data = models.JSONField(default=list, encoder=DjangoJSONEncoder)
+    updated = models.DateTimeField(blank=True, null=True)
+    failures = models.PositiveIntegerField(default=0)
+    retry_after = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        verbose_name = "Remote data"
+        verbose_name_plural = "Remote data"
+
+    def __str__(self) -> str:
+        return self.key
+
+
+class ExchangeRate(models.Model):
+    """Exchange rates published by CNB for a single day."""
+
+    date = models.DateField(unique=True)
+    # Currency code to CZK rate, BTC is stored along fiat currencies
+    rates = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+
+    class Meta:
+        verbose_name = "Exchange rate"
+        verbose_name_plural = "Exchange rates"
+
+    def __str__(self) -> str:
+        return self.date.isoformat()
+
+
 REWARDS = (
     (0, gettext_lazy("No reward")),
     (1, gettext_lazy("Name in the list of supporters")),
@@ -629,6 +693,12 @@ class PackageCategory(IntegerChoices):
     PACKAGE_DONATION = 40, pgettext_lazy("Package category", "Donation")
 
 
+# Hosting package categories renewed periodically, see Package.get_repeat
+REPEATING_PACKAGE_CATEGORIES = frozenset(
+    {PackageCategory.PACKAGE_DEDICATED, PackageCategory.PACKAGE_SHARED}
+)
+
+
 class Package(models.Model):
     name = models.CharField(max_length=150, unique=True)
     verbose = models.CharField(max_length=400)
@@ -677,12 +747,9 @@ class Package(models.Model):
         return self.limit_hosted_strings >= DEDICATED_LIMIT
 
     def get_repeat(self) -> str:
-        if self.name in {"basic", "extended", "premium", "backup"}:
+        if self.name in REPEATING_PACKAGES:
             return "y"
-        if self.category in {
-            PackageCategory.PACKAGE_DEDICATED,
-            PackageCategory.PACKAGE_SHARED,
-        }:
+        if self.category in REPEATING_PACKAGE_CATEGORIES:
             if self.name.endswith("-m"):
                 return "m"
             return "y"
@@ -720,6 +787,85 @@ class ServiceQuerySet(models.QuerySet["Service", "Service"]):
     def donations(self) -> ServiceQuerySet:
         return self.filter(kind=ServiceKind.DONATION)
 
+    def with_subscription_index(self) -> ServiceQuerySet:
+        """Prefetch subscriptions used by Service.subscription_index."""
+        return self.prefetch_related(
+            Prefetch(
+                "subscription_set",
+                queryset=Subscription.objects.select_related("package").order_by(
+                    "-expires"
+                ),
+            )
+        )
+
+    def with_package_kind(self) -> ServiceQuerySet:
+        """Annotate Service.package_kind so that it can be used for ordering."""
+
+        def has_subscription(condition: Q) -> Exists:
+            return Exists(
+                Subscription.objects.filter(condition, service=OuterRef("pk"))
+            )
+
+        return self.annotate(
+            package_kind_label=Case(
+                When(kind=ServiceKind.DONATION, then=Value("Donation")),
+                When(
+                    has_subscription(
+                        Q(package__category=PackageCategory.PACKAGE_DEDICATED)
+                    ),
+                    then=Value("Dedicated service"),
+                ),
+                When(
+                    has_subscription(
+                        Q(package__category=PackageCategory.PACKAGE_SHARED)
+                    ),
+                    then=Value("Hosted service"),
+                ),
+                When(
+                    has_subscription(Q(package__name__in=OBSOLETE_SUPPORT_PACKAGES)),
+                    then=Value("Support"),
+                ),
+                When(
+                    has_subscription(Q(package__name="backup")),
+                    then=Value("Backup"),
+                ),
+                default=Value("Community support"),
+            )
+        )
+
+    def update_status(self) -> list[Service]:
+        """
+        Update status and limits of services in bulk.
+
+        Returns services which qualify for creating a backup repository.
+        """
+        services = self.exclude(kind=ServiceKind.DONATION)
+        community = Package.objects.get(name="community")
+        active: dict[int, list[Subscription]] = defaultdict(list)
+        for subscription in (
+            Subscription.objects.filter(
+                service__in=services.values("pk"), expires__gt=timezone.now()
+            )
+            .select_related("package")
+            .order_by("-expires")
+        ):
+            active[subscription.service_id].append(subscription)
+
+        changed: list[Service] = []
+        backup: list[Service] = []
+        for service in services:
+            subscriptions = active[service.pk]
+            if service.set_status(*service.get_status(subscriptions, community)):
+                changed.append(service)
+            if not service.backup_repository and any(
+                subscription.package.category == PackageCategory.PACKAGE_DEDICATED
+                or subscription.package.name == "backup"
+                for subscription in subscriptions
+            ):
+                backup.append(service)
+        Service.objects.bulk_update(changed, SERVICE_STATUS_FIELDS, batch_size=1000)
+        return backup
+
 
 class Service(models.Model):  # ruff:ignore[too-many-public-methods]
     secret = models.CharField(max_length=100, default=generate_secret, db_index=True)
@@ -938,6 +1084,12 @@ class Service(models.Model):  # ruff:ignore[too-many-public-methods]
 
     @property
     def package_kind(self) -> str:
+        # Annotated by ServiceQuerySet.with_package_kind
+        if hasattr(self, "package_kind_label"):
+            return self.package_kind_label
+        return self.get_package_kind()
+
+    def get_package_kind(self) -> str:
         if self.is_donation:
             return "Donation"
         if self.hosted_subscriptions:
@@ -955,26 +1107,67 @@ class Service(models.Model):  # ruff:ignore[too-many-public-methods]
         return "Community support"
 
     @cached_property
-    def hosted_subscriptions(self) -> models.QuerySet[Subscription]:
-        return self.subscription_set.filter(
-            package__category=PackageCategory.PACKAGE_DEDICATED
-        ).order_by("-expires")
+    def subscription_index(self) -> dict[str, list[Subscription]]:
+        """
+        Subscriptions grouped by package, ordered by expiry.
 
-    @cached_property
-    def shared_subscriptions(self) -> models.QuerySet[Subscription]:
-        return self.subscription_set.filter(
-            package__category=PackageCategory.PACKAGE_SHARED
-        ).order_by("-expires")
+        Uses subscriptions prefetched by ServiceQuerySet.with_subscription_index
+        when available.
+        """
+        if "subscription_set" in getattr(self, "_prefetched_objects_cache", {}):
+            subscriptions = self.subscription_set.all()
+        else:
+            subscriptions = self.subscription_set.select_related("package").order_by(
+                "-expires"
+            )
+        index: dict[str, list[Subscription]] = {}
+        for subscription in subscriptions:
+            package = subscription.package
+            keys = ["all"]
+            if package.category == PackageCategory.PACKAGE_DEDICATED:
+                keys.append("hosted")
+            elif package.category == PackageCategory.PACKAGE_SHARED:
+                keys.append("shared")
+            elif package.category == PackageCategory.PACKAGE_DONATION:
+                keys.append("donation")
+            if package.name in {"basic", "extended", "premium", "backup"}:
+                keys.append(package.name)
+            if (
+                "hosted" in keys
+                or "shared" in keys
+                or package.name
+                in {
+                    "basic",
+                    "extended",
+                    "premium",
+                }
+            ):
+                keys.append("support")
+            if subscription.enabled:
+                keys.append("enabled")
+            for key in keys:
+                index.setdefault(key, []).append(subscription)
+        return index
+
+    def clear_subscription_index(self) -> None:
+        self.__dict__.pop("subscription_index", None)
+        getattr(self, "_prefetched_objects_cache", {}).pop("subscription_set", None)
 
-    @cached_property
-    def basic_subscriptions(self) -> models.QuerySet[Subscription]:
-        return self.subscription_set.filter(package__name="basic").order_by("-expires")
+    @property
+    def hosted_subscriptions(self) -> list[Subscription]:
+        return self.subscription_index.get("hosted", [])
 
-    @cached_property
-    def extended_subscriptions(self) -> models.QuerySet[Subscription]:
-        return self.subscription_set.filter(package__name="extended").order_by(
-            "-expires"
-        )
+    @property
+    def shared_subscriptions(self) -> list[Subscription]:
+        return self.subscription_index.get("shared", [])
+
+    @property
+    def basic_subscriptions(self) -> list[Subscription]:
+        return self.subscription_index.get("basic", [])
+
+    @property
+    def extended_subscriptions(self) -> list[Subscription]:
+        return self.subscription_index.get("extended", [])
 
     @property
     def has_active_extended_support(self) -> bool:
@@ -984,31 +1177,21 @@ class Service(models.Model):  # ruff:ignore[too-many-public-methods]
             for subscription in self.extended_subscriptions
         )
 
-    @cached_property
-    def premium_subscriptions(self) -> models.QuerySet[Subscription]:
-        return self.subscription_set.filter(package__name="premium").order_by(
-            "-expires"
-        )
+    @property
+    def premium_subscriptions(self) -> list[Subscription]:
+        return self.subscription_index.get("premium", [])
 
-    @cached_property
-    def support_subscriptions(self) -> models.QuerySet[Subscription]:
-        return (
-            self.hosted_subscriptions
-            | self.shared_subscriptions
-            | self.basic_subscriptions
-            | self.extended_subscriptions
-            | self.premium_subscriptions
-        ).order_by("-expires")
+    @property
+    def support_subscriptions(self) -> list[Subscription]:
+        return self.subscription_index.get("support", [])
 
-    @cached_property
-    def backup_subscriptions(self) -> models.QuerySet[Subscription]:
-        return self.subscription_set.filter(package__name="backup").order_by("-expires")
+    @property
+    def backup_subscriptions(self) -> list[Subscription]:
+        return self.subscription_index.get("backup", [])
 
-    @cached_property
-    def donation_subscriptions(self) -> models.QuerySet[Subscription]:
-        return self.subscription_set.filter(
-            package__category=PackageCategory.PACKAGE_DONATION
-        ).order_by("-expires")
+    @property
+    def donation_subscriptions(self) -> list[Subscription]:
+        return self.subscription_index.get("donation", [])
 
     @cached_property
     def donation_subscription(self) -> Subscription | None:
@@ -1058,9 +1241,9 @@ class Service(models.Model):  # ruff:ignore[too-many-public-methods]
             return None
         return self.latest_subscription
 
-    @cached_property
-    def enabled_subscriptions(self) -> models.QuerySet[Subscription]:
-        return self.subscription_set.filter(enabled=True).order_by("-expires")
+    @property
+    def enabled_subscriptions(self) -> list[Subscription]:
+        return self.subscription_index.get("enabled", [])
 
     @cached_property
     def expires(self):
@@ -1156,41 +1339,66 @@ class Service(models.Model):  # ruff:ignore[too-many-public-methods]
 
         return result
 
+    @staticmethod
+    def get_status(
+        subscriptions: Iterable[Subscription], community: Package
+    ) -> tuple[str, Package]:
+        """Get status and limits package from active subscriptions."""
+        packages: dict[str, Package] = {}
+        # Subscriptions are ordered by expiry, the latest one defines limits
+        for subscription in subscriptions:
+            package = subscription.package
+            if package.category == PackageCategory.PACKAGE_DEDICATED:
+                status = "hosted"
+            elif package.category == PackageCategory.PACKAGE_SHARED:
+                status = "shared"
+            elif package.name in OBSOLETE_SUPPORT_PACKAGES:
+                status = package.name
+            else:
+                continue
+            packages.setdefault(status, package)
+        for status in SERVICE_STATUS_PRIORITY:
+            if status in packages:
+                if status in {"hosted", "shared"}:
+                    return status, packages[status]
+                return status, community
+        return "community", community
+
+    def set_status(self, status: str, package: Package) -> bool:
+        """Set status and limits, returns whether anything has changed."""
+        if (
+            status == self.status
+            and package.limit_source_strings == self.limit_source_strings
+            and package.limit_hosted_words == self.limit_hosted_words
+            and package.limit_hosted_strings == self.limit_hosted_strings
+        ):
+            return False
+        self.status = status
+        self.limit_source_strings = package.limit_source_strings
+        self.limit_hosted_words = package.limit_hosted_words
+        self.limit_hosted_strings = package.limit_hosted_strings
+        self.limit_languages = package.limit_languages
+        self.limit_projects = package.limit_projects
+        return True
+
     def update_status(self) -> None:
         if self.is_donation:
             return
-        status = "community"
-        package = Package.objects.get(name="community")
-        if self.hosted_subscriptions.filter(expires__gt=timezone.now()).exists():
-            status = "hosted"
-            package = self.hosted_subscriptions.latest("expires").package
-        elif self.shared_subscriptions.filter(expires__gt=timezone.now()).exists():
-            status = "shared"
-            package = self.shared_subscriptions.latest("expires").package
-        elif self.premium_subscriptions.filter(expires__gt=timezone.now()).exists():
-            status = "premium"
-        elif self.extended_subscriptions.filter(expires__gt=timezone.now()).exists():
-            status = "extended"
-        elif self.basic_subscriptions.filter(expires__gt=timezone.now()).exists():
-            status = "basic"
-
-        if (
-            status != self.status
-            or package.limit_source_strings != self.limit_source_strings
-            or package.limit_hosted_words != self.limit_hosted_words
-            or package.limit_hosted_strings != self.limit_hosted_strings
-        ):
-            self.status = status
-            self.limit_source_strings = package.limit_source_strings
-            self.limit_hosted_words = package.limit_hosted_words
-            self.limit_hosted_strings = package.limit_hosted_strings
-            self.limit_languages = package.limit_languages
-            self.limit_projects = package.limit_projects
+        community = Package.objects.get(name="community")
+        subscriptions = (
+            self.subscription_set.filter(expires__gt=timezone.now())
+            .select_related("package")
+            .order_by("-expires")
+        )
+        if self.set_status(*self.get_status(subscriptions, community)):
             self.save()
 
     def has_paid_backup(self) -> bool:
-        subscriptions = self.hosted_subscriptions | self.backup_subscriptions
-        return subscriptions.filter(expires__gt=timezone.now()).exists()
+        now = timezone.now()
+        return any(
+            subscription.expires > now
+            for subscription in (*self.hosted_subscriptions, *self.backup_subscriptions)
+        )
 
     def create_backup(self) -> None:
         if (
@@ -1323,6 +1531,41 @@ class SubscriptionQuerySet(models.QuerySet["Subscription"]):
     def payment_lifecycle(self) -> SubscriptionQuerySet:
         return self.filter(enabled=True).exclude(payment=None)
 
+    @staticmethod
+    def newer_support_exists() -> Exists:
+        """Check for newer support of the service, see Subscription.could_be_obsolete."""
+        return Exists(
+            Subscription.objects.filter(
+                Q(package__name__in=OBSOLETE_SUPPORT_PACKAGES)
+                | Q(package__category__in=REPEATING_PACKAGE_CATEGORIES),
+                service=OuterRef("service"),
+                expires__gt=timezone.now() + timedelta(days=3),
+            )
+            .exclude(pk=OuterRef("pk"))
+            .order_by()
+        )
+
+    def with_renewal_state(self) -> SubscriptionQuerySet:
+        """Fetch related objects and obsolescence flag used on renewals."""
+        return self.select_related("service__customer", "package", "payment").annotate(
+            has_newer_support=self.newer_support_exists()
+        )
+
+    def repeating(self) -> SubscriptionQuerySet:
+        """Filter subscriptions with a repeating package, see Package.get_repeat."""
+        return self.filter(
+            Q(package__name__in=REPEATING_PACKAGES)
+            | Q(package__category__in=REPEATING_PACKAGE_CATEGORIES)
+        )
+
+    def exclude_obsolete(self) -> SubscriptionQuerySet:
+        """Exclude subscriptions for which Subscription.could_be_obsolete is true."""
+        return self.alias(has_newer_support=self.newer_support_exists()).exclude(
+            ~Q(service__kind=ServiceKind.DONATION),
+            package__name__in=OBSOLETE_SUPPORT_PACKAGES,
+            has_newer_support=True,
+        )
+
 
 class Subscription(models.Model):
     service = models.ForeignKey(Service, on_delete=models.deletion.PROTECT)
@@ -1349,6 +1592,11 @@ class Subscription(models.Model):
     class Meta:
         verbose_name = "Customer’s subscription"
         verbose_name_plural = "Customer’s subscriptions"
+        indexes = [
+            models.Index(
+                fields=("enabled", "expires"), name="subscription_enabled_expires"
+            ),
+        ]
 
     def __str__(self) -> str:
         return f"{self.package}: {self.service}"
@@ -1367,6 +1615,7 @@ class Subscription(models.Model):
             using=using,
             update_fields=update_fields,
         )
+        self.service.clear_subscription_index()
         self.service.update_status()
 
     def get_absolute_url(self):
@@ -1517,12 +1766,15 @@ class Subscription(models.Model):
     def could_be_obsolete(self):
         if not self.uses_obsolete_subscription_skip():
             return False
+        if self.package.name not in OBSOLETE_SUPPORT_PACKAGES:
+            return False
+        # Annotated by SubscriptionQuerySet.with_renewal_state
+        if hasattr(self, "has_newer_support"):
+            return self.has_newer_support
         expires = timezone.now() + timedelta(days=3)
-        return (
-            self.package.name in {"basic", "extended", "premium"}
-            and self.service.support_subscriptions.exclude(pk=self.pk)
-            .filter(expires__gt=expires)
-            .exists()
+        return any(
+            subscription.pk != self.pk and subscription.expires > expires
+            for subscription in self.service.support_subscriptions
         )
 
     @property
@@ -1961,3 +2213,52 @@ def sync_packages() -> list[str]:
             if modified:
                 package.save()
     return output
+
+
+def get_donate_links() -> list[Service]:
+    """List donations with an active link reward, cached across requests."""
+    results = cache.get(DONATE_LINKS_CACHE_KEY)
+    if results is None:
+        results = list(
+            Service.objects.donations()
+            .filter(
+                subscription__package__name=get_donation_reward_package_name(3),
+                subscription__enabled=True,
+                subscription__expires__gte=timezone.now(),
+            )
+            .distinct()
+        )
+        # The timeout takes care of expiring subscriptions
+        cache.set(DONATE_LINKS_CACHE_KEY, results, timeout=DONATE_LINKS_CACHE_TIMEOUT)
+    return results
+
+
+def get_hosting_packages() -> list[Package]:
+    """List hosting packages shown in the pricing overview, cached across requests."""
+    results = cache.get(HOSTING_PACKAGES_CACHE_KEY)
+    if results is None:
+        results = list(
+            Package.objects.filter(category=PackageCategory.PACKAGE_SHARED)
+            .filter(name__regex="^hosted:[0-9.]+[km]$")
+            .order_by("price")[:6]
+        )
+        cache.set(
+            HOSTING_PACKAGES_CACHE_KEY,
+            results,
+            timeout=HOSTING_PACKAGES_CACHE_TIMEOUT,
+        )
+    return results
+
+
+@receiver(post_save, sender=Service)
+@receiver(post_delete, sender=Service)
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def invalidate_donate_links(sender, **kwargs) -> None:
+    cache.delete(DONATE_LINKS_CACHE_KEY)
+
+
+@receiver(post_save, sender=Package)
+@receiver(post_delete, sender=Package)
+def invalidate_package_caches(sender, **kwargs) -> None:
+    cache.delete_many([DONATE_LINKS_CACHE_KEY, HOSTING_PACKAGES_CACHE_KEY])
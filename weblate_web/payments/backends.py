@@ -20,25 +20,33 @@
 from __future__ import annotations
 
 import datetime
+import logging
 import re
+import threading
 from dataclasses import dataclass
 from decimal import ROUND_HALF_UP, Decimal
 from hashlib import sha256
+from time import perf_counter
 from typing import TYPE_CHECKING, Any, cast
 
 import fiobank
 import requests
 import sentry_sdk
 from django.conf import settings
-from django.db import transaction
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch
+from django.dispatch import Signal
 from django.shortcuts import redirect
 from django.utils.decorators import method_decorator
 from django.utils.http import http_date
 from django.utils.timezone import make_aware, now
 from django.utils.translation import get_language, gettext, gettext_lazy
 from django.views.decorators.debug import sensitive_variables
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-from .models import CustomerFollowUp, Payment
+from .models import BankStatementCursor, BankTransaction, CustomerFollowUp, Payment
 
 if TYPE_CHECKING:
     from django.http import HttpRequest, HttpResponseRedirect
@@ -46,6 +54,8 @@ if TYPE_CHECKING:
 
     from weblate_web.invoices.models import Invoice
 
+LOGGER = logging.getLogger(__name__)
+
 
 @dataclass(frozen=True)
 class DuplicatePaymentRecord:
@@ -260,6 +270,51 @@ THEPAY_LANGUAGES = {
     "za",
     "zu",
 }
+THEPAY_TIMEOUT = 60
+# Retry only idempotent requests, creating payments must not be repeated
+THEPAY_RETRY = Retry(
+    total=3,
+    backoff_factor=0.5,
+    status_forcelist=(429, 500, 502, 503, 504),
+    raise_on_status=False,
+)
+THEPAY_SESSION_LOCK = threading.Lock()
+THEPAY_SESSION: requests.Session | None = None
+
+# Sent after each The Pay API call with method, url, status_code and elapsed
+# (seconds) arguments
+thepay_request_finished = Signal()
+
+
+def get_thepay_session() -> requests.Session:
+    """Return HTTP session shared by all The Pay requests."""
+    global THEPAY_SESSION  # ruff:ignore[global-statement]
+    if THEPAY_SESSION is None:
+        with THEPAY_SESSION_LOCK:
+            if THEPAY_SESSION is None:
+                adapter = HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=settings.THEPAY_POOL_SIZE,
+                    max_retries=THEPAY_RETRY,
+                )
+                session = requests.Session()
+                session.mount("https://", adapter)
+                THEPAY_SESSION = session
+    return THEPAY_SESSION
+
+
+def reset_thepay_session() -> None:
+    """Close shared The Pay session, it is recreated on next use."""
+    global THEPAY_SESSION  # ruff:ignore[global-statement]
+    with THEPAY_SESSION_LOCK:
+        if THEPAY_SESSION is not None:
+            THEPAY_SESSION.close()
+            THEPAY_SESSION = None
+
+
+def get_thepay_signature(merchant_id: str, password: str, timestamp: str) -> str:
+    payload = f"{merchant_id}{password}{timestamp}"
+    return sha256(payload.encode(), usedforsecurity=True).hexdigest()
 
 
 def get_backend(name: str) -> type[Backend]:
@@ -742,9 +797,13 @@ class FioBank(Backend):
 
     @classmethod
     def record_duplicate_bank_payment(
-        cls, invoice: Invoice, entry: dict[str, Any], amount: Decimal, currency: str
+        cls,
+        invoice: Invoice,
+        entry: dict[str, Any],
+        amount: Decimal,
+        currency: str,
+        paid_payment: Payment | None,
     ) -> None:
-        paid_payment = cls.get_paid_invoice_payment(invoice)
         if (
             paid_payment is not None
             and paid_payment.backend == cls.name
@@ -786,114 +845,308 @@ class FioBank(Backend):
         else:
             print(f"{invoice.number}: skipping, already paid (duplicate noted)")
 
-    @classmethod
-    @method_decorator(sensitive_variables("tokens", "token"))
-    def fetch_payments(cls, from_date: str | None = None) -> None:
+    @staticmethod
+    def extract_invoice_numbers(entry: dict[str, Any]) -> list[str]:
+        """Extract possible invoice numbers from a bank transaction."""
+        matches: list[str] = []
+        for field in EXTRACTABLE_FIELDS:
+            if value := entry.get(field):
+                matches.extend(
+                    match.replace(" ", "") for match in INVOICE_MATCH_RE.findall(value)
+                )
+        return matches
+
+    @staticmethod
+    def load_matching_invoices(numbers: set[str]) -> list[Invoice]:
+        """Load candidate invoices including their totals and payment state."""
         from weblate_web.invoices.models import (  # ruff:ignore[import-outside-top-level]
             Invoice,
             InvoiceKind,
         )
 
+        return list(
+            Invoice.objects.filter(
+                number__in=numbers,
+                kind__in=(InvoiceKind.PROFORMA, InvoiceKind.INVOICE),
+            )
+            .with_items()
+            .prefetch_related(
+                Prefetch(
+                    "paid_payment_set",
+                    queryset=Payment.objects.order_by("-created"),
+                    to_attr="bank_paid_payments",
+                ),
+                Prefetch(
+                    "draft_payment_set",
+                    queryset=Payment.objects.filter(
+                        paid_invoice__isnull=False
+                    ).order_by("-created"),
+                    to_attr="bank_paid_draft_payments",
+                ),
+            )
+        )
+
+    @staticmethod
+    def get_entry_invoices(
+        matches: list[str], invoice_lookup: dict[str, tuple[int, Invoice]]
+    ) -> list[Invoice]:
+        """Get invoices matching a transaction in the order of loading."""
+        return [
+            invoice
+            for _position, invoice in sorted(
+                invoice_lookup[number]
+                for number in set(matches)
+                if number in invoice_lookup
+            )
+        ]
+
+    @staticmethod
+    def get_loaded_paid_payment(invoice: Invoice) -> Payment | None:
+        """In-memory variant of get_paid_invoice_payment for loaded invoices."""
+        paid_payments: list[Payment] = [
+            *invoice.bank_paid_payments,  # type: ignore[attr-defined]
+            *invoice.bank_paid_draft_payments,  # type: ignore[attr-defined]
+        ]
+        return paid_payments[0] if paid_payments else None
+
+    @classmethod
+    def process_entry(
+        cls,
+        entry: dict[str, Any],
+        matches: list[str],
+        invoice_lookup: dict[str, tuple[int, Invoice]],
+        currency: str,
+    ) -> bool:
+        """Process incoming transaction, returns whether it matched an invoice."""
+        amount: Decimal = entry["amount"]
+
+        processed = False
+        duplicate_matches: list[Invoice] = []
+
+        # Process all matches
+        for invoice in cls.get_entry_invoices(matches, invoice_lookup):
+            # Match validation
+            expected_currency = invoice.get_currency_display()
+            if expected_currency != currency:
+                print(
+                    f"{invoice.number}: skipping, currency mismatch, {currency} instead of {expected_currency}"
+                )
+                continue
+            # The comment is not coming from the transaction, but can be only edited in the bank application
+            comment = entry.get("comment") or ""
+            if amount < invoice.total_amount and "[underpaid]" not in comment:
+                print(
+                    f"{invoice.number}: skipping, underpaid, {amount} instead of {invoice.total_amount}"
+                )
+                continue
+            if cls.get_loaded_paid_payment(invoice) is not None:
+                duplicate_matches.append(invoice)
+                continue
+
+            # Fetch payment(s)
+            payment = cls.get_invoice_payment(invoice)
+
+            print(f"{invoice.number}: received payment")
+
+            # Instantionate backend (does SELECT FOR UPDATE)
+            backend = payment.get_payment_backend()
+
+            # Sync payment date with the actual payment
+            if backend.payment.created.date() != entry["date"]:
+                # Make timezone aware datetime out of date object
+                backend.payment.created = make_aware(
+                    datetime.datetime.combine(entry["date"], datetime.time.min)
+                )
+                # Saved later via backend.success()
+
+            # Store transaction details
+            backend.payment.details["transaction"] = entry
+            backend.payment.details["transaction_currency"] = currency
+            # Saved later via backend.success()
+
+            # Complete processing and save updated payment
+            backend.success()
+            # Later transactions in the statement are duplicates
+            invoice.bank_paid_payments = [backend.payment]  # type: ignore[attr-defined]
+            processed = True
+            break
+
+        if not processed and duplicate_matches:
+            for invoice in duplicate_matches:
+                cls.record_duplicate_bank_payment(
+                    invoice,
+                    entry,
+                    amount,
+                    currency,
+                    cls.get_loaded_paid_payment(invoice),
+                )
+            processed = True
+
+        # Warn about not processed payment
+        if not processed and entry["account_number"] not in SKIP_ACCOUNTS:
+            print(
+                f"Unprocessed incoming payment {amount} {currency}  {entry['account_name']}"
+            )
+        return processed
+
+    @classmethod
+    @method_decorator(sensitive_variables("tokens", "token"))
+    def fetch_payments(cls, from_date: str | None = None) -> None:
         tokens: list[str]
         if isinstance(settings.FIO_TOKEN, str):
             tokens = [settings.FIO_TOKEN]
         else:
             tokens = settings.FIO_TOKEN
         for token in tokens:
-            client = fiobank.FioBank(token=token, decimal=True)
-            try:
-                info, transactions = client.last_transactions(from_date=from_date)
-            except (fiobank.ThrottlingError, requests.RequestException) as error:
-                sentry_sdk.capture_exception()
-                print(f"Failed to fetch payments: {error}")
-                continue
+            cls.fetch_token_payments(token, from_date)
 
-            currency: str = info["currency"]
-            for entry in transactions:
-                amount: Decimal = entry["amount"]
+    @classmethod
+    @method_decorator(sensitive_variables("token"))
+    def fetch_token_payments(cls, token: str, from_date: str | None = None) -> None:
+        """
+        Import bank statement for a single API token.
 
-                # Skip outgoing payments
-                if amount < 0:
-                    continue
+        Every transaction is processed in its own database transaction and
+        recorded in the ledger, the stored cursor makes it possible to resume
+        import which did not complete.
+        """
+        cursor, _created = BankStatementCursor.objects.get_or_create(
+            token_hash=sha256(token.encode(), usedforsecurity=True).hexdigest()
+        )
+        from_id: str | None = None
+        if from_date is None and cursor.is_incomplete:
+            if cursor.processed_transaction_id:
+                # Rewind the bank cursor to the last processed transaction
+                from_id = cursor.processed_transaction_id
+            elif cursor.rewind_date is not None:
+                # No transaction was processed, rewind to the failed one
+                from_date = cursor.rewind_date.isoformat()
+
+        client = fiobank.FioBank(token=token, decimal=True)
+        try:
+            info, transactions = client.last_transactions(
+                from_id=from_id, from_date=from_date
+            )
+            entries = list(transactions)
+        except (fiobank.ThrottlingError, requests.RequestException) as error:
+            sentry_sdk.capture_exception()
+            print(f"Failed to fetch payments: {error}")
+            return
+
+        cls.process_statement(info, entries, cursor)
 
-                # Extract possible invoice IDs
-                matches: list[str] = []
-                for field in EXTRACTABLE_FIELDS:
-                    if value := entry.get(field, None):
-                        matches.extend(
-                            match.replace(" ", "")
-                            for match in INVOICE_MATCH_RE.findall(value)
-                        )
-
-                processed = False
-                duplicate_matches: list[Invoice] = []
-
-                # Process all matches
-                for invoice in Invoice.objects.filter(
-                    number__in=matches,
-                    kind__in=(InvoiceKind.PROFORMA, InvoiceKind.INVOICE),
+    @staticmethod
+    def get_pending_entries(
+        account: str, entries: list[dict[str, Any]]
+    ) -> dict[int, dict[str, Any]]:
+        """Get incoming transactions which are not in the ledger yet."""
+        seen = set(
+            BankTransaction.objects.filter(
+                account=account,
+                transaction_id__in=[
+                    entry["transaction_id"]
+                    for entry in entries
+                    if entry["transaction_id"]
+                ],
+            ).values_list("transaction_id", flat=True)
+        )
+        return {
+            position: entry
+            for position, entry in enumerate(entries)
+            if entry["amount"] >= 0 and entry["transaction_id"] not in seen
+        }
+
+    @classmethod
+    def process_statement(
+        cls,
+        info: dict[str, Any],
+        entries: list[dict[str, Any]],
+        cursor: BankStatementCursor,
+    ) -> None:
+        transaction_ids = [
+            entry["transaction_id"] for entry in entries if entry["transaction_id"]
+        ]
+        if transaction_ids:
+            cursor.fetched_transaction_id = transaction_ids[-1]
+            cursor.save(update_fields=["fetched_transaction_id", "updated"])
+
+        account: str = info.get("account_number_full") or ""
+        # Skip outgoing and already processed payments
+        pending = cls.get_pending_entries(account, entries)
+
+        # Extract possible invoice IDs from the whole statement
+        entry_matches = {
+            position: cls.extract_invoice_numbers(entry)
+            for position, entry in pending.items()
+        }
+        # Keep the order of the invoices as returned by the database
+        invoice_lookup: dict[str, tuple[int, Invoice]] = {
+            invoice.number: (position, invoice)
+            for position, invoice in enumerate(
+                cls.load_matching_invoices(
+                    {number for matches in entry_matches.values() for number in matches}
+                )
+            )
+        }
+
+        currency: str = info["currency"]
+        completed = True
+        try:
+            for position, entry in enumerate(entries):
+                transaction_id: str | None = entry["transaction_id"]
+                if position in pending and not cls.process_pending_entry(
+                    entry, entry_matches[position], invoice_lookup, currency, account
                 ):
-                    # Match validation
-                    expected_currency = invoice.get_currency_display()
-                    if expected_currency != currency:
-                        print(
-                            f"{invoice.number}: skipping, currency mismatch, {currency} instead of {expected_currency}"
-                        )
-                        continue
-                    # The comment is not coming from the transaction, but can be only edited in the bank application
-                    comment = entry.get("comment") or ""
-                    if amount < invoice.total_amount and "[underpaid]" not in comment:
-                        print(
-                            f"{invoice.number}: skipping, underpaid, {amount} instead of {invoice.total_amount}"
-                        )
-                        continue
-                    if (
-                        invoice.paid_payment_set.exists()
-                        or invoice.draft_payment_set.filter(
-                            paid_invoice__isnull=False
-                        ).exists()
-                    ):
-                        duplicate_matches.append(invoice)
-                        continue
-
-                    # Fetch payment(s)
-                    payment = cls.get_invoice_payment(invoice)
-
-                    print(f"{invoice.number}: received payment")
-
-                    # Instantionate backend (does SELECT FOR UPDATE)
-                    backend = payment.get_payment_backend()
-
-                    # Sync payment date with the actual payment
-                    if backend.payment.created.date() != entry["date"]:
-                        # Make timezone aware datetime out of date object
-                        backend.payment.created = make_aware(
-                            datetime.datetime.combine(entry["date"], datetime.time.min)
-                        )
-                        # Saved later via backend.success()
-
-                    # Store transaction details
-                    backend.payment.details["transaction"] = entry
-                    backend.payment.details["transaction_currency"] = currency
-                    # Saved later via backend.success()
-
-                    # Complete processing and save updated payment
-                    backend.success()
-                    processed = True
-                    break
-
-                if not processed and duplicate_matches:
-                    for invoice in duplicate_matches:
-                        cls.record_duplicate_bank_payment(
-                            invoice, entry, amount, currency
-                        )
-                    processed = True
-
-                # Warn about not processed payment
-                if not processed and entry["account_number"] not in SKIP_ACCOUNTS:
-                    print(
-                        f"Unprocessed incoming payment {amount} {currency}  {entry['account_name']}"
+                    if completed and not cursor.processed_transaction_id:
+                        cursor.rewind_date = entry["date"]
+                    completed = False
+                    continue
+                # The cursor can not skip failed transactions
+                if completed and transaction_id:
+                    cursor.processed_transaction_id = transaction_id
+        finally:
+            # Keep the progress also when the import is aborted
+            cursor.save(
+                update_fields=["processed_transaction_id", "rewind_date", "updated"]
+            )
+
+    @classmethod
+    def process_pending_entry(
+        cls,
+        entry: dict[str, Any],
+        matches: list[str],
+        invoice_lookup: dict[str, tuple[int, Invoice]],
+        currency: str,
+        account: str,
+    ) -> bool:
+        """Process and record transaction, returns False if it failed."""
+        transaction_id: str | None = entry["transaction_id"]
+        # Loaded payments are updated in memory, restore them on rollback
+        loaded_payments = [
+            (invoice, invoice.bank_paid_payments)  # type: ignore[attr-defined]
+            for invoice in cls.get_entry_invoices(matches, invoice_lookup)
+        ]
+        try:
+            with transaction.atomic():
+                processed = cls.process_entry(entry, matches, invoice_lookup, currency)
+                # Unmatched transactions are kept out of the ledger, so
+                # that importing from a date can match them later
+                if processed and transaction_id:
+                    BankTransaction.objects.create(
+                        account=account, transaction_id=transaction_id
                     )
+        except Exception as error:
+            for invoice, payments in loaded_payments:
+                invoice.bank_paid_payments = payments  # type: ignore[attr-defined]
+            # Programming errors should not end up as unprocessed payments
+            if not isinstance(
+                error, (PaymentError, ValidationError, ValueError, IntegrityError)
+            ):
+                raise
+            sentry_sdk.capture_exception()
+            print(f"Failed to process transaction {transaction_id}: {error}")
+            return False
+        return True
 
 
 @register_backend
@@ -908,9 +1161,10 @@ class ThePay2Card(Backend):
     @staticmethod
     def get_headers() -> dict[str, str]:
         timestamp = http_date()
-        payload = f"{settings.THEPAY_MERCHANT_ID}{settings.THEPAY_PASSWORD}{timestamp}"
-        hash256 = sha256(payload.encode(), usedforsecurity=True)
-        return {"SignatureDate": timestamp, "Signature": hash256.hexdigest()}
+        signature = get_thepay_signature(
+            settings.THEPAY_MERCHANT_ID, settings.THEPAY_PASSWORD, timestamp
+        )
+        return {"SignatureDate": timestamp, "Signature": signature}
 
     @classmethod
     def request(
@@ -929,13 +1183,29 @@ class ThePay2Card(Backend):
 
         base_url = f"https://{settings.THEPAY_SERVER}/{api_version}/projects/{settings.THEPAY_PROJECT_ID}"
 
-        response = requests.request(
+        start = perf_counter()
+        response = get_thepay_session().request(
             method,
             f"{base_url}/{url}",
             params=params,
             json=json,
             headers=headers,
-            timeout=60,
+            timeout=THEPAY_TIMEOUT,
+        )
+        elapsed = perf_counter() - start
+        LOGGER.debug(
+            "The Pay %s %s: HTTP %d in %.3f s",
+            method.upper(),
+            url,
+            response.status_code,
+            elapsed,
+        )
+        thepay_request_finished.send(
+            sender=cls,
+            method=method,
+            url=url,
+            status_code=response.status_code,
+            elapsed=elapsed,
         )
 
         # Use service specific error message if available
@@ -0,0 +1,53 @@
+#
+# Copyright © Michal Čihař <michal@weblate.org>
+#
+# This file is part of Weblate <https://weblate.org/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+from __future__ import annotations
+
+from django.db import migrations, models
+
+
+def populate_billing(apps, _schema_editor):
+    Payment = apps.get_model("payments", "Payment")
+    updated = []
+    for payment in Payment.objects.filter(extra__has_key="billing").iterator():
+        billing = payment.extra["billing"]
+        if not isinstance(billing, int) or isinstance(billing, bool):
+            continue
+        payment.billing = billing
+        updated.append(payment)
+        if len(updated) >= 1000:
+            Payment.objects.bulk_update(updated, ["billing"])
+            updated = []
+    if updated:
+        Payment.objects.bulk_update(updated, ["billing"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [("payments", "0004_payment_decimal_amount")]
+
+    operations = [
+        migrations.AddField(
+            model_name="payment",
+            name="billing",
+            field=models.IntegerField(
+                blank=True, db_index=True, editable=False, null=True
+            ),
+        ),
+        migrations.RunPython(populate_billing, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,85 @@
+#
+# Copyright © Michal Čihař <michal@weblate.org>
+#
+# This file is part of Weblate <https://weblate.org/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+from __future__ import annotations
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [("payments", "0005_payment_billing")]
+
+    operations = [
+        migrations.CreateModel(
+            name="BankStatementCursor",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("token_hash", models.CharField(max_length=64, unique=True)),
+                (
+                    "fetched_transaction_id",
+                    models.CharField(blank=True, max_length=100),
+                ),
+                (
+                    "processed_transaction_id",
+                    models.CharField(blank=True, max_length=100),
+                ),
+                ("rewind_date", models.DateField(blank=True, null=True)),
+                ("updated", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name": "Bank statement cursor",
+                "verbose_name_plural": "Bank statement cursors",
+            },
+        ),
+        migrations.CreateModel(
+            name="BankTransaction",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("account", models.CharField(max_length=100)),
+                ("transaction_id", models.CharField(max_length=100)),
+                ("created", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "verbose_name": "Bank transaction",
+                "verbose_name_plural": "Bank transactions",
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("account", "transaction_id"),
+                        name="unique_bank_transaction",
+                    )
+                ],
+            },
+        ),
+    ]
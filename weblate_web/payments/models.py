@@ -109,6 +109,14 @@ DELETED_MAIL = re.compile(r"noreply\+[0-9]+@weblate.org")
 PAYMENT_QUANTUM = Decimal("0.01")
 
 
+def get_payment_billing(extra: dict) -> int | None:
+    """Extract hosted Weblate billing ID from payment extra information."""
+    billing = extra.get("billing")
+    if isinstance(billing, int) and not isinstance(billing, bool):
+        return billing
+    return None
+
+
 def round_payment_amount(amount: Decimal | int) -> Decimal:
     """Round a fiat payment amount to cents."""
     return Decimal(amount).quantize(PAYMENT_QUANTUM, rounding=ROUND_HALF_UP)
@@ -521,9 +529,8 @@ class Customer(models.Model):
             self.invoice_set.filter(
                 prepaid=False,
             )
-            .prefetch_related(
-                "invoiceitem_set", "draft_payment_set", "paid_payment_set"
-            )
+            .with_items()
+            .prefetch_related("draft_payment_set", "paid_payment_set")
             .exclude(paid_payment_set__state=Payment.PROCESSED)
             .exclude(draft_payment_set__state=Payment.PROCESSED)
             .filter(
@@ -758,6 +765,9 @@ class PaymentQuerySet(models.QuerySet["Payment", "Payment"]):
     def order(self) -> PaymentQuerySet:
         return self.order_by("-created", "description", "uuid")
 
+    def for_billing(self, billing: int) -> PaymentQuerySet:
+        return self.filter(billing=billing).order_by("end")
+
 
 class Payment(models.Model):
     NEW = 1
@@ -833,6 +843,8 @@ class Payment(models.Model):
     start = models.DateField(blank=True, null=True)
     end = models.DateField(blank=True, null=True)
     card_info = models.JSONField(default=dict, blank=True)
+    # Denormalized from extra for indexed lookups from hosted Weblate
+    billing = models.IntegerField(blank=True, null=True, db_index=True, editable=False)
 
     objects = PaymentQuerySet.as_manager()
 
@@ -859,6 +871,9 @@ class Payment(models.Model):
                 self.requested_amount = self.amount
             if self.state == self.NEW:
                 self.normalize_fixed_amount()
+        self.billing = get_payment_billing(self.extra)
+        if update_fields is not None and "extra" in update_fields:
+            update_fields = {*update_fields, "billing"}
         super().save(
             force_insert=force_insert,
             force_update=force_update,
@@ -1072,6 +1087,52 @@ class Payment(models.Model):
             process_payment(self)
 
 
+class BankTransaction(models.Model):
+    """Ledger of processed bank transactions."""
+
+    account = models.CharField(max_length=100)
+    transaction_id = models.CharField(max_length=100)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Bank transaction"
+        verbose_name_plural = "Bank transactions"
+        constraints = [
+            models.UniqueConstraint(
+                fields=("account", "transaction_id"), name="unique_bank_transaction"
+            )
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.account}: {self.transaction_id}"
+
+
+class BankStatementCursor(models.Model):
+    """Bank statement import position for an API token."""
+
+    token_hash = models.CharField(max_length=64, unique=True)
+    fetched_transaction_id = models.CharField(max_length=100, blank=True)
+    processed_transaction_id = models.CharField(max_length=100, blank=True)
+    # Used to rewind when the first fetched transaction failed
+    rewind_date = models.DateField(blank=True, null=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Bank statement cursor"
+        verbose_name_plural = "Bank statement cursors"
+
+    def __str__(self) -> str:
+        return self.processed_transaction_id
+
+    @property
+    def is_incomplete(self) -> bool:
+        """Whether some fetched transactions were not processed."""
+        return bool(
+            self.fetched_transaction_id
+            and self.processed_transaction_id != self.fetched_transaction_id
+        )
+
+
 class PaymentConf(AppConf):
     DEBUG = False
     SECRET = "secret"  # ruff:ignore[hardcoded-password-string]
@@ -23,6 +23,8 @@ import json
 from copy import deepcopy
 from datetime import date
 from decimal import Decimal
+from io import StringIO
+from threading import Barrier, Lock
 from typing import Any, cast
 from unittest.mock import patch
 
@@ -32,13 +34,18 @@ from django.contrib.auth.models import User
 from django.core import mail
 from django.core.cache import cache
 from django.core.exceptions import ValidationError
-from django.test import SimpleTestCase, TestCase
-from django.test.utils import override_settings
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.utils import timezone
 from vies.types import VATIN
 
 from weblate_web.crm.models import Interaction
 from weblate_web.invoices.models import Invoice, InvoiceCategory, InvoiceKind
+from weblate_web.management.commands.collect_payments import (
+    Command as CollectPaymentsCommand,
+)
 from weblate_web.tests import (
     THEPAY2_MOCK_SETTINGS,
     cnb_mock_rates,
@@ -47,8 +54,23 @@ from weblate_web.tests import (
     thepay_mock_payment,
 )
 
-from .backends import FioBank, InvalidState, PaymentError, get_backend, list_backends
-from .models import Customer, CustomerFollowUp, Payment
+from .backends import (
+    FioBank,
+    InvalidState,
+    PaymentError,
+    get_backend,
+    get_thepay_session,
+    list_backends,
+    reset_thepay_session,
+    thepay_request_finished,
+)
+from .models import (
+    BankStatementCursor,
+    BankTransaction,
+    Customer,
+    CustomerFollowUp,
+    Payment,
+)
 from .validators import validate_vatin
 
 CUSTOMER = {
@@ -160,20 +182,6 @@ FIO_TRASACTIONS = {
 
 
 class ModelTest(SimpleTestCase):
-    @override_settings(
-        FIO_TOKEN="test-token",  # ruff:ignore[hardcoded-password-func-arg]
-    )
-    @patch("weblate_web.payments.backends.sentry_sdk.capture_exception")
-    @patch("weblate_web.payments.backends.fiobank.FioBank.last_transactions")
-    def test_invoice_bank_throttling(
-        self, last_transactions, capture_exception
-    ) -> None:
-        last_transactions.side_effect = fiobank.ThrottlingError("API throttled")
-
-        FioBank.fetch_payments()
-
-        capture_exception.assert_called_once_with()
-
     def test_vat(self) -> None:
         customer = Customer()
         self.assertTrue(customer.needs_vat)
@@ -502,6 +510,7 @@ class BackendTest(BackendBaseTestCase):
         sender_account: str | None = None,
         transaction_id: int | None = 12210832097,
         replace: bool = False,
+        incoming_only: bool = False,
     ) -> None:
         received: dict[str, Any] = deepcopy(FIO_TRASACTIONS)
         received["accountStatement"]["info"]["currency"] = currency
@@ -528,6 +537,8 @@ class BackendTest(BackendBaseTestCase):
             transaction[1]["column22"] = None
         else:
             transaction[1]["column22"]["value"] = transaction_id
+        if incoming_only:
+            del transaction[0]
         if replace:
             responses.replace(responses.GET, FIO_API, body=json.dumps(received))
         else:
@@ -739,6 +750,200 @@ class BackendTest(BackendBaseTestCase):
         # Czech bank notation
         self.test_invoice_bank(format_string="VS{}/SS/KS")
 
+    @responses.activate
+    @override_settings(
+        FIO_TOKEN="test-token",  # ruff:ignore[hardcoded-password-func-arg]
+    )
+    def test_invoice_bank_statement_queries(self) -> None:
+        invoices = [self.create_invoice() for _unused in range(5)]
+        received: dict[str, Any] = deepcopy(FIO_TRASACTIONS)
+        template = received["accountStatement"]["transactionList"]["transaction"][1]
+        transactions = []
+        for offset, invoice in enumerate(invoices * 3):
+            transaction = deepcopy(template)
+            transaction["column16"]["value"] = invoice.number
+            transaction["column5"]["value"] = invoice.number
+            # Underpaid, so that nothing is written
+            transaction["column1"]["value"] = 1.0
+            transaction["column22"]["value"] = 10000000100 + offset
+            transactions.append(transaction)
+        received["accountStatement"]["transactionList"]["transaction"] = transactions
+        responses.add(responses.GET, FIO_API, body=json.dumps(received))
+
+        with CaptureQueriesContext(connection) as context:
+            FioBank.fetch_payments()
+        # Invoices with discount, items, paid payments and paid draft payments
+        lookups = [
+            query["sql"]
+            for query in context.captured_queries
+            if query["sql"].startswith("SELECT")
+            and ("invoices_" in query["sql"] or '"payments_payment"' in query["sql"])
+        ]
+        self.assertEqual(len(lookups), 4)
+
+    @responses.activate
+    @override_settings(
+        FIO_TOKEN="test-token",  # ruff:ignore[hardcoded-password-func-arg]
+    )
+    def test_invoice_bank_ledger(self) -> None:
+        invoice = self.create_invoice()
+        self.mock_fio_payment(invoice)
+        FioBank.fetch_payments()
+        self.assertTrue(invoice.paid_payment_set.exists())
+        self.assertTrue(
+            BankTransaction.objects.filter(
+                account="1234567890/2010", transaction_id="12210832097"
+            ).exists()
+        )
+        cursor = BankStatementCursor.objects.get()
+        self.assertEqual(cursor.processed_transaction_id, "12210832097")
+        self.assertFalse(cursor.is_incomplete)
+
+        # Known transactions are skipped
+        with patch.object(FioBank, "process_entry") as process_entry:
+            FioBank.fetch_payments()
+        process_entry.assert_not_called()
+
+    @override_settings(
+        FIO_TOKEN="test-token",  # ruff:ignore[hardcoded-password-func-arg]
+    )
+    @patch("weblate_web.payments.backends.sentry_sdk.capture_exception")
+    @patch("weblate_web.payments.backends.fiobank.FioBank.last_transactions")
+    def test_invoice_bank_throttling(
+        self, last_transactions, capture_exception
+    ) -> None:
+        last_transactions.side_effect = fiobank.ThrottlingError("API throttled")
+
+        FioBank.fetch_payments()
+
+        capture_exception.assert_called_once_with()
+
+    @responses.activate
+    @override_settings(
+        FIO_TOKEN="test-token",  # ruff:ignore[hardcoded-password-func-arg]
+    )
+    def test_invoice_bank_unmatched_not_recorded(self) -> None:
+        invoice = self.create_invoice()
+        self.mock_fio_payment(invoice)
+        with patch.object(FioBank, "process_entry", return_value=False):
+            FioBank.fetch_payments()
+        self.assertFalse(BankTransaction.objects.exists())
+
+        # Importing the statement again matches the transaction
+        responses.get(
+            "https://fioapi.fio.cz/v1/rest/set-last-date/test-token/2020-01-01/"
+        )
+        FioBank.fetch_payments(from_date="2020-01-01")
+        self.assertTrue(invoice.paid_payment_set.exists())
+        self.assertTrue(BankTransaction.objects.exists())
+
+    @responses.activate
+    @override_settings(
+        FIO_TOKEN="test-token",  # ruff:ignore[hardcoded-password-func-arg]
+    )
+    def test_invoice_bank_resume(self) -> None:
+        invoice = self.create_invoice()
+        self.mock_fio_payment(invoice)
+        with patch.object(
+            FioBank, "process_entry", side_effect=ValueError("Broken entry")
+        ):
+            FioBank.fetch_payments()
+        self.assertFalse(invoice.paid_payment_set.exists())
+        self.assertFalse(BankTransaction.objects.exists())
+        cursor = BankStatementCursor.objects.get()
+        self.assertEqual(cursor.processed_transaction_id, "10000000002")
+        self.assertTrue(cursor.is_incomplete)
+
+        # The next import rewinds the bank cursor to the failed transaction
+        responses.get(
+            "https://fioapi.fio.cz/v1/rest/set-last-id/test-token/10000000002/"
+        )
+        FioBank.fetch_payments()
+        self.assertTrue(invoice.paid_payment_set.exists())
+        cursor.refresh_from_db()
+        self.assertFalse(cursor.is_incomplete)
+
+    @responses.activate
+    @override_settings(
+        FIO_TOKEN="test-token",  # ruff:ignore[hardcoded-password-func-arg]
+    )
+    def test_invoice_bank_resume_first_entry(self) -> None:
+        invoice = self.create_invoice()
+        self.mock_fio_payment(invoice, incoming_only=True)
+        with patch.object(
+            FioBank, "process_entry", side_effect=ValueError("Broken entry")
+        ):
+            FioBank.fetch_payments()
+        cursor = BankStatementCursor.objects.get()
+        self.assertEqual(cursor.fetched_transaction_id, "12210832097")
+        self.assertEqual(cursor.processed_transaction_id, "")
+        self.assertEqual(cursor.rewind_date, date(2016, 8, 3))
+        self.assertTrue(cursor.is_incomplete)
+
+        # Nothing was processed, so the next import rewinds to the failed date
+        responses.get(
+            "https://fioapi.fio.cz/v1/rest/set-last-date/test-token/2016-08-03/"
+        )
+        FioBank.fetch_payments()
+        self.assertTrue(invoice.paid_payment_set.exists())
+        cursor.refresh_from_db()
+        self.assertEqual(cursor.processed_transaction_id, "12210832097")
+        self.assertFalse(cursor.is_incomplete)
+
+    @responses.activate
+    @override_settings(
+        FIO_TOKEN="test-token",  # ruff:ignore[hardcoded-password-func-arg]
+    )
+    def test_invoice_bank_programming_error(self) -> None:
+        invoice = self.create_invoice()
+        self.mock_fio_payment(invoice)
+        with (
+            patch.object(FioBank, "process_entry", side_effect=AttributeError("Bug")),
+            self.assertRaises(AttributeError),
+        ):
+            FioBank.fetch_payments()
+        # Progress before the failure is kept
+        cursor = BankStatementCursor.objects.get()
+        self.assertEqual(cursor.processed_transaction_id, "10000000002")
+        self.assertTrue(cursor.is_incomplete)
+
+    @responses.activate
+    @override_settings(
+        FIO_TOKEN="test-token",  # ruff:ignore[hardcoded-password-func-arg]
+    )
+    def test_invoice_bank_failed_entry_restores_loaded_payments(self) -> None:
+        invoice = self.create_invoice()
+        received: dict[str, Any] = deepcopy(FIO_TRASACTIONS)
+        transactions = received["accountStatement"]["transactionList"]["transaction"]  # type: ignore[index]
+        incoming = transactions[1]
+        incoming["column16"]["value"] = invoice.number
+        incoming["column1"]["value"] = float(invoice.total_amount)
+        repeated = deepcopy(incoming)
+        repeated["column22"]["value"] = 12210832098
+        transactions[:] = [incoming, repeated]
+        responses.add(responses.GET, FIO_API, body=json.dumps(received))
+
+        process_entry = FioBank.process_entry
+        calls: list[str] = []
+
+        def fail_first(entry: dict[str, Any], *args) -> bool:
+            result = process_entry(entry, *args)
+            calls.append(entry["transaction_id"])
+            if len(calls) == 1:
+                raise ValueError("Broken entry")
+            return result
+
+        with patch.object(FioBank, "process_entry", side_effect=fail_first):
+            FioBank.fetch_payments()
+
+        # The rolled back payment is not treated as paying the invoice
+        self.assertEqual(calls, ["12210832097", "12210832098"])
+        self.assertTrue(invoice.paid_payment_set.exists())
+        self.assertEqual(
+            list(BankTransaction.objects.values_list("transaction_id", flat=True)),
+            ["12210832098"],
+        )
+
     @responses.activate
     @override_settings(
         FIO_TOKEN="test-token",  # ruff:ignore[hardcoded-password-func-arg]
@@ -1208,6 +1413,49 @@ class ThePay2Test(BackendBaseTestCase):
         self.assertEqual(len(mail.outbox), 1)
         self.assertEqual(mail.outbox[0].subject, "Your payment on weblate.org")
 
+    @responses.activate
+    def test_pooled_session(self) -> None:
+        reset_thepay_session()
+        self.addCleanup(reset_thepay_session)
+        timings: list[tuple[str, int, float]] = []
+
+        def record(url: str, status_code: int, elapsed: float, **kwargs) -> None:
+            timings.append((url, status_code, elapsed))
+
+        thepay_request_finished.connect(record)
+        self.addCleanup(thepay_request_finished.disconnect, record)
+        url = f"https://demo.api.thepay.cz/v1/projects/42/payments/{self.payment.pk}?merchant_id=00000000-0000-0000-0000-000000000000"
+        responses.get(url, status=503)
+        thepay_mock_payment(self.payment.pk)
+        session = get_thepay_session()
+
+        thepay_mock_create_payment()
+        self.backend.initiate(None, "", "")
+        # Temporary server failure is retried
+        self.assertTrue(self.backend.complete(None))
+
+        self.assertIs(get_thepay_session(), session)
+        self.assertEqual(len(responses.calls), 3)
+        self.assertEqual(
+            [(url, status) for url, status, _elapsed in timings],
+            [("payments", 200), (f"payments/{self.payment.pk}", 200)],
+        )
+
+    @responses.activate
+    def test_collect_pending(self) -> None:
+        thepay_mock_create_payment()
+        thepay_mock_payment(self.payment.pk)
+        self.backend.initiate(None, "", "")
+        self.check_payment(Payment.PENDING)
+
+        output = StringIO()
+        call_command("collect_payments", concurrency=1, stdout=output)
+
+        self.check_payment(Payment.ACCEPTED)
+        self.assertIn("Payment accepted: 1", output.getvalue())
+        self.assertIn("Collected 1 payments", output.getvalue())
+        self.assertIn("Latency p50", output.getvalue())
+
     @responses.activate
     def test_cent_amount_is_sent_as_minor_units(self) -> None:
         self.payment.amount = Decimal("0.50")
@@ -1491,6 +1739,78 @@ class ThePay2Test(BackendBaseTestCase):
         self.assertEqual(mail.outbox[0].subject, "Your payment on weblate.org failed")
 
 
+@override_settings(**THEPAY2_MOCK_SETTINGS)
+class ThePay2CollectTest(TransactionTestCase):
+    """Collecting payments in worker threads needs committed data."""
+
+    @staticmethod
+    def mock_state(payment: Payment, **kwargs) -> None:
+        responses.get(
+            f"https://demo.api.thepay.cz/v1/projects/42/payments/{payment.pk}?merchant_id=00000000-0000-0000-0000-000000000000",
+            **kwargs,
+        )
+
+    @responses.activate
+    def test_collect_pending_concurrent(self) -> None:
+        customer = Customer.objects.create(**CUSTOMER)
+        paid, waiting, missing = (
+            Payment.objects.create(
+                customer=customer,
+                amount=100,
+                description="Test Item",
+                backend="thepay2-card",
+                state=Payment.PENDING,
+            )
+            for _ in range(3)
+        )
+        thepay_mock_payment(paid.pk)
+        self.mock_state(waiting, json={"state": "waiting_for_payment"})
+        self.mock_state(missing, status=404, json={"message": "Payment not found"})
+
+        # All workers have to be running at once, so more threads are used,
+        # the database access is serialized as SQLite does not handle
+        # concurrent transactions from threads
+        barrier = Barrier(3, timeout=10)
+        lock = Lock()
+        collect_payment = CollectPaymentsCommand.collect_payment
+
+        def collect_payment_barrier(payment_pk: str) -> tuple[str, float]:
+            barrier.wait()
+            with lock:
+                return collect_payment(payment_pk)
+
+        output = StringIO()
+        with patch.object(
+            CollectPaymentsCommand,
+            "collect_payment",
+            side_effect=collect_payment_barrier,
+        ) as collect:
+            call_command("collect_payments", concurrency=3, stdout=output)
+
+        self.assertEqual(collect.call_count, 3)
+        self.assertEqual(
+            {call.args[0] for call in collect.call_args_list},
+            {paid.pk, waiting.pk, missing.pk},
+        )
+        for payment, state in (
+            (paid, Payment.ACCEPTED),
+            (waiting, Payment.PENDING),
+            (missing, Payment.PENDING),
+        ):
+            payment.refresh_from_db()
+            self.assertEqual(payment.state, state)
+
+        lines = output.getvalue().splitlines()
+        self.assertEqual(
+            lines[:3],
+            ["Awaiting payment: 1", "Payment accepted: 1", "error: 1"],
+        )
+        self.assertTrue(lines[3].startswith("Collected 3 payments in "))
+        self.assertIn("concurrency 3", lines[3])
+        self.assertTrue(lines[4].startswith("Latency p50 "))
+        self.assertEqual(len(lines), 5)
+
+
 class VATTest(SimpleTestCase):
     @responses.activate
     def test_validation_invalid(self) -> None:
@@ -18,6 +18,8 @@
 #
 from __future__ import annotations
 
+import threading
+from dataclasses import dataclass
 from pathlib import Path
 from typing import TYPE_CHECKING
 
@@ -94,6 +96,36 @@ FACTURX_RDF_METADATA = """
 
 
 class WeblateUrlFetcher(URLFetcher):
+    """
+    URL fetcher for the PDF templates and assets.
+
+    Fetched files are kept in memory and re-read only when their modification
+    time changes.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.static_paths: dict[str, Path] = {}
+        self.files: dict[Path, tuple[int, bytes]] = {}
+
+    def find_static(self, fullname: str) -> Path:
+        path_obj = self.static_paths.get(fullname)
+        if path_obj is None or not path_obj.exists():
+            match = finders.find(fullname)
+            if match is None:
+                raise FatalURLFetchingError(f"Could not find {fullname}")
+            path_obj = self.static_paths[fullname] = Path(match)
+        return path_obj
+
+    def read_file(self, path_obj: Path) -> bytes:
+        mtime = path_obj.stat().st_mtime_ns
+        cached = self.files.get(path_obj)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        content = path_obj.read_bytes()
+        self.files[path_obj] = (mtime, content)
+        return content
+
     def fetch(self, url: str, headers: dict | None = None) -> URLFetcherResponse:
         path_obj: Path
 
@@ -106,11 +138,7 @@ class WeblateUrlFetcher(URLFetcher):
         elif url.startswith(LEGAL_URL):
             path_obj = LEGAL_TEMPLATES_PATH / url.removeprefix(LEGAL_URL)
         elif url.startswith(STATIC_URL):
-            fullname = url.removeprefix(STATIC_URL)
-            match = finders.find(fullname)
-            if match is None:
-                raise FatalURLFetchingError(f"Could not find {fullname}")
-            path_obj = Path(match)
+            path_obj = self.find_static(url.removeprefix(STATIC_URL))
         else:
             raise FatalURLFetchingError(f"Unsupported URL: {url}")
 
@@ -118,43 +146,93 @@ class WeblateUrlFetcher(URLFetcher):
         if path_obj.suffix == ".css":
             response_headers["Content-Type"] = "text/css; charset=utf-8"
 
-        return URLFetcherResponse(url, path_obj.read_bytes(), response_headers)
+        return URLFetcherResponse(url, self.read_file(path_obj), response_headers)
 
 
-def render_pdf_document(*, html: str) -> Document:
-    font_config = FontConfiguration()
-    fetcher = WeblateUrlFetcher()
+@dataclass
+class PDFRenderContext:
+    """Fonts and stylesheets shared by all PDF renders in a thread."""
+
+    font_config: FontConfiguration
+    url_fetcher: WeblateUrlFetcher
+    stylesheets: list[CSS]
+    fonts_css: Path
+    fonts_css_mtime: int
+
+    @classmethod
+    def create(cls) -> PDFRenderContext:
+        fonts_css = finders.find("pdf/fonts.css")
+        if fonts_css is None:
+            raise ValueError("Could not load fonts CSS")
+        path_obj = Path(fonts_css)
+        font_config = FontConfiguration()
+        url_fetcher = WeblateUrlFetcher()
+        # Stat before parsing so that concurrent change triggers reload
+        mtime = path_obj.stat().st_mtime_ns
+        font_style = CSS(
+            filename=fonts_css,
+            font_config=font_config,
+            url_fetcher=url_fetcher,
+        )
+        return cls(
+            font_config=font_config,
+            url_fetcher=url_fetcher,
+            stylesheets=[font_style],
+            fonts_css=path_obj,
+            fonts_css_mtime=mtime,
+        )
+
+    def is_current(self) -> bool:
+        try:
+            return self.fonts_css.stat().st_mtime_ns == self.fonts_css_mtime
+        except FileNotFoundError:
+            return False
+
+
+# FontConfiguration wraps a fontconfig configuration and Pango font map which
+# are not safe to use from several threads at once. Each thread gets its own
+# context instead of serializing all renders with a lock, so threaded workers
+# can still render in parallel at the cost of parsing fonts once per thread.
+RENDER_CONTEXT = threading.local()
+
+
+def get_render_context() -> PDFRenderContext:
+    """
+    Return the PDF render context of the current thread.
+
+    The font configuration is bound to the parsed font stylesheet, so both are
+    rebuilt together once the stylesheet changes on disk.
+    """
+    context: PDFRenderContext | None = getattr(RENDER_CONTEXT, "context", None)
+    if context is None or not context.is_current():
+        context = RENDER_CONTEXT.context = PDFRenderContext.create()
+    return context
 
+
+def reset_render_context() -> None:
+    """Drop the PDF render context of the current thread."""
+    RENDER_CONTEXT.context = None
+
+
+def render_pdf_document(*, html: str) -> Document:
+    context = get_render_context()
     renderer = HTML(
         string=html,
-        url_fetcher=fetcher,
-    )
-    fonts_css = finders.find("pdf/fonts.css")
-    if fonts_css is None:
-        raise ValueError("Could not load fonts CSS")
-    font_style = CSS(
-        filename=fonts_css,
-        font_config=font_config,
-        url_fetcher=fetcher,
+        url_fetcher=context.url_fetcher,
     )
     return renderer.render(
-        stylesheets=[font_style],
-        font_config=font_config,
+        stylesheets=context.stylesheets,
+        font_config=context.font_config,
     )
 
 
-def count_pdf_pages(*, html: str) -> int:
-    return len(render_pdf_document(html=html).pages)
-
-
-def render_pdf(
+def write_pdf_document(
+    document: Document,
     *,
-    html: str,
     output: Path,
     attachments: list[Attachment] | None = None,
     factur_x: bool = False,
 ) -> None:
-    document = render_pdf_document(html=html)
     if factur_x:
         document.metadata.xmp_metadata = [FACTURX_RDF_METADATA.encode("utf-8")]
     if attachments:
@@ -163,3 +241,18 @@ def render_pdf(
         output,
         pdf_variant="pdf/a-3b",
     )
+
+
+def render_pdf(
+    *,
+    html: str,
+    output: Path,
+    attachments: list[Attachment] | None = None,
+    factur_x: bool = False,
+) -> None:
+    write_pdf_document(
+        render_pdf_document(html=html),
+        output=output,
+        attachments=attachments,
+        factur_x=factur_x,
+    )
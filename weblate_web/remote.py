@@ -21,6 +21,7 @@
 from __future__ import annotations
 
 import operator
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import timedelta
 from time import sleep
 from typing import TYPE_CHECKING, Literal, TypedDict
@@ -35,12 +36,15 @@ from django.db.models import Q
 from django.utils import timezone
 from wlc import Weblate, WeblateException
 
+from weblate_web.models import RemoteData
 from weblate_web.payments.models import Customer
 from weblate_web.payments.validators import VAT_VALIDITY_DAYS
 
 if TYPE_CHECKING:
     from datetime import datetime
 
+    from wlc import Project
+
 CONTRIBUTORS_URL = "https://api.github.com/repos/{}/{}/stats/contributors"
 PYPI_URL = "https://pypi.org/pypi/weblate/json"
 WEBLATE_CONTRIBUTORS_URL = CONTRIBUTORS_URL.format("WeblateOrg", "weblate")
@@ -54,6 +58,11 @@ EXCLUDE_USERS = {
 }
 ACTIVITY_URL = "https://hosted.weblate.org/activity/month.json"
 CACHE_TIMEOUT = 72 * 3600
+# How long to serve the stored value before looking at the database again
+STALE_TIMEOUT = 900
+REFRESH_LOCK_TIMEOUT = 600
+RETRY_DELAY = 300
+RETRY_DELAY_MAX = 24 * 3600
 
 
 class PYPIInfo(TypedDict):
@@ -74,113 +83,246 @@ class PYPIInfo(TypedDict):
     yanked_reason: str | None
 
 
-def get_contributors(force: bool = False) -> list:
-    key = "wlweb-contributors"
-    results = cache.get(key)
-    if not force and results is not None:
+class RemoteFetchError(Exception):
+    """Remote data could not be fetched."""
+
+
+class RemoteFetcher:
+    """
+    Remote data fetcher with stale-while-revalidate caching.
+
+    Requests are served from the cache or from the last good value stored in
+    the database, the remote service is only contacted when refreshing (from
+    the background_fetch management command) or when nothing was fetched yet.
+    Concurrent refreshes are prevented by a lock and failures are retried with
+    exponential backoff.
+    """
+
+    key: str
+
+    def fetch(self) -> list:
+        raise NotImplementedError
+
+    def load(self, data: list) -> list:
+        """Restore data from the database representation."""
+        return data
+
+    @property
+    def lock_key(self) -> str:
+        return f"{self.key}-lock"
+
+    def get(self, *, force: bool = False, refresh: bool = False) -> list:
+        if force or refresh:
+            return self.refresh(force=force)
+        results = cache.get(self.key)
+        if results is None:
+            state = RemoteData.objects.filter(key=self.key).first()
+            if state is None or (state.updated is None and not state.data):
+                # Nothing was fetched yet, fetch once within the request, the
+                # refresh lock keeps concurrent requests from doing the same
+                results = self.refresh()
+                cache.add(self.key, results, timeout=STALE_TIMEOUT)
+                return results
+            # Do not block the request on the remote service, serve the last
+            # good value until the data is refreshed
+            results = self.load(state.data)
+            cache.set(self.key, results, timeout=STALE_TIMEOUT)
         return results
-    # Perform request
-    try:
-        response = requests.get(WEBLATE_CONTRIBUTORS_URL, timeout=10)
-    except OSError as error:
-        sentry_sdk.capture_exception(error)
-        response = None
-    # Stats are not yet calculated
-    if response is None or response.status_code != 200:
-        return []
-
-    stats = response.json()
-    # Fill in ranking. This seems to best reflect people effort, but still
-    # is not accurate at all. The problem is that commits stats are
-    # misleading due to high number of commits generated by old Weblate
-    # versions. Additions are heavily biased by adding new translation files.
-    for stat in stats:
-        if stat["author"] and stat["author"]["login"] in EXCLUDE_USERS:
-            stat["rank"] = 0
-            continue
-        stat["rank"] = stat["total"] + sum(
-            week["a"] + week["d"] for week in stat["weeks"]
-        )
 
-    stats.sort(key=lambda x: -x["rank"])
+    def refresh(self, *, force: bool = False) -> list:
+        """
+        Refresh data from the remote service.
 
-    data = stats[:52]
-    cache.set(key, data, timeout=CACHE_TIMEOUT)
-    return data
+        Returns the last good value when the refresh is not possible.
+        """
+        state = RemoteData.objects.get_or_create(key=self.key)[0]
+        if (
+            not force
+            and state.retry_after is not None
+            and state.retry_after > timezone.now()
+        ):
+            return self.load(state.data)
+        if not cache.add(self.lock_key, True, timeout=REFRESH_LOCK_TIMEOUT):
+            # Other worker is refreshing the data
+            return self.load(state.data)
+        try:
+            try:
+                data = self.fetch()
+            except RemoteFetchError:
+                state.failures += 1
+                state.retry_after = timezone.now() + timedelta(
+                    seconds=min(
+                        RETRY_DELAY * 2 ** min(state.failures - 1, 16),
+                        RETRY_DELAY_MAX,
+                    )
+                )
+                state.save(update_fields=["failures", "retry_after"])
+                return self.load(state.data)
+            state.data = data
+            state.updated = timezone.now()
+            state.failures = 0
+            state.retry_after = None
+            state.save()
+            cache.set(self.key, data, timeout=CACHE_TIMEOUT)
+            return data
+        finally:
+            cache.delete(self.lock_key)
 
 
-def get_activity(force: bool = False) -> list:
+class ContributorsFetcher(RemoteFetcher):
+    key = "wlweb-contributors"
+
+    def fetch(self) -> list:
+        try:
+            response = requests.get(WEBLATE_CONTRIBUTORS_URL, timeout=10)
+        except OSError as error:
+            sentry_sdk.capture_exception(error)
+            raise RemoteFetchError from error
+        # Stats are not yet calculated
+        if response.status_code != 200:
+            raise RemoteFetchError(f"Unexpected status: {response.status_code}")
+
+        stats = response.json()
+        # Fill in ranking. This seems to best reflect people effort, but still
+        # is not accurate at all. The problem is that commits stats are
+        # misleading due to high number of commits generated by old Weblate
+        # versions. Additions are heavily biased by adding new translation files.
+        for stat in stats:
+            if stat["author"] and stat["author"]["login"] in EXCLUDE_USERS:
+                stat["rank"] = 0
+                continue
+            stat["rank"] = stat["total"] + sum(
+                week["a"] + week["d"] for week in stat["weeks"]
+            )
+
+        stats.sort(key=lambda x: -x["rank"])
+
+        return stats[:52]
+
+
+class ActivityFetcher(RemoteFetcher):
     key = "wlweb-activity-stats"
-    results = cache.get(key)
-    if not force and results is not None:
-        return results
-    # Perform request
-    try:
-        response = requests.get(ACTIVITY_URL, timeout=10)
-    except OSError as error:
-        sentry_sdk.capture_exception(error)
-        response = None
-    # Stats are not yet calculated
-    if response is None or response.status_code != 200:
-        return []
-
-    stats = response.json()
-    data = stats[-25:]
-    cache.set(key, data, timeout=CACHE_TIMEOUT)
-    return data
-
-
-def get_changes(force: bool = False) -> list:
+
+    def fetch(self) -> list:
+        try:
+            response = requests.get(ACTIVITY_URL, timeout=10)
+        except OSError as error:
+            sentry_sdk.capture_exception(error)
+            raise RemoteFetchError from error
+        # Stats are not yet calculated
+        if response.status_code != 200:
+            raise RemoteFetchError(f"Unexpected status: {response.status_code}")
+
+        stats = response.json()
+        return stats[-25:]
+
+
+class ChangesFetcher(RemoteFetcher):
     key = "wlweb-changes-list"
-    results = cache.get(key)
-    if not force and results is not None:
-        return results
-    try:
-        wlc = Weblate(key=settings.CHANGES_KEY, url=settings.CHANGES_API)
 
-        project_stats = [project.statistics() for project in wlc.list_projects()]
-        stats = [
-            project.get_data()
-            for project in project_stats
-            if project["last_change"] is not None
-        ]
-    except WeblateException as error:
-        sentry_sdk.capture_exception(error)
-        return []
+    @staticmethod
+    def get_project_statistics(project: Project) -> dict | None:
+        """Return project statistics or None if the project has no changes."""
+        stats = project.statistics()
+        if stats["last_change"] is None:
+            return None
+        return stats.get_data()
+
+    def fetch(self) -> list:
+        try:
+            wlc = Weblate(key=settings.CHANGES_KEY, url=settings.CHANGES_API)
+            projects = list(wlc.list_projects())
+        except WeblateException as error:
+            sentry_sdk.capture_exception(error)
+            raise RemoteFetchError from error
+
+        # Fetch statistics concurrently, projects which fail or do not
+        # complete within the time budget are skipped
+        executor = ThreadPoolExecutor(max_workers=settings.CHANGES_CONCURRENCY)
+        try:
+            futures = [
+                executor.submit(self.get_project_statistics, project)
+                for project in projects
+            ]
+            done = wait(futures, timeout=settings.CHANGES_TIME_BUDGET).done
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        stats = []
+        failed = len(futures) - len(done)
+        for future in futures:
+            if future not in done:
+                continue
+            try:
+                result = future.result()
+            except WeblateException as error:
+                sentry_sdk.capture_exception(error)
+                failed += 1
+                continue
+            # Projects without any changes are skipped
+            if result is not None:
+                stats.append(result)
+        if projects and failed == len(projects):
+            raise RemoteFetchError("Could not fetch any project statistics")
+
+        stats.sort(key=operator.itemgetter("last_change"), reverse=True)
 
-    stats.sort(key=operator.itemgetter("last_change"), reverse=True)
+        return stats[:10]
 
-    cache.set(key, stats[:10], timeout=CACHE_TIMEOUT)
-    return stats[:10]
+    def load(self, data: list) -> list:
+        # Timestamps are serialized as strings in the database
+        for item in data:
+            if isinstance(item.get("last_change"), str):
+                item["last_change"] = parse(item["last_change"])
+        return data
 
 
-def get_release(force: bool = False) -> list[PYPIInfo]:
+class ReleaseFetcher(RemoteFetcher):
     key = "wlweb-release-x"
-    results = cache.get(key)
-    if not force and results is not None:
-        return results
-    # Perform request
-    try:
-        response = requests.get(PYPI_URL, timeout=10)
-    except OSError as error:
-        sentry_sdk.capture_exception(error)
-        response = None
-    # Stats are not yet calculated
-    if response is None or response.status_code != 200:
-        return []
-
-    recent: datetime | None = None
-    result: list[PYPIInfo] = []
-    for info in response.json()["releases"].values():
-        if not info:
-            continue
-        timestamp = parse(info[0]["upload_time_iso_8601"])
-        if recent is None or timestamp > recent:
-            recent = timestamp
-            result = info
 
-    cache.set(key, result, timeout=CACHE_TIMEOUT)
-    return result
+    def fetch(self) -> list[PYPIInfo]:
+        try:
+            response = requests.get(PYPI_URL, timeout=10)
+        except OSError as error:
+            sentry_sdk.capture_exception(error)
+            raise RemoteFetchError from error
+        # Stats are not yet calculated
+        if response.status_code != 200:
+            raise RemoteFetchError(f"Unexpected status: {response.status_code}")
+
+        recent: datetime | None = None
+        result: list[PYPIInfo] = []
+        for info in response.json()["releases"].values():
+            if not info:
+                continue
+            timestamp = parse(info[0]["upload_time_iso_8601"])
+            if recent is None or timestamp > recent:
+                recent = timestamp
+                result = info
+
+        return result
+
+
+CONTRIBUTORS_FETCHER = ContributorsFetcher()
+ACTIVITY_FETCHER = ActivityFetcher()
+CHANGES_FETCHER = ChangesFetcher()
+RELEASE_FETCHER = ReleaseFetcher()
+
+
+def get_contributors(force: bool = False, *, refresh: bool = False) -> list:
+    return CONTRIBUTORS_FETCHER.get(force=force, refresh=refresh)
+
+
+def get_activity(force: bool = False, *, refresh: bool = False) -> list:
+    return ACTIVITY_FETCHER.get(force=force, refresh=refresh)
+
+
+def get_changes(force: bool = False, *, refresh: bool = False) -> list:
+    return CHANGES_FETCHER.get(force=force, refresh=refresh)
+
+
+def get_release(force: bool = False, *, refresh: bool = False) -> list[PYPIInfo]:
+    return RELEASE_FETCHER.get(force=force, refresh=refresh)
 
 
 def fetch_vat_info(*, fetch_all: bool = False, delay: int = 30) -> None:
@@ -333,6 +333,9 @@ INVOICES_COPY_PATH: Path | None = None
 AGREEMENTS_PATH = Path(BASE_DIR) / "agreements"
 AGREEMENTS_COPY_PATH: Path | None = None
 AGREEMENTS_SIGNATURE_PATH: Path | None = None
+# Optional filesystem cache for exchange rates, for example
+# Path.home() / ".cache" / "fakturace", rates are stored in the database
+EXCHANGE_RATES_CACHE_DIR: Path | None = None
 
 LOGIN_URL = "/saml2/login/"
 if ci_database:
@@ -343,6 +346,10 @@ REGISTRATION_EMAIL_MATCH = ".*"
 
 CHANGES_API = "https://hosted.weblate.org/api/"
 CHANGES_KEY = ""
+# Number of concurrent project statistics requests
+CHANGES_CONCURRENCY = 8
+# Time limit in seconds for fetching project statistics
+CHANGES_TIME_BUDGET = 120
 
 STORAGE_SSH_HOSTNAME = "u164666-sub5.your-storagebox.de"
 STORAGE_SSH_PORT = 23
@@ -360,6 +367,9 @@ COMPRESS_OFFLINE_CONTEXT = [
     {"LANGUAGE_BIDI": False},
 ]
 
+# Additional Content-Security-Policy sources, for example {"image": ["example.com"]}
+CSP_EXTRA_SOURCES: dict[str, list[str]] = {}
+
 SAML_CSP_HANDLER = ""
 SAML_ATTRIBUTE_MAPPING = {
     "username": ("username",),
@@ -468,6 +478,8 @@ THEPAY_MERCHANT_ID: str
 THEPAY_PASSWORD: str
 THEPAY_SERVER: str
 THEPAY_PROJECT_ID: str
+# Maximal number of kept alive connections to The Pay API
+THEPAY_POOL_SIZE: int = 10
 
 # API authentication
 PAYMENT_SECRET: str
@@ -7,6 +7,9 @@ from datetime import date, datetime, timedelta
 from decimal import Decimal
 from io import BytesIO, StringIO
 from pathlib import Path
+from tempfile import TemporaryDirectory
+from threading import Barrier, Lock
+from time import sleep
 from types import SimpleNamespace
 from typing import TYPE_CHECKING, Any, Literal, cast
 from unittest.mock import PropertyMock, patch
@@ -19,15 +22,17 @@ from django.conf import settings
 from django.contrib.auth.models import User
 from django.core import mail
 from django.core.cache import cache
-from django.core.exceptions import ValidationError
+from django.core.exceptions import ImproperlyConfigured, ValidationError
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.management import call_command
 from django.core.signing import dumps
-from django.db import IntegrityError, transaction
+from django.db import IntegrityError, connection, transaction
 from django.db.models.deletion import RestrictedError
+from django.http import HttpResponse, StreamingHttpResponse
+from django.template import Context, Template
 from django.template.loader import render_to_string
 from django.test import RequestFactory, SimpleTestCase, TestCase
-from django.test.utils import override_settings
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.translation import override
@@ -39,19 +44,28 @@ from weblate_web.crm.models import Interaction
 from weblate_web.invoices.models import Discount, Invoice, InvoiceCategory, InvoiceKind
 from weblate_web.payments.models import Customer, CustomerFollowUp, Payment
 
+from .context_processors import get_language_urls
 from .exchange_rates import BTC_RATE_URL, ExchangeRates, UncachedExchangeRates
 from .hetzner import generate_random_password
 from .management.commands.backups_sync import Command as BackupsSyncCommand
 from .management.commands.recurring_payments import Command as RecurringPaymentsCommand
 from .management.commands.sync_hosted_users import USER_SYNC_RESPONSE_SALT
-from .middleware import SecurityMiddleware
+from .middleware import (
+    LocalizedDocumentationMiddleware,
+    SecurityMiddleware,
+    build_csp_template,
+)
 from .models import (
+    DONATE_LINKS_CACHE_KEY,
+    HOSTING_PACKAGES_CACHE_KEY,
     REWARD_LEVELS,
     DiscoveryActivation,
+    ExchangeRate,
     ExternalSyncState,
     Package,
     PackageCategory,
     Post,
+    RemoteData,
     Report,
     SamlIdentity,
     Service,
@@ -61,6 +75,7 @@ from .models import (
     add_subscription_past_payments,
     get_donation_package,
     get_donation_reward_package_name,
+    get_hosting_packages,
     is_pending_discovery_activation,
     normalize_site_url_for_lock,
     process_payment,
@@ -769,6 +784,35 @@ class ViewTestCase(PostTestCase):
         response = self.client.get("/en/")
         self.assertContains(response, "yearly")
 
+    def test_index_queries(self) -> None:
+        # Warm up the cache
+        self.client.get("/en/")
+        with self.assertNumQueries(0):
+            response = self.client.get("/en/")
+        self.assertContains(response, "yearly")
+
+    def test_index_queries_cold(self) -> None:
+        cache.delete_many([DONATE_LINKS_CACHE_KEY, HOSTING_PACKAGES_CACHE_KEY])
+        # Only hosting packages are used on the home page
+        with self.assertNumQueries(1):
+            self.client.get("/en/")
+
+    def test_hosting_packages_invalidation(self) -> None:
+        packages = get_hosting_packages()
+        self.assertEqual(len(packages), 6)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_hosting_packages(), packages)
+
+        package = packages[0]
+        package.price += 1
+        package.save(update_fields=["price"])
+        self.assertIsNone(cache.get(HOSTING_PACKAGES_CACHE_KEY))
+        self.assertIn(package, get_hosting_packages())
+        self.assertEqual(
+            {item.price for item in get_hosting_packages() if item == package},
+            {package.price},
+        )
+
     def test_index_link_headers(self) -> None:
         response = self.client.get("/en/")
         links = response["Link"]
@@ -850,10 +894,63 @@ class ViewTestCase(PostTestCase):
         self.assertContains(response, "https://docs.weblate.org/")
         self.assertContains(response, "https://github.com/WeblateOrg/weblate")
 
+    def test_language_urls(self) -> None:
+        self.create_post()
+        response = self.client.get("/cs/news/archive/testpost/")
+        self.assertContains(
+            response,
+            '<link rel="alternate" hreflang="de" href="/de/news/archive/testpost/" />',
+            html=True,
+        )
+        self.assertEqual(response.context["canonical_url"], "/news/archive/testpost/")
+        self.assertEqual(
+            len(response.context["language_urls"]), len(settings.LANGUAGES)
+        )
+
+        get_language_urls.cache_clear()
+        self.client.get("/cs/news/archive/testpost/")
+        self.client.get("/de/news/archive/testpost/")
+        cache_info = get_language_urls.cache_info()
+        self.assertEqual(cache_info.misses, 1)
+        self.assertEqual(cache_info.hits, 1)
+
     def test_localized_docs(self) -> None:
         response = self.client.get("/uk/contribute/")
         self.assertContains(response, "https://docs.weblate.org/uk/latest/contributing")
 
+    def test_localized_docs_streaming(self) -> None:
+        def get_response(request):
+            return StreamingHttpResponse(
+                [
+                    b"<a href='https://docs.weblate.org/e",
+                    b"n/latest/'>docs</a> https://docs.weblate.org/en",
+                    b"/latest/ https://docs.weblate.org/",
+                ],
+                content_type="text/html; charset=utf-8",
+            )
+
+        request = RequestFactory().get("/uk/")
+        with override("uk"):
+            response = LocalizedDocumentationMiddleware(get_response)(request)
+            content = b"".join(response.streaming_content)
+        self.assertEqual(
+            content,
+            b"<a href='https://docs.weblate.org/uk/latest/'>docs</a> "
+            b"https://docs.weblate.org/uk/latest/ https://docs.weblate.org/",
+        )
+
+    def test_localized_docs_unchanged(self) -> None:
+        original = HttpResponse(b"<p>No documentation links</p>")
+
+        def get_response(request):
+            return original
+
+        request = RequestFactory().get("/uk/")
+        with override("uk"):
+            response = LocalizedDocumentationMiddleware(get_response)(request)
+        self.assertIs(response, original)
+        self.assertEqual(response.content, b"<p>No documentation links</p>")
+
     @responses.activate
     def test_about(self) -> None:
         responses.add(
@@ -915,6 +1012,57 @@ class ViewTestCase(PostTestCase):
         self.assertContains(response, "test-event-id", status_code=500)
         last_event_id.assert_called_once_with()
 
+    @override_settings(DEBUG=False, CSP_EXTRA_SOURCES={"image": ["example.com"]})
+    def test_csp_extra_sources(self) -> None:
+        def get_response(request):
+            return HttpResponse()
+
+        request = RequestFactory().get("/en/about/")
+        response = SecurityMiddleware(get_response)(request)
+        policy = response["Content-Security-Policy"]
+
+        self.assertIn(
+            "img-src 'self' data: hosted.weblate.org blog.cihar.com gate.thepay.cz "
+            "*.githubusercontent.com example.com;",
+            policy,
+        )
+        self.assertIn(
+            f"script-src 'self' 'nonce-{request.csp_nonce}' "
+            "browser.sentry-cdn.com de.sentry.io;",
+            policy,
+        )
+
+    @override_settings(DEBUG=False, CSP_EXTRA_SOURCES={"invalid": ["example.com"]})
+    def test_csp_extra_sources_invalid(self) -> None:
+        with self.assertRaises(ImproperlyConfigured):
+            SecurityMiddleware()
+
+    @override_settings(DEBUG=False)
+    def test_security_middleware_template_reused(self) -> None:
+        def get_response(request):
+            return HttpResponse()
+
+        with patch(
+            "weblate_web.middleware.build_csp_template", wraps=build_csp_template
+        ) as build:
+            middleware = SecurityMiddleware(get_response)
+            test_requests = [RequestFactory().get("/en/about/") for _unused in range(3)]
+            results = [middleware(request) for request in test_requests]
+
+        # The policy is built once, only the nonce changes per request
+        build.assert_called_once_with(settings.CSP_EXTRA_SOURCES)
+        self.assertEqual(len({request.csp_nonce for request in test_requests}), 3)
+        for request, response in zip(test_requests, results, strict=True):
+            self.assertEqual(
+                response["Content-Security-Policy"],
+                f"{middleware.csp_prefix}{request.csp_nonce}{middleware.csp_suffix}",
+            )
+            self.assertIn(
+                f"'nonce-{request.csp_nonce}'", response["Content-Security-Policy"]
+            )
+            self.assertEqual(response["X-XSS-Protection"], "1; mode=block")
+            self.assertEqual(response["Permissions-Policy"], "interest-cohort=()")
+
     @responses.activate
     def test_activity(self) -> None:
         responses.add(responses.GET, ACTIVITY_URL, body=TEST_ACTIVITY.read_text())
@@ -940,6 +1088,25 @@ class ViewTestCase(PostTestCase):
         response = self.client.get("/sitemap-news.xml")
         self.assertContains(response, "testpost")
 
+    def test_sitemap_language_urls(self) -> None:
+        # The sitemap view gets unhashable sitemaps dict as an argument
+        response = self.client.get("/sitemap.xml")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            len(response.context["language_urls"]), len(settings.LANGUAGES)
+        )
+
+    def test_language_urls_not_shared(self) -> None:
+        response = self.client.get("/en/features/")
+        response.context["language_urls"][0]["url"] = "/modified/"
+        response.context["language_urls"].clear()
+
+        response = self.client.get("/en/features/")
+        self.assertEqual(
+            len(response.context["language_urls"]), len(settings.LANGUAGES)
+        )
+        self.assertNotEqual(response.context["language_urls"][0]["url"], "/modified/")
+
     def test_sitemaps(self) -> None:
         # Get root sitemap
         response = self.client.get("/sitemap.xml")
@@ -3019,6 +3186,44 @@ class APITest(UserTestCase):  # ruff:ignore[too-many-public-methods]
             {initial_payment.pk},
         )
 
+    def test_hosted_payment_billing_index(self) -> None:
+        customer = Customer.objects.create(user_id=-1, origin=PAYMENTS_ORIGIN)
+        payment = Payment.objects.create(
+            customer=customer,
+            amount=100,
+            description="Hosted payment",
+            extra={"billing": 42},
+            end=date(2026, 1, 1),
+        )
+        older = Payment.objects.create(
+            customer=customer,
+            amount=100,
+            description="Older hosted payment",
+            extra={"billing": 42},
+            end=date(2025, 1, 1),
+        )
+        other = Payment.objects.create(
+            customer=customer,
+            amount=100,
+            description="Other payment",
+            extra={"billing": "42"},
+            end=date(2027, 1, 1),
+        )
+        self.assertEqual(payment.billing, 42)
+        self.assertIsNone(other.billing)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(list(Payment.objects.for_billing(42)), [older, payment])
+
+        other.extra = {"billing": 42}
+        other.save(update_fields=["extra"])
+        other.refresh_from_db()
+        self.assertEqual(other.billing, 42)
+
+        payment.extra = {}
+        payment.save(update_fields=["extra"])
+        self.assertEqual(list(Payment.objects.for_billing(42)), [older, other])
+
     def test_hosted_invalid(self) -> None:
         response = self.client.post("/api/hosted/", {"payload": dumps({}, key="dummy")})
         self.assertEqual(response.status_code, 400)
@@ -4984,6 +5189,173 @@ class ServiceTest(FakturaceTestCase):
             },
         )
 
+    def test_subscription_index(self) -> None:
+        service = self.create_service(package="test:test-1-m")
+        for days, name in enumerate(("basic", "backup", "extended"), start=1):
+            # Only backup is missing in the packages created by create_service
+            service.subscription_set.create(
+                package=Package.objects.get_or_create(
+                    name=name, defaults={"verbose": name.title(), "price": 0}
+                )[0],
+                expires=timezone.now() + timedelta(days=days),
+            )
+
+        service = Service.objects.with_subscription_index().get(pk=service.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                [
+                    subscription.package.name
+                    for subscription in service.support_subscriptions
+                ],
+                ["test:test-1-m", "extended", "basic"],
+            )
+            self.assertEqual(len(service.hosted_subscriptions), 1)
+            self.assertEqual(len(service.backup_subscriptions), 1)
+            self.assertEqual(service.shared_subscriptions, [])
+            self.assertEqual(service.package_kind, "Dedicated service")
+            self.assertTrue(service.has_paid_backup())
+
+        service = Service.objects.get(pk=service.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(service.extended_subscriptions), 1)
+            self.assertEqual(len(service.enabled_subscriptions), 4)
+
+    def test_bulk_update_status(self) -> None:
+        hosted = self.create_service(package="test:test-1-m")
+        package = Package.objects.get(name="test:test-1-m")
+        package.limit_hosted_strings = 1000
+        package.save(update_fields=["limit_hosted_strings"])
+        support = Service.objects.create(customer=hosted.customer)
+        support.subscription_set.create(
+            package=Package.objects.get(name="extended"),
+            expires=timezone.now() + timedelta(days=1),
+        )
+        expired = Service.objects.create(customer=hosted.customer)
+        expired.subscription_set.create(
+            package=Package.objects.get(name="premium"),
+            expires=timezone.now() - timedelta(days=1),
+        )
+        Service.objects.update(status="basic")
+
+        with self.assertNumQueries(4):
+            backup = Service.objects.customer_services().update_status()
+
+        self.assertEqual(backup, [hosted])
+        self.assertEqual(
+            dict(Service.objects.values_list("pk", "status")),
+            {hosted.pk: "hosted", support.pk: "extended", expired.pk: "community"},
+        )
+        hosted.refresh_from_db()
+        self.assertEqual(hosted.limit_hosted_strings, 1000)
+
+    @staticmethod
+    def create_renewal_fixture(
+        customer: Customer, package: Package, count: int
+    ) -> None:
+        expires = timezone.now() + timedelta(days=1)
+        services = Service.objects.bulk_create(
+            Service(customer=customer) for _i in range(count)
+        )
+        payments = Payment.objects.bulk_create(
+            Payment(
+                customer=customer,
+                amount=100,
+                description="Test payment",
+                backend="pay",
+                recurring="y",
+                state=Payment.PROCESSED,
+            )
+            for _i in range(count)
+        )
+        Subscription.objects.bulk_create(
+            Subscription(
+                service=service, package=package, payment=payment, expires=expires
+            )
+            for service, payment in zip(services, payments, strict=True)
+        )
+        Payment.objects.bulk_create(
+            Payment(
+                customer=customer,
+                amount=100,
+                description="Test payment",
+                backend="pay",
+                state=Payment.REJECTED,
+                repeat=payment,
+            )
+            for payment in payments
+        )
+
+    def run_renewals(self) -> tuple[int, int]:
+        with (
+            patch.object(RecurringPaymentsCommand, "peform_payment") as perform_payment,
+            CaptureQueriesContext(connection) as queries,
+        ):
+            RecurringPaymentsCommand.handle_subscriptions()
+            RecurringPaymentsCommand.notify_expiry()
+        return len(queries), perform_payment.call_count
+
+    def test_recurring_payments_query_count(self) -> None:
+        service = self.create_service()
+        subscription = service.subscription_set.get()
+
+        self.create_renewal_fixture(service.customer, subscription.package, 10)
+        queries, performed = self.run_renewals()
+        self.assertEqual(performed, 10)
+
+        self.create_renewal_fixture(service.customer, subscription.package, 9990)
+        self.assertEqual(self.run_renewals(), (queries, 10000))
+
+    def test_recurring_payments_recheck_obsolete_after_renewal(self) -> None:
+        service = self.create_service(years=0, days=1)
+        subscription = service.subscription_set.get()
+        service.subscription_set.create(
+            package=Package.objects.get(name="basic"),
+            expires=subscription.expires,
+            payment=create_payment(
+                user=self.create_user(),
+                customer=service.customer,
+                state=Payment.PROCESSED,
+            )[0],
+        )
+
+        def renew(payment: Payment, rejected_count: int, **kwargs) -> None:
+            Subscription.objects.filter(pk=kwargs["extra"]["subscription"]).update(
+                expires=timezone.now() + timedelta(days=365)
+            )
+
+        with patch.object(
+            RecurringPaymentsCommand, "peform_payment", side_effect=renew
+        ) as perform_payment:
+            RecurringPaymentsCommand.handle_subscriptions()
+
+        # Whichever is renewed first makes the other one obsolete
+        perform_payment.assert_called_once()
+        self.assert_notifications()
+
+    def test_recurring_payments_without_recurring_payment(self) -> None:
+        service = self.create_service(years=0, days=-2, recurring="")
+        donation = self.create_donation(years=0, days=-2)
+        one_time_donation = self.create_donation(years=0, days=-2, recurring="")
+        donation_subscription = donation.subscription_set.get()
+
+        with patch.object(
+            RecurringPaymentsCommand, "peform_payment"
+        ) as perform_payment:
+            RecurringPaymentsCommand.handle_recurring_payments()
+
+        perform_payment.assert_called_once_with(
+            donation_subscription.payment_obj,
+            0,
+            amount=donation.get_donation_amount(),
+            recurring="y",
+            end_date=donation_subscription.expires,
+            extra={"donation_service": donation.pk},
+        )
+        self.assert_notifications(*["Your expired payment on weblate.org"] * 4)
+        self.assertTrue(service.subscription_set.get().enabled)
+        self.assertTrue(donation.subscription_set.get().enabled)
+        self.assertFalse(one_time_donation.subscription_set.get().enabled)
+
     @responses.activate
     def test_hosted_pay(self) -> None:
         mock_vies()
@@ -5463,6 +5835,42 @@ class CommandsTestCase(FakturaceTestCase):
             self.assertEqual(buffer.getvalue(), "")
 
 
+@dataclass
+class StandInStatistics:
+    data: dict[str, Any]
+
+    def __getitem__(self, key: str) -> Any:
+        return self.data[key]
+
+    def get_data(self) -> dict[str, Any]:
+        return self.data
+
+
+@dataclass
+class StandInProject:
+    """Stand-in for a hosted Weblate project with slow statistics API."""
+
+    name: str
+    delay: float = 0.05
+    error: Exception | None = None
+    changed: bool = True
+
+    def statistics(self) -> StandInStatistics:
+        sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return StandInStatistics(
+            {
+                "name": self.name,
+                "last_change": (
+                    f"2024-06-{int(self.name[-2:]) + 1:02d}T00:00:00Z"
+                    if self.changed
+                    else None
+                ),
+            }
+        )
+
+
 class BackgroundFetchTestCase(FakturaceTestCase):
     """Tests for background_fetch management command and underlying code."""
 
@@ -5561,6 +5969,86 @@ class BackgroundFetchTestCase(FakturaceTestCase):
         result = get_release(force=False)
         self.assertEqual(len(result), 1)
 
+    @responses.activate
+    def test_get_release_stale(self) -> None:
+        release = [{"filename": "Weblate-5.0.tar.gz"}]
+        RemoteData.objects.create(key="wlweb-release-x", data=release)
+        cache.delete("wlweb-release-x")
+        # Request never contacts the remote service
+        self.assertEqual(get_release(), release)
+        self.assertEqual(len(responses.calls), 0)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_release(), release)
+
+    @responses.activate
+    def test_get_release_initial(self) -> None:
+        cache.delete("wlweb-release-x")
+        responses.add(responses.GET, PYPI_URL, status=500)
+        # Nothing is stored, so the request fetches the data once
+        self.assertEqual(get_release(), [])
+        self.assertEqual(len(responses.calls), 1)
+        # Failure is not retried by other requests
+        self.assertEqual(get_release(), [])
+        self.assertEqual(len(responses.calls), 1)
+
+        cache.delete("wlweb-release-x")
+        RemoteData.objects.all().delete()
+        release = [{"filename": "Weblate-5.0.tar.gz"}]
+        responses.replace(
+            responses.GET,
+            PYPI_URL,
+            json={
+                "releases": {
+                    "5.0": [
+                        {**release[0], "upload_time_iso_8601": "2024-01-01T00:00:00Z"}
+                    ]
+                }
+            },
+        )
+        self.assertEqual(get_release()[0]["filename"], "Weblate-5.0.tar.gz")
+        self.assertEqual(len(responses.calls), 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_release()[0]["filename"], "Weblate-5.0.tar.gz")
+
+    @responses.activate
+    def test_get_release_initial_locked(self) -> None:
+        cache.delete("wlweb-release-x")
+        cache.add("wlweb-release-x-lock", True)
+        self.addCleanup(cache.delete, "wlweb-release-x-lock")
+        # Other worker is fetching the data
+        self.assertEqual(get_release(), [])
+        self.assertEqual(len(responses.calls), 0)
+
+    @responses.activate
+    def test_get_release_backoff(self) -> None:
+        release = [{"filename": "Weblate-5.0.tar.gz"}]
+        RemoteData.objects.create(key="wlweb-release-x", data=release)
+        responses.add(responses.GET, PYPI_URL, status=500)
+
+        self.assertEqual(get_release(refresh=True), release)
+        state = RemoteData.objects.get(key="wlweb-release-x")
+        self.assertEqual(state.failures, 1)
+        self.assertIsNotNone(state.retry_after)
+
+        # Retry is postponed
+        get_release(refresh=True)
+        self.assertEqual(len(responses.calls), 1)
+
+        # Unless forced
+        self.assertEqual(get_release(force=True), release)
+        self.assertEqual(len(responses.calls), 2)
+        state.refresh_from_db()
+        self.assertEqual(state.failures, 2)
+
+    @responses.activate
+    def test_get_release_locked(self) -> None:
+        cache.add("wlweb-release-x-lock", True)
+        try:
+            self.assertEqual(get_release(force=True), [])
+        finally:
+            cache.delete("wlweb-release-x-lock")
+        self.assertEqual(len(responses.calls), 0)
+
     def test_get_changes(self) -> None:
         mock_stat_data = {
             "last_change": "2024-06-01T00:00:00Z",
@@ -5630,6 +6118,69 @@ class BackgroundFetchTestCase(FakturaceTestCase):
             result = get_changes(force=True)
         self.assertEqual(result, [])
 
+    def test_get_changes_concurrent(self) -> None:
+        projects = [StandInProject(f"Project {i:02d}", delay=0) for i in range(20)]
+        workers = settings.CHANGES_CONCURRENCY
+        # The first round of requests can only pass once all workers are busy
+        barrier = Barrier(workers, timeout=10)
+        lock = Lock()
+        started = in_flight = peak = 0
+        statistics = StandInProject.statistics
+
+        def concurrent_statistics(project: StandInProject) -> StandInStatistics:
+            nonlocal started, in_flight, peak
+            with lock:
+                started += 1
+                first_round = started <= workers
+                in_flight += 1
+                peak = max(peak, in_flight)
+            try:
+                if first_round:
+                    barrier.wait()
+                return statistics(project)
+            finally:
+                with lock:
+                    in_flight -= 1
+
+        with (
+            patch("weblate_web.remote.Weblate") as mock_weblate,
+            patch.object(StandInProject, "statistics", concurrent_statistics),
+        ):
+            mock_weblate.return_value.list_projects.return_value = projects
+            result = get_changes(force=True)
+        self.assertEqual(len(result), 10)
+        self.assertEqual(result[0]["name"], "Project 19")
+        self.assertEqual(started, len(projects))
+        self.assertEqual(peak, workers)
+
+    @override_settings(CHANGES_TIME_BUDGET=0.5)
+    def test_get_changes_partial(self) -> None:
+        projects = [
+            StandInProject("Project 01"),
+            StandInProject("Project 02", error=WeblateException("Failed")),
+            StandInProject("Project 03", delay=2),
+        ]
+        with patch("weblate_web.remote.Weblate") as mock_weblate:
+            mock_weblate.return_value.list_projects.return_value = projects
+            result = get_changes(force=True)
+        self.assertEqual([item["name"] for item in result], ["Project 01"])
+
+    def test_get_changes_no_recent_changes(self) -> None:
+        RemoteData.objects.create(key="wlweb-changes-list", data=[{"name": "Old"}])
+        projects = [StandInProject("Project 01", changed=False)]
+        with patch("weblate_web.remote.Weblate") as mock_weblate:
+            mock_weblate.return_value.list_projects.return_value = projects
+            result = get_changes(force=True)
+        self.assertEqual(result, [])
+
+    def test_get_changes_all_failed(self) -> None:
+        RemoteData.objects.create(key="wlweb-changes-list", data=[{"name": "Old"}])
+        projects = [StandInProject("Project 01", error=WeblateException("Failed"))]
+        with patch("weblate_web.remote.Weblate") as mock_weblate:
+            mock_weblate.return_value.list_projects.return_value = projects
+            result = get_changes(force=True)
+        self.assertEqual(result, [{"name": "Old"}])
+
     def test_get_changes_caching(self) -> None:
         mock_stat_data = {
             "last_change": "2024-06-01T00:00:00Z",
@@ -5847,6 +6398,211 @@ class ExchangeRatesTestCase(SimpleTestCase):
             UncachedExchangeRates.get("EUR", date(2000, 1, 7))
 
 
+class ExchangeRatesStoreTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        for cache_dict in (
+            ExchangeRates.datacache,
+            ExchangeRates.btc_datacache,
+            ExchangeRates.conversion_datacache,
+        ):
+            patcher = patch.dict(cache_dict, clear=True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(cache.clear)
+
+    def mock_rates(self, date: str, valid_for: str) -> None:
+        responses.get(
+            f"https://api.cnb.cz/cnbapi/exrates/daily?date={date}",
+            json={
+                "rates": [
+                    {**item, "validFor": valid_for} for item in RATES_JSON["rates"]
+                ]
+            },
+        )
+
+    @responses.activate
+    def test_stored(self):
+        responses.get(
+            "https://api.cnb.cz/cnbapi/exrates/daily?date=2000-01-01",
+            json=RATES_JSON,
+        )
+        self.assertEqual(ExchangeRates.get("EUR", date(2000, 1, 1)), Decimal("22.222"))
+        self.assertEqual(
+            ExchangeRate.objects.get(date=date(2000, 1, 1)).rates["EUR"], "22.222"
+        )
+
+        # Other processes load the rates from the database
+        ExchangeRates.datacache.clear()
+        responses.reset()
+        self.assertEqual(ExchangeRates.get("USD", date(2000, 1, 1)), Decimal("23.048"))
+
+    def test_preload(self):
+        ExchangeRate.objects.bulk_create(
+            ExchangeRate(
+                date=date(2000, 1, day),
+                rates={"EUR": str(20 + day), "BTC": "1000000"},
+            )
+            for day in range(1, 4)
+        )
+        with self.assertNumQueries(1):
+            ExchangeRates.preload(date(2000, 1, 1), date(2000, 1, 31))
+        with self.assertNumQueries(0):
+            for day in range(1, 4):
+                self.assertEqual(
+                    ExchangeRates.get("EUR", date(2000, 1, day)), Decimal(20 + day)
+                )
+                self.assertEqual(
+                    ExchangeRates.get("BTC", date(2000, 1, day)), Decimal(1_000_000)
+                )
+
+    @responses.activate
+    def test_weekend(self):
+        # 2000-01-08 and 2000-01-09 is a weekend
+        self.mock_rates("2000-01-09", "2000-01-07")
+        ExchangeRates.resolve([date(2000, 1, 7), date(2000, 1, 8), date(2000, 1, 9)])
+        self.assertEqual(len(responses.calls), 1)
+        stored = dict(
+            ExchangeRate.objects.filter(
+                date__range=(date(2000, 1, 7), date(2000, 1, 9))
+            ).values_list("date", "rates")
+        )
+        self.assertEqual(
+            set(stored), {date(2000, 1, 7), date(2000, 1, 8), date(2000, 1, 9)}
+        )
+        # Rates published for Friday are used for the weekend
+        self.assertEqual(stored[date(2000, 1, 8)], stored[date(2000, 1, 7)])
+        self.assertEqual(stored[date(2000, 1, 9)], stored[date(2000, 1, 7)])
+
+        # Other processes do not need to query for the weekend
+        ExchangeRates.datacache.clear()
+        self.assertEqual(ExchangeRates.get("EUR", date(2000, 1, 8)), Decimal("22.222"))
+        self.assertEqual(len(responses.calls), 1)
+
+    @responses.activate
+    def test_weekend_merges_stored_btc(self):
+        # BTC rate stored by other process, not loaded in this one
+        ExchangeRate.objects.create(date=date(2000, 1, 7), rates={"BTC": "1000000"})
+        self.mock_rates("2000-01-08", "2000-01-07")
+        ExchangeRates.resolve([date(2000, 1, 8)])
+        stored = ExchangeRate.objects.get(date=date(2000, 1, 7)).rates
+        self.assertEqual(stored["BTC"], "1000000")
+        self.assertEqual(stored["EUR"], "22.222")
+
+        # Other processes do not need to download the rates again
+        ExchangeRates.datacache.clear()
+        self.assertEqual(ExchangeRates.get("EUR", date(2000, 1, 7)), Decimal("22.222"))
+        self.assertEqual(len(responses.calls), 1)
+
+    @responses.activate
+    def test_missing(self):
+        self.mock_rates("2000-01-01", "2000-01-01")
+        responses.get(
+            "https://api.cnb.cz/cnbapi/exrates/daily?date=2000-01-02",
+            json={"rates": []},
+        )
+        self.assertEqual(ExchangeRates.get("EUR", date(2000, 1, 2)), Decimal("22.222"))
+        self.assertEqual(len(responses.calls), 2)
+
+        # Missing date is remembered
+        self.assertEqual(ExchangeRates.get("EUR", date(2000, 1, 2)), Decimal("22.222"))
+        self.assertEqual(len(responses.calls), 2)
+
+    @responses.activate
+    def test_server_error_not_remembered(self):
+        self.mock_rates("2000-01-01", "2000-01-01")
+        responses.get(
+            "https://api.cnb.cz/cnbapi/exrates/daily?date=2000-01-02",
+            status=500,
+        )
+        self.assertEqual(ExchangeRates.get("EUR", date(2000, 1, 2)), Decimal("22.222"))
+        self.assertEqual(len(responses.calls), 2)
+        self.assertFalse(ExchangeRates.is_missing("EUR", "2000-01-02"))
+
+        # The date is downloaded again once the service recovers
+        responses.replace(
+            responses.GET,
+            "https://api.cnb.cz/cnbapi/exrates/daily?date=2000-01-02",
+            json=RATES_JSON,
+        )
+        ExchangeRates.resolve([date(2000, 1, 2)])
+        self.assertEqual(len(responses.calls), 3)
+        self.assertEqual(
+            ExchangeRate.objects.get(date=date(2000, 1, 2)).rates["EUR"], "22.222"
+        )
+
+    @responses.activate
+    def test_today_not_final(self):
+        today = timezone.now().date()
+        yesterday = today - timedelta(days=1)
+        self.mock_rates(today.isoformat(), yesterday.isoformat())
+        self.assertEqual(ExchangeRates.get("EUR", today), Decimal("22.222"))
+        # Rates for today can be published later
+        self.assertFalse(ExchangeRate.objects.filter(date=today).exists())
+        self.assertTrue(ExchangeRate.objects.filter(date=yesterday).exists())
+        self.assertEqual(ExchangeRates.get("EUR", today), Decimal("22.222"))
+        self.assertEqual(len(responses.calls), 1)
+
+    def test_convert_from_eur(self):
+        rate_date = date(2000, 1, 1)
+        rates = {
+            "EUR": Decimal("24.321"),
+            "USD": Decimal("21.987"),
+            "GBP": Decimal("28.123"),
+        }
+        ExchangeRates.datacache[rate_date.isoformat()] = rates
+        for currency in ("CZK", "USD", "GBP"):
+            for amount in (1, 19, Decimal("42.50"), 1000):
+                self.assertEqual(
+                    ExchangeRates.convert_from_eur(amount, currency, rate_date),
+                    round(
+                        Decimal(amount)
+                        * Decimal("1.1")
+                        * rates["EUR"]
+                        / rates.get(currency, Decimal(1)),
+                        0,
+                    ),
+                )
+        # The conversion table is shared with other processes
+        self.assertIsNotNone(cache.get("exchange-rates-conversion-2000-01-01"))
+
+    def test_price_format_convert_cached(self):
+        ExchangeRates.datacache[timezone.now().date().isoformat()] = {
+            "EUR": Decimal("24.321"),
+            "USD": Decimal("21.987"),
+            "GBP": Decimal("28.123"),
+        }
+        template = Template(
+            "{% load prices %}"
+            "{% for price in prices %}{{ price|price_format_convert:currency }}"
+            "{% endfor %}"
+        )
+        prices = [Decimal(price) for price in range(10, 2000, 10)]
+
+        for currency in ("CZK", "USD", "GBP"):
+            context = Context({"prices": prices, "currency": currency})
+            expected = template.render(context)
+            # Further renders use the cached conversion table
+            with self.assertNumQueries(0):
+                for _unused in range(3):
+                    self.assertEqual(template.render(context), expected)
+
+    @responses.activate
+    def test_file_fallback(self):
+        with TemporaryDirectory() as tempdir:
+            Path(tempdir, "rates-2000-01-01").write_text(
+                json.dumps({"EUR": "25.5", "USD": 22.5})
+            )
+            with override_settings(EXCHANGE_RATES_CACHE_DIR=Path(tempdir)):
+                self.assertEqual(
+                    ExchangeRates.get("EUR", date(2000, 1, 1)), Decimal("25.5")
+                )
+        self.assertEqual(
+            ExchangeRate.objects.get(date=date(2000, 1, 1)).rates,
+            {"EUR": "25.5", "USD": "22.5"},
+        )
+
+
 class StorageBoxTestCase(FakturaceTestCase):
     def test_password_is_ascii_and_within_byte_limit(self):
         password = generate_random_password()
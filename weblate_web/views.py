@@ -261,12 +261,7 @@ def api_hosted(request: HttpRequest) -> JsonResponse:
 
     billing_id: int = payload["billing"]
 
-    # TODO: This is temporary hack for payments migration period
-    payments = [
-        payment
-        for payment in Payment.objects.order_by("end").iterator()
-        if payment.extra.get("billing", -1) == billing_id
-    ]
+    payments = list(Payment.objects.for_billing(billing_id))
 
     # Get/create service for this billing
     try:
@@ -1424,12 +1419,14 @@ class UserView(TemplateView):
         data = super().get_context_data(**kwargs)
         data["user_services"] = [
             prepare_service_for_render(service)
-            for service in Service.objects.customer_services().filter(
-                customer__owners=self.request.user,
-            )
+            for service in Service.objects.customer_services()
+            .filter(customer__owners=self.request.user)
+            .with_subscription_index()
         ]
-        data["user_donations"] = Service.objects.donations().filter(
-            customer__owners=self.request.user,
+        data["user_donations"] = (
+            Service.objects.donations()
+            .filter(customer__owners=self.request.user)
+            .with_subscription_index()
         )
         return data
 